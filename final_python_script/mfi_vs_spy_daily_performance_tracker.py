@@ -3,10 +3,14 @@ import time
 import pandas as pd
 import numpy as np
 import datetime
-import yfinance as yf
 import pandas_market_calendars as mcal
 from bokeh.plotting import figure, output_file, show
 from bokeh.models import ColumnDataSource, DatetimeTickFormatter
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data, get_benchmark
+from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+from portfolio_tracker.helper_functions.price_cache import PriceCache
+from portfolio_tracker.helper_functions.price_providers import YFinanceProvider
+from portfolio_tracker.helper_functions.incremental_update import IncrementalState
 
 
 # Step 1 — Grabbing the Data
@@ -29,47 +33,6 @@ def create_market_cal(stocks_start, stocks_end):
     return market_cal
 
 
-def get_data(stocks, start, end):
-    """
-    Takes an array of stock tickers along with a start and end date, and then grabs the data using the yfinance library.
-    You’ll notice the end date parameter includes a timedelta shift, this is because yfinance is exclusive of the end
-    date you provide. Since we don’t want to remember this caveat when setting our parameters, we’ll shift the date+1
-    here using timedelta.
-    :param stocks:
-    :param start:
-    :param end:
-    :return:
-    """
-
-    def data(ticker):
-        """
-        Gets the data of the given ticker
-        :param ticker: Unique Stock Code
-        :return:
-        """
-        df = yf.download(ticker, start=start, end=(end + datetime.timedelta(days=1)))
-        df['symbol'] = ticker
-        df.index = pd.to_datetime(df.index)
-        return df
-
-    datas = map(data, stocks)
-    return pd.concat(datas, keys=stocks, names=['Ticker', 'Date'], sort=True)
-
-
-def get_benchmark(benchmark, start, end):
-    """
-    Function just feeds into get_data and then drops the ticker symbol
-    :param benchmark:
-    :param start:
-    :param end:
-    :return:
-    """
-    benchmark = get_data(benchmark, start, end)
-    benchmark = benchmark.drop(['symbol'], axis=1)
-    benchmark.reset_index(inplace=True)
-    return benchmark
-
-
 #  Step 2 — Finding our Initial Active Portfolio
 def position_adjust(daily_positions, sale):
     """
@@ -515,40 +478,53 @@ if __name__ == '__main__':
     start_time = time.time()
 
     # Step 1 — Grabbing the Data
-    # our buy/sell transaction history
-    portfolio_df = pd.read_csv('mfi_log_book.csv')
-    portfolio_df['Open Date'] = pd.to_datetime(portfolio_df['Open Date'])
-    symbols = portfolio_df.Symbol.unique()
+    # our buy/sell transaction history, parsed with a fixed schema and cached in binary form until the log book changes
+    portfolio_df = load_ledger('mfi_log_book.csv', cache_path='mfi_log_book.pkl')
+    symbols = portfolio_df.Symbol.unique().tolist()
     stocks_start = datetime.datetime(2020, 7, 24)  # On 24th July 2020 first 30 stocks of MFI were bought
     # stocks_end = datetime.datetime(2020, 8, 10)
     stocks_end = datetime.date.today() - datetime.timedelta(days=1)  # Returns are calculated to one previous day
     # print(stocks_end)
 
-    # Daily closes for all tickers in our inventory before the end date specified
-    daily_adj_close = get_data(symbols, stocks_start, stocks_end)
-    daily_adj_close = daily_adj_close[['Close']].reset_index()
+    # Prices come from Yahoo Finance. To run without network, swap in DirectoryProvider('prices') to read exported
+    # files, or SyntheticProvider() for deterministic made-up prices
+    price_provider = YFinanceProvider()
 
-    # Daily closes for our benchmark comparison
-    daily_benchmark = get_benchmark(['SPY'], stocks_start, stocks_end)
-    daily_benchmark = daily_benchmark[['Date', 'Close']]
+    # Prices are kept in a local cache between runs, so a daily run only downloads the days since the last one
+    price_cache = PriceCache('price_cache.sqlite')
 
     # Contains dates that the market was open in our timeframe
     market_cal = create_market_cal(stocks_start, stocks_end)
 
-    # Step 2 — Finding our Initial Active Portfolio
-    # Now that we have these four datasets, we need to figure out how many shares we actively held during the start date
-    # specified. Assigning the output to a variable should give you the active positions within your portfolio
-    active_portfolio = portfolio_start_balance(portfolio_df, stocks_start)
-
-    # Step 3 — Creating Daily Performance Snapshots
-    # Running this line of code should return back a list of all trading days within the time range specified,
-    # along with an accurate count of positions per-day
-    positions_per_day = time_fill(active_portfolio, market_cal)
-
-    # Step 4 — Making Portfolio Calculations
-    # Now that we have an accurate by-day ledger of our active holdings, we can go ahead and create the final
-    # calculations needed to generate graphs!
-    combined_df = per_day_portfolio_calcs(positions_per_day, daily_benchmark, daily_adj_close, stocks_start)
+    # Rather than recomputing every day since the start date on every run, the state of the last run is kept in
+    # incremental_state/ and only the trading days since then are worked out and appended. On the first run, or once a
+    # transaction that was already counted has been edited (or the start date moved), every day is computed from scratch
+    state = IncrementalState.load('incremental_state')
+    if state is not None and state.is_current(portfolio_df, stocks_start):
+        prices_start = state.next_day()
+    else:
+        state, prices_start = None, stocks_start
+
+    # Nothing needs fetching when the script has already run today
+    if state is None or prices_start <= pd.Timestamp(stocks_end):
+        # Daily closes for all tickers in our inventory before the end date specified, from the first day we still need
+        daily_adj_close = get_data(symbols, prices_start, stocks_end, provider=price_provider, cache=price_cache)
+        daily_adj_close = daily_adj_close[['Close']].reset_index()
+
+        # Daily closes for our benchmark comparison
+        daily_benchmark = get_benchmark(['SPY'], prices_start, stocks_end, provider=price_provider, cache=price_cache)
+        daily_benchmark = daily_benchmark[['Date', 'Close']]
+
+        # Steps 2 to 4 — Active Portfolio, Daily Snapshots and Portfolio Calculations
+        # A full build finds the active portfolio on the start date and values every trading day, just like
+        # portfolio_start_balance, time_fill and per_day_portfolio_calcs above. An update carries on from the lots
+        # still held on the last day computed, with the same start date closes and benchmark base
+        if state is None:
+            state = IncrementalState.build('incremental_state', portfolio_df, stocks_start, market_cal,
+                                           daily_benchmark, daily_adj_close)
+        else:
+            state.update(portfolio_df, market_cal, daily_benchmark, daily_adj_close)
+    combined_df = state.combined_df()
     # combined_df.to_csv("Combined_DF_csv.csv")
 
     # # Step 5 — Visualize the Data
@@ -0,0 +1,43 @@
+import os
+import re
+import sys
+
+import pandas as pd
+
+from portfolio_tracker.cli import main
+
+
+def parse_ledger(text):
+    """
+    Parses a ledger given on the command line as path or path:start_date. Only a date at the very end is split off,
+    so paths with a colon of their own (e.g. C:\\ledgers\\cohort_2020.csv on Windows) are kept whole
+    :param text: e.g. cohort_2020.csv:2020-07-24
+    :return: Tuple of the path and the start date (None when not given)
+    """
+    match = re.fullmatch(r'(.+):(\d{4}-\d{2}-\d{2})', text)
+    if match is None:
+        return text, None
+    return match.group(1), pd.Timestamp(match.group(2))
+
+
+def ledger_name(path, taken):
+    """
+    Names a ledger after its file, numbering it when another ledger already goes by that name (e.g. two accounts'
+    mfi_log_book.csv), so that their results don't overwrite each other
+    :param path: Path of the log book
+    :param taken: Names given so far
+    :return: e.g. mfi_log_book, or mfi_log_book_2 for the second one
+    """
+    base = os.path.splitext(os.path.basename(path))[0]
+    name, number = base, 1
+    while name in taken:
+        number += 1
+        name = '{}_{}'.format(base, number)
+    return name
+
+
+# Evaluates several MFI cohorts or accounts in one go, fetching the prices they share only once, e.g.
+#   python -m portfolio_tracker.batch cohort_1.csv cohort_2.csv:2021-01-04 --start 2020-07-24 --output results/batch
+# The same as python -m portfolio_tracker batch, which takes the same inputs as the other commands
+if __name__ == '__main__':
+    main(['batch'] + sys.argv[1:])
@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.ledger_loader import read_ledger
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data, get_benchmark
+from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.synthetic_ledger import synthetic_ledger, write_ledger
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+# Scenarios run when none are given: (tickers, lots per ticker, sell frequency, days analysed)
+DEFAULT_SCENARIOS = [(30, 1, 0., 365), (100, 4, 0.2, 365), (500, 8, 0.3, 730)]
+
+# Charts from step 5, timed unless --no-plots is given
+PLOTS = ['line', 'line_facets', 'total_return', 'mfi_vs_spy']
+
+# Library every chart is drawn with, which step 5 only imports when the chart is drawn
+CHART_LIBRARIES = {'line': 'plotly', 'line_facets': 'plotly', 'total_return': 'plotly', 'mfi_vs_spy': 'bokeh'}
+
+
+def measure(func, *args, repeat=3):
+    """
+    Times a stage and measures the memory it allocates. The stage is timed `repeat` times, and then run once more
+    under tracemalloc for its peak memory, so that tracing doesn't slow down the timed runs
+    :param func: Stage to run
+    :param args: Arguments of the stage
+    :param repeat: Number of timed runs
+    :return: Tuple of the stage's result and a dict of measurements
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {'best_seconds': min(timings),
+                    'median_seconds': float(np.median(timings)),
+                    'peak_memory_mb': peak / 2 ** 20,
+                    'rows_out': len(result) if isinstance(result, pd.DataFrame) else None}
+
+
+def run_scenario(n_tickers, lots_per_ticker, sell_frequency, days, repeat=3, plots=PLOTS, seed=0):
+    """
+    Generates a synthetic ledger and prices for a scenario, and measures every stage of the pipeline on them
+    :param n_tickers: Number of tickers
+    :param lots_per_ticker: Number of buy lots per ticker
+    :param sell_frequency: Chance of every lot being (partly) sold
+    :param days: Number of calendar days analysed
+    :param repeat: Number of timed runs per stage
+    :param plots: Charts from step 5 to measure
+    :param seed: Seed of the synthetic ledger and prices
+    :return: Dict describing the scenario and its measurements
+    """
+    stocks_start = pd.Timestamp('2020-07-24')
+    stocks_end = stocks_start + pd.Timedelta(days=days)
+    provider = SyntheticProvider(seed=seed)
+
+    # The ledger is written out as a log book and read back the way main.py reads it, and the synthetic prices trade on
+    # business days, so those make up the market calendar
+    stages = {}
+    with tempfile.TemporaryDirectory() as directory:
+        ledger_path = os.path.join(directory, 'mfi_log_book.csv')
+        write_ledger(synthetic_ledger(n_tickers, lots_per_ticker, sell_frequency, stocks_start, stocks_end, seed=seed,
+                                      provider=provider), ledger_path)
+        portfolio_df, stages['read_ledger'] = measure(read_ledger, ledger_path, repeat=repeat)
+    symbols = list(portfolio_df.Symbol.unique())
+    daily_adj_close = get_data(symbols, stocks_start, stocks_end, provider=provider)[['Close']].reset_index()
+    daily_benchmark = get_benchmark(['SPY'], stocks_start, stocks_end, provider=provider)[['Date', 'Close']]
+    market_cal = TradingCalendar(pd.bdate_range(stocks_start, stocks_end))
+
+    active_portfolio, stages['portfolio_start_balance'] = measure(portfolio_start_balance, portfolio_df, stocks_start,
+                                                                  repeat=repeat)
+
+    # The interval and matrix path that main.py takes through steps 3 and 4
+    intervals, stages['holding_intervals'] = measure(holding_intervals, active_portfolio, market_cal, repeat=repeat)
+    valuation, stages['matrix_portfolio_calcs'] = measure(matrix_portfolio_calcs, intervals, market_cal,
+                                                          daily_benchmark, daily_adj_close, stocks_start,
+                                                          repeat=repeat)
+    combined_df, stages['to_combined_df'] = measure(valuation.to_combined_df, repeat=repeat)
+
+    if plots:
+        stages.update(measure_plots(combined_df, plots, repeat))
+
+    return {'tickers': n_tickers, 'lots_per_ticker': lots_per_ticker, 'sell_frequency': sell_frequency,
+            'days': days, 'ledger_rows': len(portfolio_df), 'trading_days': len(market_cal),
+            'combined_rows': len(combined_df), 'stages': stages}
+
+
+def measure_plots(combined_df, plots, repeat):
+    """
+    Measures the charts from step 5. They write their HTML and CSV files into the working directory and open a
+    browser, so they're run from a temporary directory with the browser pointed at a command that does nothing
+    :param combined_df: Output of step 4
+    :param plots: Names of the charts to measure
+    :param repeat: Number of timed runs per chart
+    :return: Dict of measurements by chart
+    """
+    from portfolio_tracker.helper_functions import step5_agg_line_chart
+
+    stages = {}
+    cwd, browser = os.getcwd(), os.environ.get('BROWSER')
+    os.environ['BROWSER'] = 'true'
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            for name in plots:
+                # plotly and bokeh are only needed for the charts, so a missing one is reported rather than failing
+                # the run
+                library = CHART_LIBRARIES[name]
+                if importlib.util.find_spec(library) is None:
+                    stages[name] = {'skipped': "No module named '{}'".format(library)}
+                    continue
+                chart = getattr(step5_agg_line_chart, name)
+                _, stages[name] = measure(chart, combined_df, 'Ticker Return', 'Benchmark Return', repeat=repeat)
+    finally:
+        os.chdir(cwd)
+        if browser is None:
+            del os.environ['BROWSER']
+        else:
+            os.environ['BROWSER'] = browser
+    return stages
+
+
+def git_commit():
+    """
+    :return: Commit the benchmark was run at, or None outside of a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_scenario(text):
+    """
+    Parses a scenario given on the command line as tickers,lots,sell_frequency,days
+    :param text: e.g. 100,4,0.2,365
+    :return: Tuple of the scenario's settings
+    """
+    n_tickers, lots_per_ticker, sell_frequency, days = text.split(',')
+    return int(n_tickers), int(lots_per_ticker), float(sell_frequency), int(days)
+
+
+# Benchmarks every stage of the pipeline on synthetic ledgers of growing size, e.g.
+#   python -m portfolio_tracker.benchmark --scenario 30,1,0,365 --scenario 1000,8,0.3,730 --output before.json
+# Results from different versions can then be compared stage by stage
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the portfolio tracker pipeline on synthetic ledgers")
+    parser.add_argument('--scenario', action='append', type=parse_scenario,
+                        help="tickers,lots_per_ticker,sell_frequency,days (can be repeated)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic ledgers and prices")
+    parser.add_argument('--no-plots', action='store_true', help="Skip the charts from step 5")
+    parser.add_argument('--output', default='benchmark_results.json', help="Path of the JSON results")
+    args = parser.parse_args()
+
+    results = {'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+               'commit': git_commit(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__,
+               'repeat': args.repeat,
+               'seed': args.seed,
+               'scenarios': []}
+
+    for scenario in args.scenario or DEFAULT_SCENARIOS:
+        result = run_scenario(*scenario, repeat=args.repeat, plots=[] if args.no_plots else PLOTS, seed=args.seed)
+        results['scenarios'].append(result)
+        print("CUSTOM INFO: {tickers} tickers x {lots_per_ticker} lots, {days} days -> {combined_rows} rows".format(
+            **result))
+        for stage, measurements in result['stages'].items():
+            if 'skipped' in measurements:
+                print("    {:<26} skipped ({})".format(stage, measurements['skipped']))
+            else:
+                print("    {:<26} {:>9.4f} s {:>10.1f} MB".format(stage, measurements['best_seconds'],
+                                                                 measurements['peak_memory_mb']))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("CUSTOM INFO: Results written to {}".format(args.output))
@@ -0,0 +1,465 @@
+import argparse
+import datetime
+import logging
+import os
+import time
+
+# The command line of the tracker, run as python -m portfolio_tracker <command>, e.g.
+#   python -m portfolio_tracker fetch --start 2020-07-27 --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker compute --start 2020-07-27 --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker render --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker report --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker intraday --interval 1m
+#   python -m portfolio_tracker simulate --paths 100000 --years 3
+#   python -m portfolio_tracker backtest --start 2010-01-01 --last-start 2018-12-01 --stocks 20 30 --years 3
+#   python -m portfolio_tracker watch --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker serve --benchmarks SPY QQQ IWM
+#   python -m portfolio_tracker batch cohort_1.csv cohort_2.csv:2021-01-04 --start 2020-07-24
+# Only the standard library is imported up front. Every command imports the parts of the tracker it runs, so compute
+# (e.g. from cron) never loads the charting libraries, and neither does report, while yfinance and
+# pandas_market_calendars are only loaded when prices have to be downloaded or the calendar built
+
+LOGGER = logging.getLogger('portfolio_tracker')
+
+
+def yesterday():
+    """
+    :return: Yesterday's date, the last day with closing prices for a run today
+    """
+    return datetime.date.today() - datetime.timedelta(days=1)
+
+
+def _sources(args):
+    """
+    Builds where prices come from
+    :param args: Parsed command line
+    :return: Tuple of the price provider and the PriceCache in front of it (None without --price-cache)
+    """
+    from portfolio_tracker.helper_functions.price_cache import PriceCache
+    from portfolio_tracker.helper_functions.price_providers import make_provider
+
+    provider_kwargs = {'path': args.prices_dir} if args.provider == 'directory' else {}
+    cache = PriceCache(args.price_cache) if args.price_cache else None
+    return make_provider(args.provider, **provider_kwargs), cache
+
+
+def _inputs(args, provider, cache):
+    """
+    Reads the log book and gets the prices of its tickers and of the benchmarks, through the price cache
+    :param args: Parsed command line
+    :param provider: Price provider, as returned by _sources
+    :param cache: PriceCache, or None
+    :return: Tuple of the transactions, the daily closes of every ticker ('Ticker', 'Date', 'Close'), the benchmarks'
+             closes (with the equal-weight index) and the primary benchmark's daily closes ('Date', 'Close')
+    """
+    from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+    from portfolio_tracker.helper_functions.multi_benchmark import portfolio_prices
+
+    portfolio_df = load_ledger(args.ledger, cache_path=args.ledger + '.pkl')
+    return (portfolio_df,) + portfolio_prices(portfolio_df, args.start, args.end, args.benchmarks, provider=provider,
+                                              cache=cache)
+
+
+def fetch(args):
+    """
+    Downloads the prices of the log book's tickers and of the benchmarks into the price cache, and builds the market
+    calendar, so that a later compute runs from local data only
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal
+
+    if not args.price_cache:
+        raise SystemExit("fetch needs a --price-cache to keep the prices in")
+    _, daily_adj_close, benchmark_closes, _ = _inputs(args, *_sources(args))
+    market_cal = create_market_cal(args.start, args.end, cache_dir=args.calendar_dir)
+    LOGGER.info("Fetched %d ticker closes and %d benchmark closes over %d trading days", len(daily_adj_close),
+                benchmark_closes.notna().sum().sum(), len(market_cal))
+
+
+def compute(args):
+    """
+    Runs steps 2 to 4 and writes the combined dataframe, with the columns of every benchmark, to <results>/combined,
+    and the rolling risk figures of the portfolio and every ticker to <results>/risk
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.instrumentation import Instrumentation, configure
+    from portfolio_tracker.helper_functions.multi_benchmark import add_benchmark_columns
+    from portfolio_tracker.helper_functions.result_store import write_results
+    from portfolio_tracker.helper_functions.risk_metrics import risk_table
+    from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal
+    from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+    from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+    from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+    instrumentation = configure(Instrumentation.from_env())
+    with instrumentation.stage('fetch') as record:
+        portfolio_df, daily_adj_close, benchmark_closes, daily_benchmark = _inputs(args, *_sources(args))
+        record.rows_out = len(daily_adj_close) + int(benchmark_closes.size)
+    with instrumentation.stage('calendar') as record:
+        market_cal = create_market_cal(args.start, args.end, cache_dir=args.calendar_dir)
+        record.rows_out = len(market_cal)
+    with instrumentation.stage('start_balance', rows_in=len(portfolio_df)) as record:
+        active_portfolio = portfolio_start_balance(portfolio_df, args.start)
+        record.rows_out = len(active_portfolio)
+    with instrumentation.stage('time_fill', rows_in=len(active_portfolio)) as record:
+        positions_per_day = holding_intervals(active_portfolio, market_cal)
+        record.rows_out = len(positions_per_day)
+    with instrumentation.stage('daily_calcs', rows_in=len(positions_per_day)) as record:
+        valuation = matrix_portfolio_calcs(positions_per_day, market_cal, daily_benchmark, daily_adj_close,
+                                           args.start)
+        combined_df = add_benchmark_columns(valuation.to_combined_df(), benchmark_closes)
+        record.rows_out = len(combined_df)
+    with instrumentation.stage('write', rows_in=len(combined_df)):
+        write_results(combined_df, os.path.join(args.results, 'combined'), args.format, partition_by='month')
+    with instrumentation.stage('risk', rows_in=len(combined_df)) as record:
+        risk_df = risk_table(combined_df)
+        write_results(risk_df, os.path.join(args.results, 'risk'), args.format)
+        record.rows_out = len(risk_df)
+
+
+def render(args):
+    """
+    Draws the MFI vs benchmarks chart from the results of compute, loading only the columns it plots
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.multi_benchmark import benchmark_column
+    from portfolio_tracker.helper_functions.result_store import read_results
+    from portfolio_tracker.helper_functions.step5_agg_line_chart import mfi_vs_spy
+
+    columns = ['Symbol', 'Date Snapshot', args.metric, 'Benchmark Return'] + \
+        [benchmark_column('{} Return', benchmark) for benchmark in args.benchmarks]
+    combined_df = read_results(os.path.join(args.results, 'combined'), columns=columns, start=args.from_date,
+                               end=args.to_date)
+    mfi_vs_spy(combined_df, args.metric, 'Benchmark Return', benchmarks=args.benchmarks,
+               open_browser=not args.no_browser)
+
+
+def report(args):
+    """
+    Prints the portfolio's cost, value and return on a day (the last one of the results by default) against every
+    benchmark, and the same for every symbol held that day
+    :param args: Parsed command line
+    :return:
+    """
+    import pandas as pd
+    from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube
+    from portfolio_tracker.helper_functions.multi_benchmark import benchmark_column
+    from portfolio_tracker.helper_functions.result_store import read_results
+
+    gains = {benchmark: benchmark_column('{} Gain / (Loss)', benchmark) for benchmark in args.benchmarks}
+    metrics = ['Adj cost', 'Ticker Share Value', 'Stock Gain / (Loss)'] + list(gains.values())
+    combined_df = read_results(os.path.join(args.results, 'combined'), columns=['Symbol', 'Date Snapshot'] + metrics,
+                               end=args.to_date)
+    cube = AggregationCube.build(combined_df)
+    date = cube.dates[-1] if args.to_date is None else cube.dates[cube.dates <= pd.Timestamp(args.to_date)][-1]
+
+    def returns(figures):
+        table = figures[['Adj cost', 'Ticker Share Value', 'Stock Gain / (Loss)']].copy()
+        table['Return'] = figures['Stock Gain / (Loss)'] / figures['Adj cost']
+        for benchmark, gain in gains.items():
+            table[benchmark + ' Return'] = figures[gain] / figures['Adj cost']
+        return table
+
+    portfolio = cube.by_date(metrics).set_index('Date Snapshot').loc[[date]]
+    by_symbol = cube.by_symbol(metrics)
+    by_symbol = by_symbol[by_symbol['Date Snapshot'] == date].set_index('Symbol')
+    print("Portfolio on {:%Y-%m-%d}".format(date))
+    print(returns(portfolio).rename(index=lambda _: 'Portfolio').rename_axis(None).to_string())
+    print()
+    print(returns(by_symbol).sort_values('Return', ascending=False).to_string())
+
+
+def intraday(args):
+    """
+    Values the portfolio on intraday bars over the sessions from --from (the last session by default) to the end date,
+    one session at a time, and writes every session's rows to <results>/intraday_<interval>/<YYYY-MM-DD>. The bars are
+    kept in an IntradayStore, so a session that has closed is only downloaded once
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.intraday_valuation import intraday_portfolio_calcs
+    from portfolio_tracker.helper_functions.price_cache import IntradayStore
+    from portfolio_tracker.helper_functions.result_store import write_results
+    from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal, get_intraday_data
+    from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+    from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+
+    # The same provider gets the daily closes and the intraday bars
+    provider, cache = _sources(args)
+    portfolio_df, daily_adj_close, _, daily_benchmark = _inputs(args, provider, cache)
+    market_cal = create_market_cal(args.start, args.end, cache_dir=args.calendar_dir)
+    intervals = holding_intervals(portfolio_start_balance(portfolio_df, args.start), market_cal)
+    sessions = market_cal.between(args.from_date or market_cal[-1], args.end)
+    store = IntradayStore(args.bars_dir, args.bars_format)
+
+    def session_data(tickers, session):
+        return get_intraday_data(tickers, session, args.interval, provider=provider, store=store)
+
+    def write_session(session, combined_df):
+        write_results(combined_df, os.path.join(args.results, 'intraday_' + args.interval), args.format,
+                      partition_by='day', replace=False)
+        LOGGER.info("Valued %s: %d rows", session.date(), len(combined_df))
+
+    cube = intraday_portfolio_calcs(intervals, sessions, args.interval, daily_adj_close, daily_benchmark,
+                                    session_data, args.benchmarks[0], args.start, on_session=write_session)
+    if cube is not None:
+        last_bar = cube.by_date(['Ticker Share Value', 'Stock Gain / (Loss)', 'Benchmark Gain / (Loss)']).iloc[-1]
+        print(last_bar.to_string())
+
+
+def simulate(args):
+    """
+    Simulates the portfolio and the primary benchmark from the daily returns in the results of compute, prints how the
+    paths end up (e.g. the share of them in which the portfolio beats the benchmark) and draws the fan of the paths
+    next to the MFI vs benchmark chart
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.result_store import read_results
+    from portfolio_tracker.helper_functions.risk_metrics import TRADING_DAYS_PER_YEAR
+    from portfolio_tracker.helper_functions.simulation import outcome_summary, simulate as simulate_paths
+    from portfolio_tracker.helper_functions.step5_agg_line_chart import mfi_vs_spy
+
+    columns = ['Symbol', 'Date Snapshot', 'Qty', 'Symbol Adj Close', 'Benchmark Close', 'Ticker Return',
+               'Benchmark Return']
+    combined_df = read_results(os.path.join(args.results, 'combined'), columns=columns)
+    fan, final = simulate_paths(combined_df, horizon=int(args.years * TRADING_DAYS_PER_YEAR), n_paths=args.paths,
+                                method=args.method, block_length=args.block_length, seed=args.seed,
+                                max_workers=args.workers)
+    for name, value in outcome_summary(final).items():
+        # Everything but the number of paths is a share or a return
+        print(("{:<24}{:,}" if isinstance(value, int) else "{:<24}{:.1%}").format(name, value))
+    if not args.no_chart:
+        mfi_vs_spy(combined_df, 'Ticker Return', 'Benchmark Return', open_browser=not args.no_browser, fan=fan)
+
+
+def backtest(args):
+    """
+    Backtests the annual rebalancing of the Magic Formula from every month between --start and --last-start, for every
+    cohort size and seed, and writes the summary of every scenario to <results>/backtest/summary and their daily
+    figures to <results>/backtest/daily
+    :param args: Parsed command line
+    :return:
+    """
+    import pandas as pd
+    from portfolio_tracker.helper_functions.backtest import run_backtest, scenario_grid
+    from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+    from portfolio_tracker.helper_functions.result_store import write_results
+    from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal
+
+    if args.universe:
+        with open(args.universe) as universe_file:
+            universe = [line.strip() for line in universe_file if line.strip()]
+    else:
+        universe = load_ledger(args.ledger, cache_path=args.ledger + '.pkl')['Symbol'].unique().tolist()
+    scores = pd.read_csv(args.scores, index_col=0, parse_dates=True) if args.scores else None
+    starts = pd.date_range(args.start, args.last_start or args.start, freq=pd.DateOffset(months=args.every))
+    scenarios = scenario_grid(starts, args.stocks, range(args.seeds))
+
+    provider, cache = _sources(args)
+    summary, daily = run_backtest(scenarios, universe, args.end, benchmark=args.benchmarks[0], years=args.years,
+                                  scores=scores, provider=provider, cache=cache,
+                                  market_cal=create_market_cal(args.start, args.end, cache_dir=args.calendar_dir),
+                                  ledger_dir=args.ledgers_dir)
+    write_results(summary.join(scenarios).reset_index(), os.path.join(args.results, 'backtest', 'summary'),
+                  args.format)
+    write_results(daily, os.path.join(args.results, 'backtest', 'daily'), args.format, partition_by='month')
+    print("{} scenarios, beating {} in {:.1%} of them".format(len(summary), args.benchmarks[0],
+                                                              (summary['Excess Return'] > 0).mean()))
+    print(summary[['Return', 'Benchmark Return', 'Excess Return', 'Annual Return', 'Max Drawdown']].describe()
+          .to_string())
+
+
+def watch(args):
+    """
+    Keeps the MFI vs benchmarks chart up to date while the log book is edited. Every time it's saved, only the symbols
+    with a changed row are computed again, from the day of the earliest change, and mfi_vs_spy.html is written again
+    (reload the page to see it)
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.ledger_watch import WatchState, watch as watch_ledger
+    from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal, get_data
+    from portfolio_tracker.helper_functions.step5_agg_line_chart import mfi_vs_spy
+
+    start_time = time.time()
+    provider, cache = _sources(args)
+
+    def fetch_closes(tickers):
+        return get_data(tickers, args.start, args.end, provider=provider, cache=cache)[['Close']].reset_index()
+
+    portfolio_df, daily_adj_close, benchmark_closes, daily_benchmark = _inputs(args, provider, cache)
+    market_cal = create_market_cal(args.start, args.end, cache_dir=args.calendar_dir)
+    state = WatchState(portfolio_df, args.start, daily_adj_close, daily_benchmark, market_cal,
+                       benchmark_closes=benchmark_closes, fetch=fetch_closes)
+    mfi_vs_spy(state.cube(), 'Ticker Return', 'Benchmark Return', benchmarks=args.benchmarks)
+    print("Watching {}, ready in {:.1f} seconds".format(args.ledger, time.time() - start_time))
+
+    def redraw(changes, cube):
+        mfi_vs_spy(cube, 'Ticker Return', 'Benchmark Return', benchmarks=args.benchmarks, open_browser=False)
+
+    watch_ledger(args.ledger, state, redraw, interval=args.poll)
+
+
+def serve(args):
+    """
+    Keeps the results warm in memory and answers JSON queries about them over a local port, e.g.
+      curl 'http://127.0.0.1:8050/portfolio?metrics=Ticker%20Return,SPY%20Return,QQQ%20Return'
+      curl 'http://127.0.0.1:8050/tickers/AAPL?start=2020-08-01'
+      curl 'http://127.0.0.1:8050/holdings?date=2020-08-10'
+    The results are computed again when the log book changes or a new day starts, or on a POST to /refresh
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.helper_functions.tracker_service import TrackerService, serve as serve_service
+
+    provider, cache = _sources(args)
+    service = TrackerService(args.ledger, args.start, args.end, benchmarks=args.benchmarks, provider=provider,
+                             cache=cache, ledger_cache_path=args.ledger + '.pkl', calendar_cache_dir=args.calendar_dir)
+    serve_service(service, args.host, args.port)
+
+
+def batch(args):
+    """
+    Evaluates several MFI cohorts or accounts in one go, fetching the prices they share only once. Every ledger's
+    results go to <output>/<ledger name>/combined, and the cross-portfolio summary to <output>/summary
+    :param args: Parsed command line
+    :return:
+    """
+    from portfolio_tracker.batch import ledger_name, parse_ledger
+    from portfolio_tracker.helper_functions.batch_runner import run_batch
+    from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+
+    ledgers, starts = {}, {}
+    for path, start in map(parse_ledger, args.ledgers):
+        name = ledger_name(path, ledgers)
+        ledgers[name] = load_ledger(path)
+        starts[name] = start if start is not None else args.start
+
+    provider, cache = _sources(args)
+    _, summary = run_batch(ledgers, starts, args.end, benchmark=args.benchmarks, provider=provider, cache=cache,
+                           max_workers=args.workers, output_dir=args.output or os.path.join(args.results, 'batch'),
+                           results_format=args.format)
+    print(summary.to_string())
+
+
+COMMANDS = {'fetch': fetch, 'compute': compute, 'render': render, 'report': report, 'intraday': intraday,
+            'simulate': simulate, 'backtest': backtest, 'watch': watch, 'serve': serve, 'batch': batch}
+
+
+def parser():
+    """
+    :return: ArgumentParser of the command line, with a sub-parser per command
+    """
+    def date(text):
+        return datetime.datetime.strptime(text, '%Y-%m-%d')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--benchmarks', nargs='+', default=['SPY'],
+                        help="Benchmark tickers, the first being the primary one")
+    common.add_argument('--results', default='results', help="Directory the results are written to and read from")
+
+    prices = argparse.ArgumentParser(add_help=False)
+    prices.add_argument('--start', type=date, default=datetime.datetime(2020, 7, 27), help="Start date, YYYY-MM-DD")
+    prices.add_argument('--end', type=date, default=datetime.datetime.combine(yesterday(), datetime.time()),
+                        help="End date, YYYY-MM-DD, defaults to yesterday")
+    # The names of price_providers.PROVIDERS, written out so that parsing the command line doesn't import pandas
+    prices.add_argument('--provider', choices=['directory', 'synthetic', 'yfinance'], default='yfinance')
+    prices.add_argument('--prices-dir', default='prices', help="Directory of the 'directory' provider")
+    prices.add_argument('--price-cache', default='price_cache.sqlite', help="Price cache, or '' for none")
+    prices.add_argument('--calendar-dir', default='.', help="Directory the market calendar is cached in")
+
+    inputs = argparse.ArgumentParser(add_help=False, parents=[prices])
+    inputs.add_argument('--ledger', default='mfi_log_book.csv', help="Log book CSV")
+
+    main_parser = argparse.ArgumentParser(prog='python -m portfolio_tracker',
+                                          description="Track a Magic Formula portfolio against its benchmarks")
+    main_parser.add_argument('-v', '--verbose', action='store_true', help="Log every stage")
+    commands = main_parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('fetch', parents=[common, inputs], help="Download prices into the price cache")
+    compute_parser = commands.add_parser('compute', parents=[common, inputs], help="Compute and write the results")
+    compute_parser.add_argument('--format', default=None, choices=['parquet', 'feather', 'csv'],
+                                help="Format of the results, defaults to parquet (csv without pyarrow)")
+    render_parser = commands.add_parser('render', parents=[common], help="Draw the MFI vs benchmarks chart")
+    render_parser.add_argument('--metric', default='Ticker Return', help="Portfolio metric plotted")
+    render_parser.add_argument('--from', dest='from_date', type=date, default=None, help="First date plotted")
+    render_parser.add_argument('--to', dest='to_date', type=date, default=None, help="Last date plotted")
+    render_parser.add_argument('--no-browser', action='store_true', help="Only write mfi_vs_spy.html")
+    report_parser = commands.add_parser('report', parents=[common], help="Print returns against the benchmarks")
+    report_parser.add_argument('--to', dest='to_date', type=date, default=None,
+                               help="Day reported, defaults to the last")
+    intraday_parser = commands.add_parser('intraday', parents=[common, inputs],
+                                          help="Value the portfolio on intraday bars")
+    # The keys of market_calendar.INTERVALS, written out for the same reason as the providers
+    intraday_parser.add_argument('--interval', choices=['1m', '2m', '5m', '15m', '30m', '1h'], default='5m')
+    intraday_parser.add_argument('--from', dest='from_date', type=date, default=None,
+                                 help="First session valued, defaults to the last one")
+    intraday_parser.add_argument('--bars-dir', default='intraday_bars', help="Directory intraday bars are stored in")
+    intraday_parser.add_argument('--bars-format', default='csv', choices=['csv', 'parquet'])
+    intraday_parser.add_argument('--format', default=None, choices=['parquet', 'feather', 'csv'],
+                                 help="Format of the results, defaults to parquet (csv without pyarrow)")
+    simulate_parser = commands.add_parser('simulate', parents=[common],
+                                          help="Simulate the portfolio against the primary benchmark")
+    simulate_parser.add_argument('--paths', type=int, default=100000, help="Number of paths simulated")
+    simulate_parser.add_argument('--years', type=float, default=3, help="Years every path runs for")
+    # The names of simulation.METHODS, written out for the same reason as the providers
+    simulate_parser.add_argument('--method', choices=['bootstrap', 'normal'], default='bootstrap')
+    simulate_parser.add_argument('--block-length', type=int, default=21, help="Trading days per bootstrap block")
+    simulate_parser.add_argument('--seed', type=int, default=0)
+    simulate_parser.add_argument('--workers', type=int, default=None,
+                                 help="Worker processes, defaults to the number of CPUs")
+    simulate_parser.add_argument('--no-chart', action='store_true', help="Only print how the paths end up")
+    simulate_parser.add_argument('--no-browser', action='store_true', help="Only write mfi_vs_spy.html")
+    backtest_parser = commands.add_parser('backtest', parents=[common, inputs],
+                                          help="Backtest annual rebalancing over many start dates and cohort sizes")
+    backtest_parser.add_argument('--last-start', type=date, default=None,
+                                 help="Last start date of a scenario, the first being --start")
+    backtest_parser.add_argument('--every', type=int, default=1, help="Months between the start dates of scenarios")
+    backtest_parser.add_argument('--stocks', type=int, nargs='+', default=[30], help="Stocks in a cohort")
+    backtest_parser.add_argument('--seeds', type=int, default=1, help="Random cohorts per start date and size")
+    backtest_parser.add_argument('--years', type=float, default=None,
+                                 help="Years every scenario runs for, defaults to up to the end date")
+    backtest_parser.add_argument('--universe', default=None,
+                                 help="File of the tickers cohorts are picked from, one per line, defaults to the "
+                                      "log book's")
+    backtest_parser.add_argument('--scores', default=None,
+                                 help="CSV of the scores ranking the universe (dates × tickers, lowest first), "
+                                      "e.g. Magic Formula ranks; cohorts are picked at random without")
+    backtest_parser.add_argument('--ledgers-dir', default=None,
+                                 help="Directory every scenario's log book is written to")
+    backtest_parser.add_argument('--format', default=None, choices=['parquet', 'feather', 'csv'],
+                                 help="Format of the results, defaults to parquet (csv without pyarrow)")
+    watch_parser = commands.add_parser('watch', parents=[common, inputs],
+                                       help="Redraw the chart whenever the log book changes")
+    watch_parser.add_argument('--poll', type=float, default=.25, help="Seconds between checks of the log book")
+    serve_parser = commands.add_parser('serve', parents=[common, inputs], help="Serve the results over HTTP")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8050)
+    # A server runs for days, so by default every day runs up to its own yesterday
+    serve_parser.set_defaults(end=None)
+    batch_parser = commands.add_parser('batch', parents=[common, prices],
+                                       help="Evaluate many ledgers against one shared price dataset")
+    batch_parser.add_argument('ledgers', nargs='+',
+                              help="Log book CSVs, optionally with their own start date as path:YYYY-MM-DD")
+    batch_parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to the CPU count")
+    batch_parser.add_argument('--output', default=None, help="Directory the results go to, defaults to <results>/batch")
+    batch_parser.add_argument('--format', default=None, choices=['parquet', 'feather', 'csv'],
+                              help="Format of the results, defaults to parquet (csv without pyarrow)")
+    return main_parser
+
+
+def main(argv=None):
+    """
+    Runs a command of the tracker
+    :param argv: Command line arguments, or None for sys.argv
+    :return:
+    """
+    args = parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    start_time = time.time()
+    COMMANDS[args.command](args)
+    LOGGER.info("%s took %.2f seconds", args.command, time.time() - start_time)
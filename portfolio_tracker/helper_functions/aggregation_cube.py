@@ -0,0 +1,270 @@
+import collections
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Number of cubes kept in memory, the least recently used going first
+CUBE_CACHE_SIZE = 4
+
+# Columns never aggregated, even though they're numeric
+KEY_COLUMNS = ['Lot']
+
+# Cubes in memory, by the id of the combined dataframe they were built from, with a weak reference to that dataframe
+# to tell it apart from a later one given the same id. An entry goes as soon as its dataframe does
+_cubes = collections.OrderedDict()
+
+
+class UnknownMetricError(KeyError):
+    """
+    Raised when a cube is asked for metrics it can't aggregate: columns the combined dataframe doesn't have or that
+    aren't numeric
+    """
+
+    def __init__(self, metrics):
+        """
+        :param metrics: The metrics asked for that the cube doesn't know
+        """
+        super().__init__(metrics)
+        self.metrics = list(metrics)
+
+    def __str__(self):
+        return "Unknown metric {}".format(', '.join(map(str, self.metrics)))
+
+
+class FrameGoneError(RuntimeError):
+    """
+    Raised when a cube is asked for metrics it hasn't summed yet after the combined dataframe it was built from has been
+    garbage collected, so there's nothing left to sum them from. Whoever asks has to keep the dataframe alive until
+    every metric they need has been computed
+    """
+
+    def __init__(self, metrics):
+        """
+        :param metrics: The metrics asked for that the cube hadn't summed
+        """
+        super().__init__(metrics)
+        self.metrics = list(metrics)
+
+    def __str__(self):
+        return "The combined dataframe this cube was built from is gone, so {} can't be summed".format(
+            ', '.join(map(str, self.metrics)))
+
+
+class AggregationCube:
+    """
+    Sums and means of the metrics of the combined dataframe by date, for the whole portfolio and for every symbol.
+    Building the cube works out once which (symbol, date) group every row falls in, which is the expensive part of a
+    groupby. The sum and count of a metric per group are then a single bincount, taken the first time a chart asks for
+    that metric and kept, and the portfolio figures are rolled up from the per-symbol ones. So however many charts are
+    drawn, the combined dataframe is grouped once and every metric summed once.
+    The cube only holds a weak reference to the combined dataframe, so a cube that is kept around (e.g. in the cache of
+    aggregation_cube) never keeps the results in memory after everything else is done with them
+    """
+
+    def __init__(self, index, group_date, dates, codes=None, frame=None, sums=None, counts=None, parts=None,
+                 order=None):
+        """
+        :param index: ('Symbol', 'Date Snapshot') of every group
+        :param group_date: Position in dates of every group's date
+        :param dates: Sorted distinct dates
+        :param codes: Group of every row of frame
+        :param frame: The combined dataframe, which metrics not summed yet are taken from
+        :param sums: Dict of the per-group sums of the metrics summed so far
+        :param counts: Dict of the per-group counts of the values summed
+        :param parts: Cubes this one was stacked from (see combine), which metrics not stacked yet are taken from
+        :param order: Group of the stacked parts' groups at every position, or None when they're already in order
+        """
+        self.index = index
+        self.group_date = group_date
+        self.dates = dates
+        self.codes = codes
+        self.frame = frame
+        self.sums = sums if sums is not None else {}
+        self.counts = counts if counts is not None else {}
+        self.parts = parts
+        self.order = order
+
+    @property
+    def frame(self):
+        """
+        :return: The combined dataframe metrics not summed yet are taken from, or None once it's gone
+        """
+        return self._frame() if self._frame is not None else None
+
+    @frame.setter
+    def frame(self, frame):
+        self._frame = weakref.ref(frame) if frame is not None else None
+
+    @classmethod
+    def build(cls, combined_df):
+        """
+        Groups a combined dataframe (or the daily table of compact_frames) by symbol and date
+        :param combined_df: Output of step 4
+        :return: AggregationCube
+        """
+        date_codes, dates = pd.factorize(combined_df['Date Snapshot'], sort=True)
+        symbol_codes, symbols = pd.factorize(combined_df['Symbol'], sort=True)
+        groups, codes = np.unique(symbol_codes.astype(np.int64) * len(dates) + date_codes, return_inverse=True)
+        index = pd.MultiIndex.from_arrays([np.asarray(symbols)[groups // len(dates)], dates[groups % len(dates)]],
+                                          names=['Symbol', 'Date Snapshot'])
+        return cls(index, groups % len(dates), dates, codes, combined_df)
+
+    @classmethod
+    def combine(cls, cubes):
+        """
+        Stacks the cubes of separate sets of symbols (e.g. one cube per symbol, as ledger_watch keeps) into the cube of
+        all of them, without going back to their rows. The metrics are stacked the first time they're asked for, so
+        only the ones a chart uses are, and every part must already have them summed
+        :param cubes: AggregationCubes, of different symbols
+        :return: AggregationCube
+        """
+        # The groups are numbered by their symbol and date in the symbols and dates of all the parts, which only
+        # involves the parts' own (short) lists of symbols and dates rather than every group's
+        part_symbols = [cube.index.levels[0].to_numpy(dtype=object) for cube in cubes]
+        part_dates = [cube.dates.to_numpy() for cube in cubes]
+        symbols, dates = np.unique(np.concatenate(part_symbols)), np.unique(np.concatenate(part_dates))
+        symbol_codes = np.concatenate([np.searchsorted(symbols, part)[cube.index.codes[0]]
+                                       for part, cube in zip(part_symbols, cubes)])
+        date_codes = np.concatenate([np.searchsorted(dates, part)[cube.group_date]
+                                     for part, cube in zip(part_dates, cubes)])
+        symbols, dates = pd.Index(symbols), pd.DatetimeIndex(dates)
+
+        group = symbol_codes.astype(np.int64) * len(dates) + date_codes
+        order = None if np.all(group[1:] > group[:-1]) else np.argsort(group, kind='mergesort')
+        if order is not None:
+            symbol_codes, date_codes = symbol_codes[order], date_codes[order]
+        index = pd.MultiIndex(levels=[symbols, dates], codes=[symbol_codes, date_codes],
+                              names=['Symbol', 'Date Snapshot'], verify_integrity=False)
+        return cls(index, date_codes, dates, parts=list(cubes), order=order)
+
+    def metrics(self):
+        """
+        :return: Every metric the cube can aggregate
+        """
+        if self.parts is not None:
+            return [metric for metric in self.parts[0].metrics() if all(metric in part.sums for part in self.parts)]
+        frame = self.frame
+        if frame is None:
+            return list(self.sums)
+        return [column for column in frame.select_dtypes('number').columns if column not in KEY_COLUMNS]
+
+    def compute(self, columns=None):
+        """
+        Sums and counts the given metrics per group, unless they already are
+        :param columns: Metrics, or None for all of them
+        :return:
+        """
+        if columns is None:
+            columns = self.metrics()
+        missing = [column for column in columns if column not in self.sums]
+        # A frame set to None was let go on purpose, and the cube only knows what it has summed, but a frame that was
+        # collected would have had the missing metrics
+        if missing and self.parts is None and self._frame is not None and self.frame is None:
+            raise FrameGoneError(missing)
+        unknown = [column for column in missing if column not in self.metrics()] if missing else []
+        if unknown:
+            raise UnknownMetricError(unknown)
+
+        for column in columns:
+            if column in self.sums:
+                continue
+            if self.parts is not None:
+                self.sums[column], self.counts[column] = self._stack(column)
+                continue
+            values = self.frame[column].to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            n_groups = len(self.index)
+            self.sums[column] = np.bincount(self.codes, weights=np.where(present, values, 0.), minlength=n_groups)
+            self.counts[column] = np.bincount(self.codes, weights=present, minlength=n_groups)
+
+    def _stack(self, column):
+        """
+        :param column: Metric
+        :return: Tuple of the parts' per-group sums and counts of the metric, stacked in the cube's order
+        """
+        stacked = []
+        for held in ('sums', 'counts'):
+            values = np.concatenate([getattr(part, held)[column] for part in self.parts])
+            stacked.append(values if self.order is None else values[self.order])
+        return tuple(stacked)
+
+    def by_symbol(self, columns, how='sum'):
+        """
+        Per-symbol figures by date
+        :param columns: Metrics
+        :param how: 'sum' or 'mean'
+        :return: Dataframe with 'Symbol' and 'Date Snapshot' columns and one column per metric
+        """
+        self.compute(columns)
+        return self._figures({column: self.sums[column] for column in columns},
+                             {column: self.counts[column] for column in columns}, self.index, how)
+
+    def by_date(self, columns, how='sum'):
+        """
+        Portfolio-level figures by date
+        :param columns: Metrics
+        :param how: 'sum' or 'mean'
+        :return: Dataframe with a 'Date Snapshot' column and one column per metric
+        """
+        self.compute(columns)
+
+        def roll_up(per_group):
+            return np.bincount(self.group_date, weights=per_group, minlength=len(self.dates))
+
+        return self._figures({column: roll_up(self.sums[column]) for column in columns},
+                             {column: roll_up(self.counts[column]) for column in columns},
+                             pd.Index(self.dates, name='Date Snapshot'), how)
+
+    @staticmethod
+    def _figures(sums, counts, index, how):
+        """
+        :param sums: Dict of sums by metric
+        :param counts: Dict of counts by metric
+        :param index: Index of the figures
+        :param how: 'sum' or 'mean'
+        :return:
+        """
+        if how == 'sum':
+            figures = sums
+        elif how == 'mean':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                figures = {column: np.where(counts[column] > 0, sums[column] / counts[column], np.nan)
+                           for column in sums}
+        else:
+            raise ValueError("Unknown aggregation {}, expected 'sum' or 'mean'".format(how))
+        return pd.DataFrame(figures, index=index).reset_index()
+
+
+def _forget(frame_id, frame_ref):
+    """
+    Drops the cube of a dataframe that has been garbage collected, unless a later dataframe has taken over its id
+    :param frame_id: id of the dataframe
+    :param frame_ref: Weak reference to the dataframe
+    :return:
+    """
+    if frame_id in _cubes and _cubes[frame_id][0] is frame_ref:
+        del _cubes[frame_id]
+
+
+def aggregation_cube(combined_df):
+    """
+    The cube of a combined dataframe, built only once for the same results. Cubes are kept in memory for as long as the
+    dataframe they were built from is, so every chart drawn from it shares the same cube. A dataframe changed in place
+    after its cube was built needs a new cube (from AggregationCube.build)
+    :param combined_df: Output of step 4, or a cube already built (which is returned as is)
+    :return: AggregationCube
+    """
+    if isinstance(combined_df, AggregationCube):
+        return combined_df
+    frame_id = id(combined_df)
+    if frame_id in _cubes and _cubes[frame_id][0]() is combined_df:
+        _cubes.move_to_end(frame_id)
+        return _cubes[frame_id][1]
+
+    cube = AggregationCube.build(combined_df)
+    frame_ref = weakref.ref(combined_df, lambda ref: _forget(frame_id, ref))
+    _cubes[frame_id] = (frame_ref, cube)
+    while len(_cubes) > CUBE_CACHE_SIZE:
+        _cubes.popitem(last=False)
+    return cube
@@ -0,0 +1,289 @@
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.ledger_loader import LEDGER_COLUMNS, LEDGER_DATE_FORMAT
+from portfolio_tracker.helper_functions.market_calendar import trading_days
+from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal, get_benchmark, get_data
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import _interval_sum
+
+# Most (trading days × holdings) values valued at once. Scenarios are valued in chunks of about this size, which bounds
+# the memory a backtest takes however many scenarios it runs
+CHUNK_VALUES = 2 ** 22
+
+
+def scenario_grid(start_dates, cohort_sizes, seeds=(0,)):
+    """
+    Every combination of start date, cohort size and seed, as the scenarios of a backtest
+    :param start_dates: Dates the first cohort is bought on
+    :param cohort_sizes: Numbers of stocks in a cohort
+    :param seeds: Seeds of the cohorts picked at random (when there are no scores to rank the stocks by)
+    :return: Dataframe indexed by scenario name, with 'Start', 'Stocks' and 'Seed' columns
+    """
+    scenarios = pd.DataFrame(list(itertools.product(pd.to_datetime(list(start_dates)), cohort_sizes, seeds)),
+                             columns=['Start', 'Stocks', 'Seed'])
+    scenarios.index = ['{:%Y-%m-%d}/{}/{}'.format(*row) for row in scenarios.itertuples(index=False)]
+    scenarios.index.name = 'Scenario'
+    return scenarios
+
+
+def rebalance_days(days, start, end, holding_years=1):
+    """
+    Positions of the trading days a cohort is bought on: the first trading day on or after the start, and on or after
+    every anniversary of it before the end
+    :param days: Trading days as a DatetimeIndex
+    :param start: Start of the scenario
+    :param end: End of the scenario
+    :param holding_years: Years every cohort is held for
+    :return: Array of day positions
+    """
+    anniversaries = [start]
+    while start + pd.DateOffset(years=holding_years * len(anniversaries)) < end:
+        anniversaries.append(start + pd.DateOffset(years=holding_years * len(anniversaries)))
+    positions = np.unique(days.searchsorted(pd.DatetimeIndex(anniversaries)))
+    return positions[positions < days.searchsorted(end, side='right')]
+
+
+def rebalancing_ledger(closes, start, end, n_stocks, capital=None, lot_cost=50., holding_years=1, scores=None, seed=0,
+                       carried=None):
+    """
+    Generates the log book of one Magic Formula scenario: n_stocks are bought in equal amounts on the start date, held
+    for a year and all sold on its anniversary, when the proceeds are put into the next cohort in the same way, and so
+    on up to the end. Buying and selling on the same day at the same closes keeps the portfolio self-financing, so its
+    value can be compared with the capital put into the benchmark on the start date.
+    A cohort is made of the stocks with the best (lowest) scores on the day, e.g. their combined Magic Formula rank of
+    earnings yield and return on capital, or of stocks picked at random when no scores are given. Only stocks with a
+    close on the day are picked, and a stock that stops trading is sold at its last close
+    :param closes: Closes of every stock in the universe, as a dataframe of (trading days × tickers) with no closes
+                   carried forward
+    :param start: Start of the scenario
+    :param end: End of the scenario
+    :param n_stocks: Stocks in every cohort
+    :param capital: Money put into the first cohort, defaults to lot_cost in every stock
+    :param lot_cost: Cost of every lot of the first cohort, when no capital is given
+    :param holding_years: Years every cohort is held for
+    :param scores: Dataframe of (dates × tickers) scores, the latest on or before a rebalance being used, or None
+    :param seed: Seed of the stocks picked at random
+    :param carried: closes.ffill() as an array, when generating many ledgers from the same closes
+    :return: Transactions dataframe, in the layout load_ledger returns
+    """
+    rng = np.random.default_rng(seed)
+    carried = closes.ffill().to_numpy(dtype=float) if carried is None else carried
+    cash = n_stocks * lot_cost if capital is None else capital
+
+    # Every transaction as a (ticker, day, quantity, price) entry, turned into a ledger in one go at the end
+    tickers, days, qty, price = [], [], [], []
+    held, held_qty = np.array([], dtype=int), np.array([])
+    for day in rebalance_days(closes.index, pd.Timestamp(start), pd.Timestamp(end), holding_years):
+        if len(held):
+            tickers.append(held)
+            days.append(np.full(len(held), day))
+            qty.append(-held_qty)
+            price.append(carried[day, held])
+            cash = (held_qty * carried[day, held]).sum()
+
+        day_closes = closes.iloc[day].to_numpy(dtype=float)
+        candidates = np.flatnonzero(~np.isnan(day_closes))
+        if scores is None:
+            held = np.sort(rng.choice(candidates, min(n_stocks, len(candidates)), replace=False))
+        else:
+            ranks = scores.reindex(columns=closes.columns).loc[:closes.index[day]].iloc[-1].to_numpy(dtype=float)
+            held = np.sort(candidates[np.argsort(ranks[candidates], kind='mergesort')[:n_stocks]])
+        held_qty = cash / len(held) / day_closes[held]
+        tickers.append(held)
+        days.append(np.full(len(held), day))
+        qty.append(held_qty)
+        price.append(day_closes[held])
+
+    ticker, day, qty, price = (np.concatenate(values) for values in (tickers, days, qty, price))
+    symbol = closes.columns[ticker]
+    ledger = pd.DataFrame({'Index': np.arange(1, len(ticker) + 1),
+                           'Symbol': symbol,
+                           'Security': symbol + ' ',
+                           'Qty': np.abs(qty),
+                           'Type': np.where(qty < 0, 'Sell', 'Buy'),
+                           'Open Date': closes.index[day],
+                           'Adj Cost per Share': price,
+                           'Adj Cost': np.abs(qty) * price})
+    return ledger[LEDGER_COLUMNS]
+
+
+def evaluate_ledgers(ledgers, closes, benchmark_close, ends=None):
+    """
+    Values many ledgers in one batch against one price matrix. Rather than running steps 2 to 4 once per ledger, the
+    ledgers are stacked with every symbol prefixed by its ledger, so that a single call of holding_intervals works out
+    the lot intervals of all of them, and the intervals are then summed into (trading days × holdings) matrices a chunk
+    of ledgers at a time and priced off the shared closes.
+    Besides the value of the holdings, every ledger's money in and out is followed: 'Net Invested' is what its buys
+    cost less what its sales brought in, and 'Benchmark Value' is what the same money would be worth had every buy
+    bought the benchmark and every sale sold it, on the same days
+    :param ledgers: Dict of transactions dataframes by name
+    :param closes: Closes of every ticker in any ledger, as a dataframe of (trading days × tickers)
+    :param benchmark_close: Benchmark closes by trading day
+    :param ends: Dict of the last day every ledger is valued on by name, defaults to the last trading day
+    :return: Tuple of the trading days and a dict of (ledgers × days) arrays of 'Net Invested', 'Value' and
+             'Benchmark Value', NaN before a ledger's first transaction and after its last day
+    """
+    days = closes.index
+    n_days, names = len(days), list(ledgers)
+    ledger = pd.concat([ledgers[name].assign(Scenario=i) for i, name in enumerate(names)], ignore_index=True)
+    ledger['Ticker'] = ledger['Symbol'].astype(str)
+    ledger['Symbol'] = ledger['Scenario'].astype(str) + ':' + ledger['Ticker']
+
+    # What every ledger is holding, valued a chunk of ledgers at a time. Holdings are (ledger, ticker) pairs, so a
+    # chunk's quantities are a (days × holdings) matrix, priced with the closes carried forward over the days a ticker
+    # doesn't trade, and summed up per ledger by a product with the matrix of which ledger every holding belongs to
+    intervals = holding_intervals(ledger, days).sort_values('Scenario', kind='mergesort')
+    prices = np.nan_to_num(closes.ffill().to_numpy(dtype=float))
+    holding, holdings = pd.factorize(intervals['Symbol'])
+    holding_scenario = intervals.groupby(holding)['Scenario'].first().to_numpy()
+    holding_ticker = closes.columns.get_indexer(intervals.groupby(holding)['Ticker'].first())
+    first_day = days.searchsorted(intervals['First Day'].values)
+    last_day = days.searchsorted(intervals['Last Day'].values)
+    lot_qty = intervals['Qty'].to_numpy(dtype=float)
+
+    value = np.zeros((len(names), n_days))
+    chunk_holdings = max(CHUNK_VALUES // n_days, 1)
+    chunk_starts = np.searchsorted(holding_scenario, holding_scenario[::chunk_holdings])
+    for first, last in zip(chunk_starts, np.append(chunk_starts[1:], len(holdings))):
+        if first == last:
+            continue
+        rows = (holding >= first) & (holding < last)
+        qty = _interval_sum(lot_qty[rows], holding[rows] - first, first_day[rows], last_day[rows],
+                            (n_days, last - first))
+        scenarios, scenario = np.unique(holding_scenario[first:last], return_inverse=True)
+        membership = np.zeros((last - first, len(scenarios)))
+        membership[np.arange(last - first), scenario] = 1.
+        value[scenarios] += ((qty * prices[:, holding_ticker[first:last]]) @ membership).T
+
+    # Money in and out, on the first trading day on or after every transaction
+    flow_day = days.searchsorted(ledger['Open Date'].values)
+    flows = ledger[flow_day < n_days]
+    flow_day = flow_day[flow_day < n_days]
+    flow = np.where(flows['Type'] == 'Sell', -1., 1.) * flows['Adj Cost'].to_numpy(dtype=float)
+    scenario = flows['Scenario'].to_numpy()
+    benchmark = benchmark_close.reindex(days).ffill().to_numpy(dtype=float)
+    net_invested, benchmark_shares = np.zeros((len(names), n_days)), np.zeros((len(names), n_days))
+    np.add.at(net_invested, (scenario, flow_day), flow)
+    np.add.at(benchmark_shares, (scenario, flow_day), flow / benchmark[flow_day])
+
+    # Every ledger is only valued from its first transaction to its last day
+    first_flow = np.full(len(names), n_days)
+    np.minimum.at(first_flow, scenario, flow_day)
+    last = np.full(len(names), n_days - 1) if ends is None else \
+        days.searchsorted(pd.DatetimeIndex([ends[name] for name in names]), side='right') - 1
+    valued = (np.arange(n_days) >= first_flow[:, None]) & (np.arange(n_days) <= last[:, None])
+    figures = {'Net Invested': np.cumsum(net_invested, axis=1), 'Value': value,
+               'Benchmark Value': np.cumsum(benchmark_shares, axis=1) * benchmark}
+    return days, {name: np.where(valued, values, np.nan) for name, values in figures.items()}
+
+
+def backtest_summary(names, days, figures):
+    """
+    How every scenario of a backtest ended up
+    :param names: Names of the scenarios
+    :param days: Trading days
+    :param figures: Dict of (scenarios × days) arrays, as returned by evaluate_ledgers
+    :return: Dataframe indexed by scenario name
+    """
+    valued = ~np.isnan(figures['Value'])
+    first = valued.argmax(axis=1)
+    last = len(days) - 1 - valued[:, ::-1].argmax(axis=1)
+    rows = np.arange(len(names))
+    net_invested = figures['Net Invested'][rows, last]
+    value, benchmark_value = figures['Value'][rows, last], figures['Benchmark Value'][rows, last]
+    years = (days[last] - days[first]).days.to_numpy() / 365.25
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = value / net_invested
+        benchmark_growth = benchmark_value / net_invested
+        drawdown = figures['Value'] / np.fmax.accumulate(figures['Value'], axis=1) - 1
+        summary = pd.DataFrame({'First Day': days[first], 'Last Day': days[last], 'Net Invested': net_invested,
+                                'Value': value, 'Benchmark Value': benchmark_value,
+                                'Return': growth - 1, 'Benchmark Return': benchmark_growth - 1,
+                                'Excess Return': growth - benchmark_growth,
+                                'Annual Return': growth ** (1 / years) - 1,
+                                'Benchmark Annual Return': benchmark_growth ** (1 / years) - 1,
+                                'Max Drawdown': np.nanmin(drawdown, axis=1)}, index=pd.Index(names, name='Scenario'))
+    return summary
+
+
+def backtest_table(names, days, figures):
+    """
+    Melts the figures of a backtest into a long table: a row per scenario and day it was valued on
+    :param names: Names of the scenarios
+    :param days: Trading days
+    :param figures: Dict of (scenarios × days) arrays, as returned by evaluate_ledgers
+    :return: Dataframe with 'Date Snapshot', 'Scenario', 'Net Invested', 'Value' and 'Benchmark Value' columns
+    """
+    valued = ~np.isnan(figures['Value'].T.ravel())
+    table = pd.DataFrame({'Date Snapshot': np.repeat(days.to_numpy(), len(names))[valued],
+                          'Scenario': pd.Categorical.from_codes(np.tile(np.arange(len(names)), len(days))[valued],
+                                                                categories=names)})
+    for name, values in figures.items():
+        table[name] = values.T.ravel()[valued]
+    return table
+
+
+def write_ledgers(ledgers, directory):
+    """
+    Writes every ledger as a log book CSV, <directory>/<name>.csv, with the dates formatted and the byte order mark the
+    exported log book starts with, so that any scenario can be run through the tracker on its own
+    :param ledgers: Dict of transactions dataframes by name
+    :param directory: Directory the log books are written to
+    :return:
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, ledger in ledgers.items():
+        ledger = ledger.assign(**{'Open Date': ledger['Open Date'].dt.strftime(LEDGER_DATE_FORMAT)})
+        ledger.to_csv(os.path.join(directory, name.replace('/', '_') + '.csv'), index=False, encoding='utf-8-sig')
+
+
+def run_backtest(scenarios, universe, stocks_end, benchmark='SPY', years=None, holding_years=1, lot_cost=50.,
+                 scores=None, provider=None, cache=None, market_cal=None, ledger_dir=None):
+    """
+    Backtests the annual rebalancing of the Magic Formula over many scenarios (start dates, cohort sizes and seeds) in
+    one go. The closes of the whole universe and of the benchmark are fetched once over the widest date range any
+    scenario needs, every scenario's log book is generated from them, and all the log books are then valued in one
+    batch against the same price matrix by evaluate_ledgers
+    :param scenarios: Dataframe of scenarios, as returned by scenario_grid
+    :param universe: Tickers the cohorts are picked from
+    :param stocks_end: End date of the backtest
+    :param benchmark: Benchmark ticker
+    :param years: Years every scenario runs for, or None to run them all to stocks_end
+    :param holding_years: Years every cohort is held for
+    :param lot_cost: Cost of every lot of the first cohort
+    :param scores: Dataframe of (dates × tickers) scores to rank the universe by, lowest first, or None to pick them
+                   at random
+    :param provider: PriceProvider, defaults to a YFinanceProvider
+    :param cache: Optional PriceCache in front of the provider
+    :param market_cal: Trading days covering every scenario, or None to build them with create_market_cal
+    :param ledger_dir: Directory every scenario's log book is written to, or None
+    :return: Tuple of the summary of every scenario (see backtest_summary) and the daily figures of every scenario (see
+             backtest_table)
+    """
+    stocks_end = pd.Timestamp(stocks_end)
+    widest_start = scenarios['Start'].min()
+    daily_adj_close = get_data(list(universe), widest_start, stocks_end, provider=provider, cache=cache)
+    daily_adj_close = daily_adj_close[['Close']].reset_index()
+    daily_benchmark = get_benchmark([benchmark], widest_start, stocks_end, provider=provider, cache=cache)
+    if market_cal is None:
+        market_cal = create_market_cal(widest_start, stocks_end)
+    days = trading_days(market_cal)
+    closes = daily_adj_close.pivot(index='Date', columns='Ticker', values='Close').reindex(days)
+    carried = closes.ffill().to_numpy(dtype=float)
+    benchmark_close = daily_benchmark.set_index('Date')['Close']
+
+    ends = {name: min(stocks_end, row.Start + pd.DateOffset(months=round(12 * years))) if years else stocks_end
+            for name, row in scenarios.iterrows()}
+    ledgers = {name: rebalancing_ledger(closes, row.Start, ends[name], row.Stocks, lot_cost=lot_cost,
+                                        holding_years=holding_years, scores=scores, seed=row.Seed, carried=carried)
+               for name, row in scenarios.iterrows()}
+    if ledger_dir is not None:
+        write_ledgers(ledgers, ledger_dir)
+
+    days, figures = evaluate_ledgers(ledgers, closes, benchmark_close, ends)
+    names = list(ledgers)
+    return backtest_summary(names, days, figures), backtest_table(names, days, figures)
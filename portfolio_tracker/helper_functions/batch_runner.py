@@ -0,0 +1,152 @@
+import concurrent.futures
+import os
+
+import pandas as pd
+
+from portfolio_tracker.helper_functions.result_store import write_results
+from portfolio_tracker.helper_functions.multi_benchmark import add_benchmark_columns, equal_weight_index, get_benchmarks
+from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal, get_data
+from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.market_calendar import trading_days
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+# Prices and calendar shared by every ledger in a worker process, set once by _init_worker rather than being sent along
+# with every ledger
+_shared = {}
+
+
+def _init_worker(daily_adj_close, benchmark_closes, market_cal):
+    """
+    Receives the shared prices and calendar once per worker process
+    :param daily_adj_close: Daily closes of every ticker in any ledger ('Ticker', 'Date', 'Close')
+    :param benchmark_closes: Closes of every benchmark, as returned by get_benchmarks
+    :param market_cal: Trading days covering every ledger
+    :return:
+    """
+    _shared.update(daily_adj_close=daily_adj_close, benchmark_closes=benchmark_closes, market_cal=market_cal)
+
+
+def run_ledger(portfolio, stocks_start, stocks_end, daily_adj_close, benchmark_closes, market_cal):
+    """
+    Runs steps 2 to 4 for one ledger, on the slice of the shared prices and calendar it covers. The slice holds exactly
+    the prices a run of main.py for this ledger alone would fetch, so the results are the same: the first benchmark
+    fills the 'Benchmark ...' columns of step 4, and every benchmark, plus an equal-weight index of the ledger's own
+    tickers, gets its own columns
+    :param portfolio: Transactions dataframe read from the log book
+    :param stocks_start: Start date of the analysis
+    :param stocks_end: End date of the analysis
+    :param daily_adj_close: Daily closes of every ticker in any ledger ('Ticker', 'Date', 'Close')
+    :param benchmark_closes: Closes of every benchmark, as returned by get_benchmarks
+    :param market_cal: Trading days covering every ledger
+    :return: The ledger's combined dataframe
+    """
+    stocks_start, stocks_end = pd.Timestamp(stocks_start), pd.Timestamp(stocks_end)
+    symbols = portfolio['Symbol'].unique()
+    daily_adj_close = daily_adj_close[daily_adj_close['Ticker'].isin(symbols) &
+                                      daily_adj_close['Date'].between(stocks_start, stocks_end)]
+    benchmark_closes = benchmark_closes.loc[stocks_start:stocks_end].join(equal_weight_index(daily_adj_close, symbols))
+    daily_benchmark = benchmark_closes.iloc[:, 0].rename('Close').reset_index()
+    days = trading_days(market_cal)
+    days = days[(days >= stocks_start) & (days <= stocks_end)]
+
+    active_portfolio = portfolio_start_balance(portfolio, stocks_start)
+    intervals = holding_intervals(active_portfolio, days)
+    valuation = matrix_portfolio_calcs(intervals, days, daily_benchmark, daily_adj_close, stocks_start)
+    return add_benchmark_columns(valuation.to_combined_df(), benchmark_closes)
+
+
+def portfolio_summary(combined_df):
+    """
+    Portfolio-level figures on the last day of a combined dataframe: what the holdings cost, what they and their
+    benchmark equivalent are worth, and the returns of both
+    :param combined_df: Output of step 4
+    :return: Dict of figures
+    """
+    if combined_df.empty:
+        return {'Lots': 0, 'Tickers': 0}
+    last_day = combined_df['Date Snapshot'].max()
+    last = combined_df[combined_df['Date Snapshot'] == last_day]
+    cost = last['Adj cost'].sum()
+    value = last['Ticker Share Value'].sum()
+    benchmark_value = last['Benchmark Share Value'].sum()
+    return {'First Day': combined_df['Date Snapshot'].min(), 'Last Day': last_day,
+            'Lots': len(last), 'Tickers': last['Symbol'].nunique(),
+            'Cost': cost, 'Value': value, 'Gain / (Loss)': value - cost, 'Return': value / cost - 1,
+            'Benchmark Value': benchmark_value, 'Benchmark Return': benchmark_value / cost - 1,
+            'Excess Return': (value - benchmark_value) / cost}
+
+
+def _run_shared(name, portfolio, stocks_start, stocks_end, output_dir, results_format):
+    """
+    Worker task: runs one ledger against the worker's shared prices, writes its results if an output directory is
+    given, and hands back its summary (and its results, when they aren't written)
+    :param name: Name of the ledger
+    :param portfolio: Transactions dataframe
+    :param stocks_start: Start date of the analysis
+    :param stocks_end: End date of the analysis
+    :param output_dir: Directory the results are written to, or None to send them back
+    :param results_format: Format of the results written, or None for the default of result_store
+    :return: Tuple of the name, the summary and the combined dataframe (None when written)
+    """
+    combined_df = run_ledger(portfolio, stocks_start, stocks_end, _shared['daily_adj_close'],
+                             _shared['benchmark_closes'], _shared['market_cal'])
+    summary = portfolio_summary(combined_df)
+    if output_dir is not None:
+        write_results(combined_df, os.path.join(output_dir, name, 'combined'), results_format, partition_by='month')
+        combined_df = None
+    return name, summary, combined_df
+
+
+def run_batch(ledgers, stocks_start, stocks_end, benchmark=('SPY',), provider=None, cache=None, market_cal=None,
+              max_workers=None, output_dir=None, results_format=None):
+    """
+    Evaluates many ledgers against one shared price dataset. The union of their symbols is fetched once over the widest
+    date range any of them needs, and steps 2 to 4 then run for every ledger in a process pool. The prices go to every
+    worker process once, when it starts, so only the ledgers themselves travel with the tasks and the work scales
+    with the cores rather than with the number of ledgers
+    :param ledgers: Dict of transactions dataframes by ledger name
+    :param stocks_start: Start date of the analysis, or a dict of start dates by ledger name
+    :param stocks_end: End date of the analysis
+    :param benchmark: Benchmark tickers, the first being the primary one
+    :param provider: PriceProvider, defaults to a YFinanceProvider
+    :param cache: Optional PriceCache in front of the provider
+    :param market_cal: Trading days covering every ledger, or None to build them with create_market_cal
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    :param output_dir: Directory every ledger's results are written to (as <output_dir>/<name>/combined), or None to
+                       return them instead
+    :param results_format: Format of the results written, or None for the default of result_store
+    :return: Tuple of a dict of combined dataframes by ledger name (empty when written out) and a dataframe with one
+             summary row per ledger
+    """
+    starts = stocks_start if isinstance(stocks_start, dict) else {name: stocks_start for name in ledgers}
+    starts = {name: pd.Timestamp(starts[name]) for name in ledgers}
+    stocks_end = pd.Timestamp(stocks_end)
+    widest_start = min(starts.values())
+
+    # One fetch for every ticker held in any ledger, over the widest date range
+    symbols = sorted(set().union(*(ledger['Symbol'].unique() for ledger in ledgers.values())))
+    daily_adj_close = get_data(symbols, widest_start, stocks_end, provider=provider, cache=cache)
+    daily_adj_close = daily_adj_close[['Close']].reset_index()
+    # The benchmarks are lined up as a (days × benchmarks) matrix rather than stacked, which would give the primary
+    # benchmark series one close per benchmark on every day
+    benchmark_closes = get_benchmarks(benchmark, widest_start, stocks_end, provider=provider, cache=cache)
+    if market_cal is None:
+        market_cal = create_market_cal(widest_start, stocks_end)
+
+    results, summaries = {}, {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                initargs=(daily_adj_close, benchmark_closes, market_cal)) as pool:
+        futures = [pool.submit(_run_shared, name, ledger, starts[name], stocks_end, output_dir, results_format)
+                   for name, ledger in ledgers.items()]
+        for future in concurrent.futures.as_completed(futures):
+            name, summary, combined_df = future.result()
+            summaries[name] = summary
+            if combined_df is not None:
+                results[name] = combined_df
+
+    summary = pd.DataFrame.from_dict(summaries, orient='index').reindex(list(ledgers))
+    summary.index.name = 'Portfolio'
+    if output_dir is not None:
+        write_results(summary.reset_index(), os.path.join(output_dir, 'summary'), results_format)
+    return results, summary
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.multi_benchmark import benchmark_columns
+from portfolio_tracker.helper_functions.step4_daily_calcs import DERIVED_COLUMNS
+
+# Columns of the combined dataframe that change from day to day (besides the holdings' 'Date Snapshot' and 'Qty').
+# Every other column is fixed for a lot - the ledger columns, its cost basis, and its ticker's and the benchmark's
+# start and end closes - and is only stored once per lot in the lot table
+DAILY_COLUMNS = ['Symbol Adj Close', 'Adj cost daily', 'Benchmark Close', 'Adj cost', 'Equiv Benchmark Shares',
+                 'Benchmark Start Date Cost', 'Benchmark Return', 'Ticker Return', 'Ticker Share Value',
+                 'Benchmark Share Value', 'Stock Gain / (Loss)', 'Benchmark Gain / (Loss)', 'Abs Value Compare',
+                 'Abs Value Return', 'Abs. Return Compare']
+
+# Derived ratios, which can be stored as float32. A float32 keeps 24 bits of mantissa, so every stored ratio is within
+# a relative FLOAT32_RTOL of its float64 value, and sums of n ratios (as the charts take) within n * FLOAT32_RTOL
+RATIO_COLUMNS = ['Benchmark Return', 'Ticker Return', 'Abs Value Return', 'Abs. Return Compare']
+FLOAT32_RTOL = 2 ** -24
+
+# String columns of the lot table, stored as categoricals
+STRING_COLUMNS = ['Symbol', 'Security', 'Type']
+
+# Columns of the lot intervals that only the valuation engine works with
+INTERVAL_COLUMNS = ['Lot', 'First Day', 'Last Day', 'Ticker Position', 'Adj cost per share']
+
+
+def compact_combined_df(combined_df, float32=False):
+    """
+    Splits the combined dataframe into a lean daily table and a lot dimension table. The daily table keeps one row per
+    lot per day with only the columns that change from day to day, plus a 'Lot' code into the lot table and the
+    symbol as a categorical (so it can still be grouped by symbol on its own). The lot table holds every column that is
+    fixed for a lot once. Strings become categoricals, and with float32 the derived ratios are stored as float32 too.
+    On long histories this cuts the memory taken several-fold; expand_combined_df puts the two back together
+    Columns of any extra benchmarks (see multi_benchmark.add_benchmark_columns) are kept in the daily table
+    :param combined_df: Output of step 4
+    :param float32: Whether to store the RATIO_COLUMNS as float32 (see FLOAT32_RTOL)
+    :return: Tuple of the daily table and the lot table
+    """
+    daily_columns = ['Date Snapshot', 'Qty'] + DAILY_COLUMNS + benchmark_columns(combined_df.columns)
+    lot_columns = [column for column in combined_df.columns if column not in daily_columns]
+
+    # Rows of the same lot share every lot column, so numbering the distinct combinations numbers the lots
+    lot = combined_df.groupby(lot_columns, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+    first_row = np.unique(lot, return_index=True)[1]
+    lots = combined_df.iloc[first_row][lot_columns].reset_index(drop=True)
+    return _compact_tables(combined_df[daily_columns], lot, lots, float32)
+
+
+def compact_valuation(rows, intervals, float32=False):
+    """
+    Builds the tables of compact_combined_df straight from the valuation engine, without the combined dataframe ever
+    being built: the ledger columns of every lot come from its lot intervals, once per lot rather than once per day.
+    This is what DailyValuation.to_combined_df(compact=True) returns
+    :param rows: Output of step 4 for holdings with only the 'Lot', 'Qty', 'Symbol' and 'Date Snapshot' columns
+    :param intervals: Lot intervals the rows were valued from
+    :param float32: Whether to store the RATIO_COLUMNS as float32 (see FLOAT32_RTOL)
+    :return: Tuple of the daily table and the lot table
+    """
+    # Lots are numbered in the order they first appear, as compact_combined_df numbers them. The ledger columns are
+    # taken from the lot's intervals and the columns of step 4 that are fixed for a lot from its first row
+    lot, lot_ids = pd.factorize(rows['Lot'])
+    first_row = np.unique(lot, return_index=True)[1]
+    ledger_columns = sorted(column for column in intervals.columns if column not in INTERVAL_COLUMNS + ['Qty'])
+    ledger = intervals.drop_duplicates('Lot').set_index('Lot').loc[lot_ids, ledger_columns]
+    fixed_columns = [column for column in DERIVED_COLUMNS if column not in DAILY_COLUMNS]
+    lots = pd.concat([ledger.reset_index(drop=True), rows.iloc[first_row][fixed_columns].reset_index(drop=True)],
+                     axis=1)
+    return _compact_tables(rows[['Date Snapshot', 'Qty'] + DAILY_COLUMNS], lot, lots, float32)
+
+
+def _compact_tables(daily, lot, lots, float32):
+    """
+    Finishes the daily and lot tables: the daily table gets the 'Lot' code and symbol of every row, strings become
+    categoricals and with float32 the derived ratios are stored as float32
+    :param daily: Columns of the combined dataframe that change from day to day
+    :param lot: Lot code of every row
+    :param lots: Columns fixed for every lot, one row per lot code
+    :param float32: Whether to store the RATIO_COLUMNS as float32
+    :return: Tuple of the daily table and the lot table
+    """
+    lots.index.name = 'Lot'
+    daily = daily.copy()
+    daily.insert(0, 'Lot', lot.astype(np.int32))
+    daily.insert(1, 'Symbol', lots['Symbol'].to_numpy()[lot])
+
+    for table in (daily, lots):
+        for column in STRING_COLUMNS:
+            if column in table.columns:
+                table[column] = table[column].astype('category')
+    if float32:
+        daily[RATIO_COLUMNS] = daily[RATIO_COLUMNS].astype(np.float32)
+    return daily, lots
+
+
+def expand_combined_df(daily, lots):
+    """
+    Puts a daily table and lot table from compact_combined_df back together into the combined dataframe, with the
+    columns in the order step 4 returns them
+    :param daily: Daily table
+    :param lots: Lot table
+    :return:
+    """
+    lot = daily['Lot'].to_numpy()
+    combined_df = pd.concat([daily.drop(['Lot', 'Symbol'], axis=1).reset_index(drop=True),
+                             lots.iloc[lot].reset_index(drop=True)], axis=1)
+    extra_columns = benchmark_columns(daily.columns)
+    holding_columns = sorted(column for column in combined_df.columns
+                             if column not in DERIVED_COLUMNS and column not in extra_columns)
+    return combined_df[holding_columns + DERIVED_COLUMNS + extra_columns]
@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from portfolio_tracker.helper_functions.price_providers import EmptyDownloadError, PriceProvider, SyntheticProvider
+
+# Errors a download is retried on: network errors and timeouts (all OSErrors, as are the requests library's) and
+# downloads that came back empty. Anything else is a bug or a bad argument, which would only fail the same way again
+RETRIED_ERRORS = (OSError, EmptyDownloadError)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. Tokens are added at a steady rate up to a maximum burst size, and every
+    request has to take a token before it goes out, so no more than `rate` requests per second are sent on average.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Tokens added per second
+        :param burst: Maximum number of tokens the bucket can hold
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available, and then takes it
+        :return:
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_all(tickers, download, start, end, max_workers=8, requests_per_second=4., retries=3, backoff=1.,
+              timeout=30.):
+    """
+    Downloads the price history of every ticker over a bounded thread pool. Every request takes a token from a shared
+    rate limiter first (if there is one), and a request that fails with one of the RETRIED_ERRORS is retried with
+    exponential backoff (backoff, 2 * backoff, ...) before the ticker is given up on.
+    :param tickers: Tickers to download
+    :param download: Callable download(ticker, start, end, timeout) returning a dataframe indexed by date
+    :param start: Start date
+    :param end: End date (inclusive)
+    :param max_workers: Maximum number of downloads in flight at once
+    :param requests_per_second: Rate limit across all workers, or None for no limit
+    :param retries: Number of retries after the first failed attempt
+    :param backoff: Seconds to wait before the first retry
+    :param timeout: Per-ticker request timeout in seconds, passed on to download
+    :return: Dictionary of ticker to dataframe, in the order of tickers
+    """
+    # The bucket holds a single token, so even the first requests of the workers go out one at a time at the rate
+    bucket = TokenBucket(requests_per_second) if requests_per_second else None
+
+    def fetch(ticker):
+        """
+        Downloads a single ticker, retrying on failure
+        :param ticker: Unique Stock Code
+        :return:
+        """
+        for attempt in range(retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                return download(ticker, start, end, timeout)
+            except RETRIED_ERRORS:
+                if attempt == retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {ticker: executor.submit(fetch, ticker) for ticker in tickers}
+
+    # Every download has finished by the time the pool shuts down, so we can collect them without waiting. We collect
+    # all of the failures before raising, so that a single error message names every ticker that couldn't be fetched
+    failed = [ticker for ticker, future in futures.items() if future.exception() is not None]
+    # An error that wasn't retried is raised as it is, rather than passed off as a download that kept failing
+    for ticker in failed:
+        if not isinstance(futures[ticker].exception(), RETRIED_ERRORS):
+            raise futures[ticker].exception()
+    if failed:
+        raise RuntimeError("Failed to download {} after {} retries".format(", ".join(failed), retries)) \
+            from futures[failed[-1]].exception()
+    return {ticker: future.result() for ticker, future in futures.items()}
+
+
+class StubDownloader(PriceProvider):
+    """
+    Local stand-in for a price download, for testing the fetch layer without network. It sleeps for a random latency,
+    fails a given share of requests, times out when the latency runs past the timeout, and otherwise returns the bars
+    of another provider (deterministic synthetic bars by default). It also keeps count of the calls made and the most
+    that were ever in flight at once.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.05, failure_rate=0., seed=0, provider=None):
+        """
+        :param latency: Minimum simulated latency in seconds
+        :param jitter: Maximum extra latency in seconds, drawn uniformly
+        :param failure_rate: Share of calls that fail with a ConnectionError
+        :param seed: Seed for latencies and failures
+        :param provider: PriceProvider returning the bars, defaults to a SyntheticProvider
+        """
+        self.provider = provider or SyntheticProvider()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def download(self, ticker, start, end, timeout=None):
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            latency = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+        try:
+            time.sleep(latency if timeout is None else min(latency, timeout))
+            if timeout is not None and latency > timeout:
+                raise TimeoutError("Timed out downloading {}".format(ticker))
+            if fail:
+                raise ConnectionError("Simulated failure downloading {}".format(ticker))
+            return self.provider.download(ticker, start, end)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
@@ -0,0 +1,127 @@
+import numpy as np
+
+# Downsampling methods downsample_line takes, by name
+METHODS = ('lttb', 'minmax')
+
+
+def _as_float(x):
+    """
+    :param x: Dates, datetimes or numbers
+    :return: The values as a float array, with datetimes as nanoseconds, so that distances along x can be compared
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(float)
+    return x.astype(float)
+
+
+def _check_n_out(n_out):
+    """
+    :param n_out: Number of points to keep
+    :return:
+    """
+    if n_out < 2:
+        raise ValueError("Can't thin a line out to fewer than 2 points, {} asked for".format(n_out))
+
+
+def _evenly_spaced(n, n_out):
+    """
+    Fallback of the methods for fewer points than they need to work: points evenly spaced along the line, from the
+    first to the last
+    :param n: Number of points of the line
+    :param n_out: Number of points to keep
+    :return: Sorted indices of the points kept
+    """
+    return np.unique(np.linspace(0, n - 1, n_out).round().astype(np.int64))
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: picks n_out points of a line that keep its visual shape. The first and last points
+    are always kept, the points between them are split into n_out - 2 buckets, and from every bucket the point is
+    kept that forms the largest triangle with the point kept from the bucket before and the average of the bucket after
+    :param x: Sorted x values
+    :param y: y values
+    :param n_out: Number of points to keep, at least 2
+    :return: Sorted indices of the points kept
+    """
+    _check_n_out(n_out)
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return _evenly_spaced(n, n_out)
+    x, y = _as_float(x), np.asarray(y, dtype=float)
+
+    # Bucket edges over the points between the first and the last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Averages of every bucket, the last point standing in for the bucket after the last one
+    sums_x, sums_y = np.add.reduceat(x[1:n - 1], edges[:-1] - 1), np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # Twice the area of the triangle each candidate forms; only which one is largest matters
+        area = np.abs((x[previous] - avg_x[bucket + 1]) * (y[start:stop] - y[previous]) -
+                      (x[previous] - x[start:stop]) * (avg_y[bucket + 1] - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax_indices(x, y, n_out):
+    """
+    Min-max decimation: splits the x range into (n_out - 2) / 2 equal buckets (one per pixel column, at the chart's
+    width) and keeps the lowest and highest point of every bucket, so no peak or trough is lost, along with the first
+    and last points. Cheaper than LTTB, and exact about the extremes
+    :param x: Sorted x values
+    :param y: y values
+    :param n_out: Maximum number of points to keep, at least 2
+    :return: Sorted indices of the points kept
+    """
+    _check_n_out(n_out)
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 4:
+        return _evenly_spaced(n, n_out)
+    x, y = _as_float(x), np.asarray(y, dtype=float)
+
+    n_buckets = (n_out - 2) // 2
+    span = x[-1] - x[0]
+    bucket = np.zeros(n, dtype=np.int64) if span == 0 else \
+        np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    # Sorted by bucket and then by y, the first point of every bucket is its lowest and the last its highest
+    order = np.lexsort((y, bucket))
+    bucket_sorted = bucket[order]
+    first = np.flatnonzero(np.r_[True, bucket_sorted[1:] != bucket_sorted[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate([[0, n - 1], order[first], order[last]]))
+
+
+def downsample_line(x, y, max_points, method='lttb'):
+    """
+    Thins a line out to at most max_points points before it's drawn, so that a chart of years of daily (or intraday)
+    data stays small. Points where y is missing are dropped first
+    :param x: Sorted x values
+    :param y: y values
+    :param max_points: Maximum number of points to keep, at least 2, or None to keep them all
+    :param method: 'lttb' (Largest-Triangle-Three-Buckets, keeps the shape) or 'minmax' (keeps every bucket's extremes)
+    :return: Tuple of the x and y values kept
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown downsampling method {}, expected one of {}".format(method, METHODS))
+    if max_points is not None:
+        _check_n_out(max_points)
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    present = ~np.isnan(y)
+    x, y = x[present], y[present]
+    if max_points is None or len(x) <= max_points:
+        return x, y
+    indices = lttb_indices(x, y, max_points) if method == 'lttb' else minmax_indices(x, y, max_points)
+    return x[indices], y[indices]
@@ -0,0 +1,220 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.market_calendar import trading_days
+from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.step4_daily_calcs import DERIVED_COLUMNS
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs, _close_on
+
+# Columns that depend on the last date of the price data. They change on every run for every row, so they're not
+# stored with the partitions but stamped on when the combined dataframe is loaded
+END_DATE_COLUMNS = ['Benchmark End Date Close', 'Ticker End Date Close']
+
+
+def ledger_hash(portfolio, end_date):
+    """
+    Fingerprint of the transactions on or before a date. If it changes, rows that the stored days were built from have
+    been edited, and the stored days can't be trusted any more
+    :param portfolio: Transactions dataframe read from the log book
+    :param end_date: Last date to include
+    :return: Hex digest
+    """
+    rows = portfolio[portfolio['Open Date'] <= end_date]
+    return hashlib.sha256(pd.util.hash_pandas_object(rows).to_numpy().tobytes()).hexdigest()
+
+
+class IncrementalState:
+    """
+    What a run leaves behind so that the next one only has to work out the trading days since. It lives in a
+    directory holding:
+        state.json         the analysis start, the last day computed, the benchmark base and a hash of the ledger
+        closes.csv         every ticker's close on the first and on the last date of the price data
+        open_lots.pkl      the lots still held on the last day computed, with the quantity left in each
+        combined_*.pkl     the combined dataframe, partitioned by month
+    Only the partitions of the months that new days land in are rewritten, which on a daily run is just the last one.
+    """
+
+    def __init__(self, path, stocks_start, start_date, end_date, benchmark_start_close, benchmark_end_close,
+                 closes, open_lots, ledger):
+        """
+        :param path: Directory the state is kept in
+        :param stocks_start: Start date of the analysis
+        :param start_date: First date of the price data
+        :param end_date: Last trading day computed
+        :param benchmark_start_close: Benchmark close on start_date
+        :param benchmark_end_close: Benchmark close on the last date of the price data
+        :param closes: Dataframe by ticker with 'Start Close' and 'End Close' columns
+        :param open_lots: Lot intervals still held on end_date
+        :param ledger: Hash of the transactions on or before end_date
+        """
+        self.path = path
+        self.stocks_start = pd.Timestamp(stocks_start)
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.benchmark_start_close = benchmark_start_close
+        self.benchmark_end_close = benchmark_end_close
+        self.closes = closes
+        self.open_lots = open_lots
+        self.ledger = ledger
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the state left behind by the last run
+        :param path: Directory the state is kept in
+        :return: IncrementalState, or None if there isn't one
+        """
+        if not os.path.exists(os.path.join(path, 'state.json')):
+            return None
+        with open(os.path.join(path, 'state.json')) as f:
+            meta = json.load(f)
+        closes = pd.read_csv(os.path.join(path, 'closes.csv'), index_col='Ticker')
+        open_lots = pd.read_pickle(os.path.join(path, 'open_lots.pkl'))
+        return cls(path, meta['stocks_start'], meta['start_date'], meta['end_date'], meta['benchmark_start_close'],
+                   meta['benchmark_end_close'], closes, open_lots, meta['ledger'])
+
+    @classmethod
+    def build(cls, path, portfolio, stocks_start, market_cal, daily_benchmark, daily_adj_close):
+        """
+        Computes every trading day from scratch, as the full pipeline does, and stores the result as a new state. Any
+        partitions already in the directory are removed
+        :param path: Directory to keep the state in
+        :param portfolio: Transactions dataframe read from the log book
+        :param stocks_start: Start date of the analysis
+        :param market_cal: Trading days, as returned by create_market_cal
+        :param daily_benchmark: Daily benchmark closes ('Date', 'Close')
+        :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+        :return: IncrementalState
+        """
+        os.makedirs(path, exist_ok=True)
+        for partition in glob.glob(os.path.join(path, 'combined_*.pkl')):
+            os.remove(partition)
+
+        start_date = daily_adj_close['Date'].min()
+        tickers = pd.Index(sorted(daily_adj_close['Ticker'].unique()))
+        benchmark = daily_benchmark.set_index('Date')['Close']
+        closes = pd.DataFrame({'Start Close': _close_on(daily_adj_close, start_date, tickers)},
+                              index=pd.Index(tickers, name='Ticker'))
+        state = cls(path, stocks_start, start_date, start_date - pd.Timedelta(days=1),
+                    float(benchmark[benchmark.index.min()]), np.nan, closes, None, None)
+
+        # Starting from the active portfolio on the start date, every trading day is a new day
+        state._append(portfolio_start_balance(portfolio, stocks_start), market_cal, daily_benchmark, daily_adj_close,
+                      portfolio)
+        return state
+
+    def is_current(self, portfolio, stocks_start):
+        """
+        Whether the stored days can be extended: the analysis still starts on the same date, and none of the
+        transactions they were built from have changed since
+        :param portfolio: Transactions dataframe read from the log book
+        :param stocks_start: Start date of the analysis
+        :return:
+        """
+        return (self.stocks_start == pd.Timestamp(stocks_start)
+                and self.ledger == ledger_hash(portfolio, self.end_date))
+
+    def next_day(self):
+        """
+        :return: The first date that hasn't been computed yet
+        """
+        return self.end_date + pd.Timedelta(days=1)
+
+    def update(self, portfolio, market_cal, daily_benchmark, daily_adj_close):
+        """
+        Works out the trading days after the last day computed and appends them to the stored combined dataframe. Only
+        the prices from next_day() on are needed.
+        The holdings carry on from the lots still open on the last day computed, with the transactions dated after it
+        (as portfolio_start_balance passes them on) applied on top. Costs and returns are measured against the stored
+        start closes and benchmark base, so the new rows are exactly what a full recompute would produce
+        :param portfolio: Transactions dataframe read from the log book
+        :param market_cal: Trading days, as returned by create_market_cal
+        :param daily_benchmark: Daily benchmark closes from next_day() on ('Date', 'Close')
+        :param daily_adj_close: Daily closes of every ticker from next_day() on ('Ticker', 'Date', 'Close')
+        :return: Number of trading days added
+        """
+        active = portfolio_start_balance(portfolio, self.stocks_start)
+        new_transactions = active[active['Open Date'] > self.end_date]
+        open_lots = self.open_lots.drop(['First Day', 'Last Day'], axis=1).set_index('Lot')
+        open_lots.index.name = active.index.name
+        return self._append(pd.concat([open_lots, new_transactions]), market_cal, daily_benchmark, daily_adj_close,
+                            portfolio)
+
+    def _append(self, active, market_cal, daily_benchmark, daily_adj_close, portfolio):
+        """
+        Values the trading days from next_day() up to the last date of the price data, appends them to the partitions
+        and saves the state
+        :param active: Active positions as of next_day(), along with the transactions after it
+        :param market_cal: Trading days, as returned by create_market_cal
+        :param daily_benchmark: Daily benchmark closes ('Date', 'Close')
+        :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+        :param portfolio: Transactions dataframe read from the log book
+        :return: Number of trading days added
+        """
+        # Days are only computed once there are prices for them, so a close that hasn't been published yet is picked
+        # up on the next run rather than being stored as missing
+        days = trading_days(market_cal)
+        price_end = daily_adj_close['Date'].max()
+        days = days[(days >= self.next_day()) & (days <= price_end)]
+        if len(days) == 0:
+            return 0
+
+        intervals = holding_intervals(active, days)
+        valuation = matrix_portfolio_calcs(intervals, days, daily_benchmark, daily_adj_close, self.stocks_start,
+                                           start_date=self.start_date, start_closes=self.closes['Start Close'],
+                                           benchmark_start_close=self.benchmark_start_close)
+
+        # Lots without an end close are kept here and left out when loading, since the end close moves on every run
+        combined_df = valuation.to_combined_df(drop_unpriced=False).drop(END_DATE_COLUMNS, axis=1)
+        for month, rows in combined_df.groupby(combined_df['Date Snapshot'].dt.to_period('M')):
+            partition = os.path.join(self.path, 'combined_{}.pkl'.format(month))
+            if os.path.exists(partition):
+                rows = pd.concat([pd.read_pickle(partition), rows], ignore_index=True)
+            rows.to_pickle(partition)
+
+        self.closes['End Close'] = _close_on(daily_adj_close, price_end, self.closes.index)
+        self.benchmark_end_close = valuation.benchmark_end_close
+        self.end_date = days[-1]
+        self.open_lots = intervals[intervals['Last Day'] == self.end_date]
+        self.ledger = ledger_hash(portfolio, self.end_date)
+        self.save()
+        return len(days)
+
+    def save(self):
+        """
+        Writes everything but the partitions, which are written as days are appended
+        :return:
+        """
+        meta = {'stocks_start': str(self.stocks_start), 'start_date': str(self.start_date),
+                'end_date': str(self.end_date), 'benchmark_start_close': self.benchmark_start_close,
+                'benchmark_end_close': self.benchmark_end_close, 'ledger': self.ledger}
+        with open(os.path.join(self.path, 'state.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        self.closes.to_csv(os.path.join(self.path, 'closes.csv'))
+        self.open_lots.to_pickle(os.path.join(self.path, 'open_lots.pkl'))
+
+    def combined_df(self):
+        """
+        Loads the stored days as the combined dataframe that to_combined_df returns for the whole date range:
+        the end date closes are stamped on, lots of tickers without a start or end close are left out, and the rows
+        are put back in the same order
+        :return:
+        """
+        partitions = sorted(glob.glob(os.path.join(self.path, 'combined_*.pkl')))
+        combined_df = pd.concat([pd.read_pickle(partition) for partition in partitions], ignore_index=True)
+
+        priced = self.closes.dropna(subset=['Start Close', 'End Close'])
+        combined_df = combined_df[combined_df['Symbol'].isin(priced.index)]
+        combined_df['Benchmark End Date Close'] = self.benchmark_end_close
+        combined_df['Ticker End Date Close'] = combined_df['Symbol'].map(priced['End Close']).to_numpy(dtype=float)
+
+        # Every partition is grouped by symbol in the order the symbols first appear, and so is the whole range
+        order = np.argsort(pd.factorize(combined_df['Symbol'])[0], kind='mergesort')
+        holding_columns = [column for column in combined_df.columns if column not in DERIVED_COLUMNS]
+        return combined_df.iloc[order][holding_columns + DERIVED_COLUMNS].reset_index(drop=True)
@@ -0,0 +1,199 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where only traced memory is reported
+    resource = None
+
+LOGGER = logging.getLogger('portfolio_tracker')
+
+
+def _max_rss_mb():
+    """
+    High-water mark of the process's resident memory so far
+    :return: Megabytes, or None where the platform doesn't report it
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+class StageRecord:
+    """
+    Measurements of a single run of a stage. Rows out are set by the code inside the stage, once it knows them
+    """
+
+    def __init__(self, name, rows_in=None):
+        """
+        :param name: Name of the stage
+        :param rows_in: Number of rows going into the stage
+        """
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.max_rss_mb = None
+        self.peak_traced_mb = None
+        self.profile = None
+
+    def as_dict(self):
+        """
+        :return: The measurements as a JSON-friendly dict, leaving out the ones that weren't taken
+        """
+        # Row counts often come from NumPy (e.g. a dataframe's size), which json can't write
+        rows_in, rows_out = [int(rows) if rows is not None else None for rows in (self.rows_in, self.rows_out)]
+        record = {'stage': self.name, 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                  'rows_in': rows_in, 'rows_out': rows_out, 'max_rss_mb': self.max_rss_mb,
+                  'peak_traced_mb': self.peak_traced_mb, 'profile': self.profile}
+        return {key: value for key, value in record.items() if value is not None}
+
+
+class Instrumentation:
+    """
+    Records wall time, CPU time, rows in and out and memory for every stage of a run, and logs each stage as a JSON
+    line as it finishes. Memory is the process's peak resident size by default, which costs nothing to read; stages
+    named in trace_memory are also run under tracemalloc for the peak they allocate themselves, and stages named in
+    profile are run under cProfile, with the stats dumped to profile_dir. Both slow the stage down, so they're meant to
+    be turned on for one stage at a time while chasing a regression.
+    """
+
+    def __init__(self, profile=(), trace_memory=(), profile_dir='.', logger=LOGGER, level=logging.INFO):
+        """
+        :param profile: Names of the stages to run under cProfile
+        :param trace_memory: Names of the stages to run under tracemalloc
+        :param profile_dir: Directory the cProfile stats are dumped to, as <stage>.prof (<stage>-2.prof on its 2nd run)
+        :param logger: Logger the JSON lines are written to
+        :param level: Logging level of the JSON lines
+        """
+        self.profile = set(profile)
+        self.trace_memory = set(trace_memory)
+        self.profile_dir = profile_dir
+        self.logger = logger
+        self.level = level
+        self.records = []
+
+    @classmethod
+    def from_env(cls, environ=os.environ, **kwargs):
+        """
+        Configures the instrumentation from environment variables, so profiling can be turned on for a run without
+        touching the code:
+            PORTFOLIO_TRACKER_PROFILE       comma-separated stages to run under cProfile
+            PORTFOLIO_TRACKER_TRACEMALLOC   comma-separated stages to run under tracemalloc
+            PORTFOLIO_TRACKER_PROFILE_DIR   directory for the cProfile stats
+        :param environ: Environment to read
+        :param kwargs: Any other Instrumentation arguments
+        :return: Instrumentation
+        """
+        def stages(variable):
+            return [name.strip() for name in environ.get(variable, '').split(',') if name.strip()]
+
+        return cls(profile=stages('PORTFOLIO_TRACKER_PROFILE'), trace_memory=stages('PORTFOLIO_TRACKER_TRACEMALLOC'),
+                   profile_dir=environ.get('PORTFOLIO_TRACKER_PROFILE_DIR', '.'), **kwargs)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Measures the block it wraps as a stage, e.g.
+            with instrumentation.stage('time_fill', rows_in=len(active_portfolio)) as record:
+                positions_per_day = holding_intervals(active_portfolio, market_cal)
+                record.rows_out = len(positions_per_day)
+        :param name: Name of the stage
+        :param rows_in: Number of rows going into the stage
+        :return: StageRecord, filled in when the block exits
+        """
+        record = StageRecord(name, rows_in)
+        tracing = name in self.trace_memory and not tracemalloc.is_tracing()
+        profiler = cProfile.Profile() if name in self.profile else None
+
+        if tracing:
+            tracemalloc.start()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            record.wall_seconds = time.perf_counter() - wall_start
+            record.cpu_seconds = time.process_time() - cpu_start
+            if tracing:
+                record.peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+            record.max_rss_mb = _max_rss_mb()
+            if profiler:
+                # A stage that runs more than once (like the aggregation of every chart) gets a file per run:
+                # <stage>.prof for the first, then <stage>-2.prof and so on
+                os.makedirs(self.profile_dir, exist_ok=True)
+                runs = sum(1 for earlier in self.records if earlier.name == name and earlier.profile)
+                record.profile = os.path.join(self.profile_dir, '{}{}.prof'.format(name, '-{}'.format(runs + 1)
+                                                                                   if runs else ''))
+                profiler.dump_stats(record.profile)
+                self.logger.log(self.level, "Top functions of stage %s:\n%s", name, _top_functions(profiler))
+
+            self.records.append(record)
+            self.logger.log(self.level, json.dumps(record.as_dict()))
+
+    def summary(self):
+        """
+        :return: The measurements of every stage run so far, in order
+        """
+        return [record.as_dict() for record in self.records]
+
+    def write(self, path):
+        """
+        Writes the measurements of every stage run so far to a JSON file
+        :param path: Path of the JSON file
+        :return:
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def _top_functions(profiler, limit=15):
+    """
+    :param profiler: cProfile.Profile that has been run
+    :param limit: Number of functions to list
+    :return: The functions that took the most cumulative time, as pstats prints them
+    """
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+# The instrumentation the pipeline's stages report to, until configure() swaps in another one. Out of the box it only
+# logs, and nothing is shown unless logging has been set up
+_instrumentation = Instrumentation()
+
+
+def configure(instrumentation):
+    """
+    Sets the instrumentation the pipeline's stages report to
+    :param instrumentation: Instrumentation
+    :return: The instrumentation
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
+    return instrumentation
+
+
+def stage(name, rows_in=None):
+    """
+    Measures a block as a stage of the configured instrumentation (see Instrumentation.stage)
+    :param name: Name of the stage
+    :param rows_in: Number of rows going into the stage
+    :return:
+    """
+    return _instrumentation.stage(name, rows_in)
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube
+from portfolio_tracker.helper_functions.market_calendar import session_bars, trading_days
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs, _close_on
+
+# Metrics the intraday cube sums by default. A cube keeps a sum and a count of every metric for every symbol and bar,
+# so over many sessions of 1m bars it's worth only keeping the ones the charts use
+INTRADAY_METRICS = ['Adj cost', 'Ticker Share Value', 'Benchmark Share Value', 'Stock Gain / (Loss)',
+                    'Benchmark Gain / (Loss)', 'Ticker Return', 'Benchmark Return']
+
+
+def session_closes(prices, session, interval, tickers):
+    """
+    Lines up a session's intraday closes on the session's bars
+    :param prices: Intraday closes ('Ticker', 'Date', 'Close'), as returned by get_intraday_data
+    :param session: Trading day
+    :param interval: Bar size
+    :param tickers: Tickers to line up
+    :return: Dataframe of closes indexed by bar, with a column per ticker
+    """
+    # Bars nobody traded in (the afternoon of an early close, or the rest of a session still going on) are left out
+    bars = session_bars([session], interval)
+    bars = bars[bars.isin(prices['Date'])]
+    # No trade in a bar means no bar from Yahoo, so a ticker's last close carries on until its next trade
+    closes = prices.pivot(index='Date', columns='Ticker', values='Close')
+    return closes.reindex(index=bars, columns=tickers).ffill().rename_axis(index='Date', columns='Ticker')
+
+
+def intraday_portfolio_calcs(intervals, market_cal, interval, daily_adj_close, daily_benchmark, session_data,
+                             benchmark, stocks_start, metrics=INTRADAY_METRICS, on_session=None):
+    """
+    Step 4 on intraday bars. There are hundreds of bars to a trading day, so rather than valuing every bar of the whole
+    range at once, the sessions are valued one at a time: the lot intervals held on the day are valued on the day's
+    bars by matrix_portfolio_calcs, exactly as the daily run values trading days, and the session's rows are handed to
+    on_session (e.g. to write them out) and summed into a small per-session AggregationCube before being dropped. So
+    memory holds a single session's rows however many sessions are valued.
+    The ledger only has dates, so positions change at the open of the day a trade is made. The cost basis and the
+    start and end closes are the daily ones, so the last bar of every session agrees with the daily run for that day
+    :param intervals: Lot intervals, as returned by holding_intervals
+    :param market_cal: Sessions to value, as returned by create_market_cal
+    :param interval: Bar size, e.g. '1m', '5m' or '1h'
+    :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close') from the start of the analysis
+    :param daily_benchmark: Daily benchmark closes ('Date', 'Close')
+    :param session_data: Function taking a list of tickers and a session and returning their intraday closes, as
+                         get_intraday_data does
+    :param benchmark: Benchmark ticker, whose intraday closes are fetched along with the tickers'
+    :param stocks_start: Start date of the analysis
+    :param metrics: Metrics summed into the cube
+    :param on_session: Function taking the session and its rows (in the layout of the combined dataframe, with the
+                       bars as 'Date Snapshot'), or None
+    :return: AggregationCube of every session's bars, or None when nothing was held
+    """
+    tickers = pd.Index(sorted(intervals['Symbol'].unique()))
+    start_date, end_date = daily_adj_close['Date'].min(), daily_adj_close['Date'].max()
+    start_closes = pd.Series(_close_on(daily_adj_close, start_date, tickers), index=tickers)
+    end_closes = pd.Series(_close_on(daily_adj_close, end_date, tickers), index=tickers)
+    benchmark_daily = daily_benchmark.set_index('Date')['Close']
+    benchmark_start_close = float(benchmark_daily[benchmark_daily.index.min()])
+    benchmark_end_close = float(benchmark_daily[benchmark_daily.index.max()])
+
+    cubes = []
+    for session in trading_days(market_cal):
+        held = intervals[(intervals['First Day'] <= session) & (intervals['Last Day'] >= session)].copy()
+        if not len(held):
+            continue
+        session_tickers = sorted(set(held['Symbol']) | {benchmark})
+        closes = session_closes(session_data(session_tickers, session), session, interval, session_tickers)
+        if not len(closes):
+            continue
+
+        # Within the session every lot held on the day is held on every bar
+        held['First Day'], held['Last Day'] = closes.index[0], closes.index[-1]
+        bar_closes = closes.stack(dropna=False).rename('Close').reset_index()
+        benchmark_bars = closes[benchmark].rename('Close').reset_index()
+        valuation = matrix_portfolio_calcs(held, closes.index, benchmark_bars, bar_closes, stocks_start,
+                                           start_date=start_date, start_closes=start_closes,
+                                           benchmark_start_close=benchmark_start_close, end_closes=end_closes,
+                                           benchmark_end_close=benchmark_end_close)
+        combined_df = valuation.to_combined_df()
+        if on_session is not None:
+            on_session(session, combined_df)
+
+        cube = AggregationCube.build(combined_df)
+        cube.compute(metrics)
+        # Once summed, the cube doesn't need the rows any more
+        cube.frame = cube.codes = None
+        cubes.append(cube)
+    return AggregationCube.combine(cubes) if cubes else None
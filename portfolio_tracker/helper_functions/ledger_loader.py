@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns of mfi_log_book.csv and their types. The exported log book also carries a byte order mark and a run of
+# empty, unnamed columns after these, which are never read
+LEDGER_SCHEMA = {'Index': 'int64',
+                 'Symbol': 'category',
+                 'Security': 'object',
+                 'Qty': 'float64',
+                 'Type': 'category',
+                 'Open Date': 'object',
+                 'Adj Cost per Share': 'float64',
+                 'Adj Cost': 'float64'}
+LEDGER_COLUMNS = list(LEDGER_SCHEMA)
+
+# Date format of the 'Open Date' column, e.g. 23-Jul-20
+LEDGER_DATE_FORMAT = '%d-%b-%y'
+
+
+def read_ledger(path, chunksize=None):
+    """
+    Reads a log book CSV with an explicit schema: only the known columns are parsed, numbers go straight to floats,
+    Symbol and Type become categoricals and 'Open Date' is parsed with its fixed format rather than being inferred.
+    Given a chunksize, the file is streamed in chunks of that many rows, so that the raw text of a multi-million-row
+    ledger is never held all at once
+    :param path: Path of the log book CSV
+    :param chunksize: Rows per chunk, or None to read the file in one go
+    :return: Transactions dataframe
+    """
+    reader = pd.read_csv(path, usecols=LEDGER_COLUMNS, dtype=LEDGER_SCHEMA, encoding='utf-8-sig',
+                         chunksize=chunksize)
+
+    # Every chunk's dates are parsed as it comes in, so only one chunk's worth of date strings is around at a time
+    chunks = []
+    for chunk in [reader] if chunksize is None else reader:
+        chunk['Open Date'] = pd.to_datetime(chunk['Open Date'], format=LEDGER_DATE_FORMAT)
+        chunks.append(chunk)
+
+    # Every chunk has its own categories, so the categoricals are unioned rather than concatenated (which would turn
+    # them back into strings). The categories are kept sorted, as read_csv sorts them, so that sorting by symbol still
+    # sorts alphabetically
+    ledger = pd.concat(chunks, ignore_index=True)
+    for column, dtype in LEDGER_SCHEMA.items():
+        if dtype == 'category' and len(chunks) > 1:
+            ledger[column] = union_categoricals([chunk[column] for chunk in chunks], sort_categories=True)
+    return ledger[LEDGER_COLUMNS]
+
+
+def _file_hash(path, block_size=2 ** 20):
+    """
+    :param path: Path of a file
+    :param block_size: Bytes read at a time
+    :return: SHA-256 hex digest of the file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_ledger(path, cache_path=None, chunksize=None):
+    """
+    Loads the log book, through a binary cache of the parsed ledger when a cache_path is given. The cache is used as
+    long as the log book's size and modification time haven't changed. If they have, the log book's contents are hashed,
+    and the cache is still used if they turn out to be the same (e.g. the file was only copied or touched)
+    :param path: Path of the log book CSV
+    :param cache_path: Path of the cache file, or None to always parse the CSV
+    :param chunksize: Rows per chunk when the CSV is parsed (see read_ledger)
+    :return: Transactions dataframe
+    """
+    if cache_path is None:
+        return read_ledger(path, chunksize)
+
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = pd.read_pickle(cache_path) if os.path.exists(cache_path) else None
+    if cached is not None and cached['key'] == key:
+        return cached['ledger']
+
+    content_hash = _file_hash(path)
+    if cached is not None and cached['hash'] == content_hash:
+        ledger = cached['ledger']
+    else:
+        ledger = read_ledger(path, chunksize)
+    pd.to_pickle({'key': key, 'hash': content_hash, 'ledger': ledger}, cache_path)
+    return ledger
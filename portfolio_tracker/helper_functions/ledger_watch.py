@@ -0,0 +1,233 @@
+import os
+import time
+
+import pandas as pd
+
+from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube
+from portfolio_tracker.helper_functions.instrumentation import LOGGER
+from portfolio_tracker.helper_functions.ledger_loader import read_ledger
+from portfolio_tracker.helper_functions.market_calendar import trading_days
+from portfolio_tracker.helper_functions.multi_benchmark import EQUAL_WEIGHT, add_benchmark_columns, equal_weight_index
+from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs, _close_on
+
+
+def ledger_changes(old, new):
+    """
+    Diffs two parses of the log book. Rows are compared by their contents, so rows that were added, removed or edited
+    anywhere in the file are all found, and rows that only moved aren't
+    :param old: Previous transactions dataframe
+    :param new: New transactions dataframe
+    :return: Dict of the earliest 'Open Date' of a changed row by symbol, for every symbol with a changed row
+    """
+    def row_hashes(ledger):
+        return pd.Series(pd.util.hash_pandas_object(ledger.astype(object), index=False).to_numpy(), index=ledger.index)
+
+    old_hashes, new_hashes = row_hashes(old), row_hashes(new)
+    # Counting every distinct row on both sides catches duplicated rows being added or removed too
+    old_counts, new_counts = old_hashes.value_counts(), new_hashes.value_counts()
+    counts = pd.concat([old_counts, new_counts], axis=1).fillna(0)
+    changed = counts.index[counts.iloc[:, 0] != counts.iloc[:, 1]]
+
+    changed_rows = pd.concat([old[old_hashes.isin(changed).to_numpy()], new[new_hashes.isin(changed).to_numpy()]])
+    return changed_rows.groupby(changed_rows['Symbol'].astype(object))['Open Date'].min().to_dict()
+
+
+class WatchState:
+    """
+    The results of the tracker for a log book that keeps changing. A new trade only changes the rows of its own symbol,
+    and only from its open date on, so when the log book changes, steps 2 to 4 only run again for the symbols with a
+    changed row, over the days from the earliest change. The results are kept as a block of rows per symbol, so the
+    other rows of those symbols, and every other symbol's block, are kept as they are. Every block also has its own
+    AggregationCube, so the charts' figures are put together from the symbols' cubes without touching any rows
+    """
+
+    def __init__(self, ledger, stocks_start, daily_adj_close, daily_benchmark, market_cal, benchmark_closes=None,
+                 fetch=None):
+        """
+        Runs steps 2 to 4 over the whole log book
+        :param ledger: Transactions dataframe read from the log book
+        :param stocks_start: Start date of the analysis
+        :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+        :param daily_benchmark: Daily benchmark closes ('Date', 'Close')
+        :param market_cal: Trading days, as returned by create_market_cal
+        :param benchmark_closes: Closes of the benchmarks to add columns for (see multi_benchmark.get_benchmarks),
+                                 or None
+        :param fetch: Function taking a list of tickers and returning their daily closes (as daily_adj_close), used for
+                      tickers traded for the first time
+        """
+        self.ledger = ledger
+        self.stocks_start = pd.Timestamp(stocks_start)
+        self.daily_adj_close = daily_adj_close
+        self.daily_benchmark = daily_benchmark
+        self.days = trading_days(market_cal)
+        self.benchmark_closes = benchmark_closes
+        self.fetch = fetch
+
+        # The start and end of the price data set the cost basis and end closes of every ticker, so they're taken
+        # from all the prices once, rather than from the prices of the tickers recomputed
+        self.start_date = daily_adj_close['Date'].min()
+        self.end_date = daily_adj_close['Date'].max()
+        intervals = holding_intervals(portfolio_start_balance(ledger, self.stocks_start), self.days)
+        combined_df = matrix_portfolio_calcs(intervals, self.days, daily_benchmark, daily_adj_close,
+                                             self.stocks_start).to_combined_df()
+        self.blocks = self._split(combined_df)
+        self.cubes = {symbol: self._block_cube(block) for symbol, block in self.blocks.items()}
+
+    @staticmethod
+    def _split(combined_df):
+        """
+        :param combined_df: Output of step 4
+        :return: Dict of every symbol's rows, in day order, by symbol
+        """
+        positions = combined_df.groupby(combined_df['Symbol'].astype(object), sort=False).indices
+        return {symbol: combined_df.iloc[rows].reset_index(drop=True) for symbol, rows in positions.items()}
+
+    def _block_cube(self, block):
+        """
+        :param block: Rows of one symbol
+        :return: The symbol's AggregationCube, with every metric (the benchmarks' included) summed
+        """
+        if self.benchmark_closes is not None:
+            block = add_benchmark_columns(block, self.benchmark_closes)
+        cube = AggregationCube.build(block)
+        cube.compute()
+        # Once summed, the cube doesn't need the rows any more
+        cube.frame = cube.codes = None
+        return cube
+
+    def _categorical(self):
+        """
+        :return: Dict of the categorical dtypes of the ledger's 'Symbol' and 'Type', which the blocks are kept in
+        """
+        return {column: self.ledger[column].dtype for column in ['Symbol', 'Type']
+                if isinstance(self.ledger[column].dtype, pd.CategoricalDtype)}
+
+    def apply(self, ledger):
+        """
+        Brings the results up to date with a new parse of the log book
+        :param ledger: New transactions dataframe
+        :return: Dict of the earliest changed 'Open Date' by symbol recomputed (empty when nothing changed)
+        """
+        changes = ledger_changes(self.ledger, ledger)
+        self.ledger = ledger
+        if not changes:
+            return changes
+
+        # A new symbol or type changes the ledger's categories, which every block is brought in line with
+        categorical = self._categorical()
+        first = next(iter(self.blocks.values()), None)
+        if first is not None and any(first[column].dtype != dtype for column, dtype in categorical.items()):
+            self.blocks = {symbol: block.astype(categorical) for symbol, block in self.blocks.items()}
+
+        new_tickers = sorted(set(changes) - set(self.daily_adj_close['Ticker'].unique()))
+        if new_tickers and self.fetch is not None:
+            self.daily_adj_close = pd.concat([self.daily_adj_close, self.fetch(new_tickers)], ignore_index=True)
+            if self.benchmark_closes is not None and EQUAL_WEIGHT in self.benchmark_closes.columns:
+                symbols = ledger['Symbol'].unique()
+                self.benchmark_closes = self.benchmark_closes.drop(EQUAL_WEIGHT, axis=1).join(
+                    equal_weight_index(self.daily_adj_close, symbols))
+                # The equal-weight index is a benchmark of every symbol, so every cube changes with it
+                self.cubes = {symbol: self._block_cube(block) for symbol, block in self.blocks.items()}
+
+        self._recompute(list(changes), min(changes.values()))
+        return changes
+
+    def _recompute(self, symbols, since):
+        """
+        Runs steps 2 to 4 again for some symbols, over the trading days on or after a date, and swaps the new rows in
+        :param symbols: Symbols to recompute
+        :param since: Earliest date that changed
+        :return:
+        """
+        # A change on or before the start of the analysis changes the start balance, and with it every day
+        first_day = 0 if since <= self.stocks_start else self.days.searchsorted(since)
+        days = self.days[first_day:]
+        if not len(days):
+            return
+
+        # Lots opened before the first day recomputed, and sales made before it, all land on the first day, which
+        # leaves exactly the quantities held on that day
+        portfolio = self.ledger[self.ledger['Symbol'].isin(symbols)]
+        intervals = holding_intervals(portfolio_start_balance(portfolio, self.stocks_start), days)
+        fresh = {}
+        if len(intervals):
+            tickers = pd.Index(sorted(intervals['Symbol'].unique()))
+            prices = self.daily_adj_close[self.daily_adj_close['Ticker'].isin(tickers) &
+                                          (self.daily_adj_close['Date'] >= days[0])]
+            start_closes = pd.Series(_close_on(self.daily_adj_close, self.start_date, tickers), index=tickers)
+            valuation = matrix_portfolio_calcs(intervals, days, self.daily_benchmark, prices, self.stocks_start,
+                                               start_date=self.start_date, start_closes=start_closes,
+                                               end_date=self.end_date)
+            fresh = self._split(valuation.to_combined_df().astype(self._categorical()))
+
+        for symbol in symbols:
+            block = self.blocks.pop(symbol, None)
+            self.cubes.pop(symbol, None)
+            kept = [block[block['Date Snapshot'] < days[0]]] if block is not None else []
+            rows = pd.concat(kept + [fresh[symbol]], ignore_index=True) if symbol in fresh else \
+                (kept[0] if kept else None)
+            if rows is not None and len(rows):
+                self.blocks[symbol] = rows
+                self.cubes[symbol] = self._block_cube(rows)
+
+    def cube(self):
+        """
+        :return: AggregationCube of the whole combined dataframe, stacked from the symbols' cubes
+        """
+        return AggregationCube.combine([self.cubes[symbol] for symbol in sorted(self.cubes)])
+
+    def combined_df(self):
+        """
+        Puts the blocks together in the order a full run leaves the rows in: grouped by symbol, with the symbols in the
+        order they're first held (alphabetically among those first held on the same day)
+        :return: The combined dataframe, with the columns of every benchmark added if benchmark closes were given
+        """
+        symbols = sorted(self.blocks, key=lambda symbol: (self.blocks[symbol]['Date Snapshot'].iat[0], symbol))
+        combined_df = pd.concat([self.blocks[symbol] for symbol in symbols], ignore_index=True)
+        if self.benchmark_closes is None:
+            return combined_df
+        return add_benchmark_columns(combined_df, self.benchmark_closes)
+
+
+def watch(path, state, on_change, interval=.25, stop=None):
+    """
+    Watches the log book for changes, checking its size and modification time every interval seconds. After a change
+    the log book is parsed again, the state brought up to date, and on_change called with the changes and the new
+    AggregationCube (e.g. to render the charts again). Putting the whole combined dataframe together takes longer than
+    the update itself on large ledgers, so it's left to on_change to ask the state for it when it needs the rows
+    :param path: Path of the log book CSV
+    :param state: WatchState of the log book's current contents
+    :param on_change: Function taking the changes (see WatchState.apply) and the AggregationCube
+    :param interval: Seconds between checks
+    :param stop: Function returning True once watching should stop, or None to watch until interrupted
+    :return:
+    """
+    stat = os.stat(path)
+    last_seen = (stat.st_size, stat.st_mtime_ns)
+    try:
+        while stop is None or not stop():
+            time.sleep(interval)
+            try:
+                stat = os.stat(path)
+            except OSError as error:
+                # Editors often save by writing a new file and moving it into place, so the log book can be missing
+                # for a moment. We keep polling, and pick it up again once it's back
+                LOGGER.warning("Couldn't check %s: %s", path, error)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == last_seen:
+                continue
+            last_seen = (stat.st_size, stat.st_mtime_ns)
+            start_time = time.time()
+            try:
+                changes = state.apply(read_ledger(path))
+            except (OSError, ValueError, KeyError) as error:
+                # Most likely the file was caught half-written, the next change will bring the rest
+                LOGGER.warning("Couldn't read %s: %s", path, error)
+                continue
+            if changes:
+                LOGGER.info("Recomputed %s in %.3f seconds", ', '.join(sorted(changes)), time.time() - start_time)
+                on_change(changes, state.cube())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,187 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+# Trading calendars built so far in this process, by exchange
+_CALENDARS = {}
+
+# Bar sizes of the intraday mode, by the names yfinance uses, as pandas frequencies
+INTERVALS = {'1m': '1min', '2m': '2min', '5m': '5min', '15m': '15min', '30m': '30min', '1h': '60min'}
+
+# Regular trading session, in exchange time
+SESSION_OPEN = datetime.time(9, 30)
+SESSION_CLOSE = datetime.time(16)
+
+
+class TradingCalendar:
+    """
+    Trading days backed by a sorted datetime64[D] array. Every lookup is a binary search (numpy searchsorted), so
+    finding a day, the next or previous trading day, or a range of days is O(log n) however long the calendar is.
+    Iterating over it yields pandas Timestamps, so it can be used anywhere a list of trading days was used before.
+    """
+
+    def __init__(self, days):
+        """
+        :param days: Trading days, in any form numpy can turn into datetime64[D]
+        """
+        self.days = np.unique(np.asarray(days, dtype='datetime64[D]'))
+
+    def __len__(self):
+        return len(self.days)
+
+    def __iter__(self):
+        return iter(self.to_index())
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return TradingCalendar(self.days[item])
+        return pd.Timestamp(self.days[item])
+
+    def __contains__(self, date):
+        position = self._search(date)
+        return position < len(self.days) and self.days[position] == np.datetime64(pd.Timestamp(date).date())
+
+    def __array__(self, dtype=None):
+        return self.days.astype('datetime64[ns]') if dtype is None else self.days.astype(dtype)
+
+    def _search(self, date, side='left'):
+        return int(np.searchsorted(self.days, np.datetime64(pd.Timestamp(date).date()), side=side))
+
+    def to_index(self):
+        """
+        :return: The trading days as a pandas DatetimeIndex
+        """
+        return pd.DatetimeIndex(self.days.astype('datetime64[ns]'))
+
+    def index(self, date):
+        """
+        Position of a trading day in the calendar
+        :param date: Trading day
+        :return:
+        """
+        if date not in self:
+            raise KeyError("{} is not a trading day".format(date))
+        return self._search(date)
+
+    def next_day(self, date, inclusive=True):
+        """
+        First trading day on or after (or strictly after, when not inclusive) a date
+        :param date: Any date
+        :param inclusive: Whether the date itself counts
+        :return: Timestamp, or None past the end of the calendar
+        """
+        position = self._search(date, side='left' if inclusive else 'right')
+        return pd.Timestamp(self.days[position]) if position < len(self.days) else None
+
+    def previous_day(self, date, inclusive=True):
+        """
+        Last trading day on or before (or strictly before, when not inclusive) a date
+        :param date: Any date
+        :param inclusive: Whether the date itself counts
+        :return: Timestamp, or None before the start of the calendar
+        """
+        position = self._search(date, side='right' if inclusive else 'left') - 1
+        return pd.Timestamp(self.days[position]) if position >= 0 else None
+
+    def between(self, start, end):
+        """
+        The trading days from start to end, both inclusive
+        :param start: Start date
+        :param end: End date
+        :return: TradingCalendar
+        """
+        return TradingCalendar(self.days[self._search(start):self._search(end, side='right')])
+
+
+def trading_days(market_cal):
+    """
+    Turns a market calendar (a TradingCalendar or a list of days, as create_market_cal used to return) into a
+    DatetimeIndex
+    :param market_cal:
+    :return:
+    """
+    if isinstance(market_cal, TradingCalendar):
+        return market_cal.to_index()
+    return pd.DatetimeIndex(np.asarray(market_cal, dtype='datetime64[ns]'))
+
+
+def session_bars(market_cal, interval):
+    """
+    The intraday counterpart of the trading days: the start time of every bar of the regular session on every trading
+    day, in exchange time without a time zone, which is how the daily dates are kept too. Bars are stamped with their
+    start as yfinance does, so the first bar of a day is at 09:30 and, for 1m bars, the last one at 15:59. Early closes
+    aren't known to the calendar; their afternoon bars simply come back without prices
+    :param market_cal: Trading days, as returned by create_market_cal
+    :param interval: Bar size, one of the INTERVALS keys
+    :return: DatetimeIndex of the bars, in order
+    """
+    if interval not in INTERVALS:
+        raise ValueError("Unknown bar interval {}, expected one of {}".format(interval, ", ".join(INTERVALS)))
+    days = trading_days(market_cal)
+    step = pd.Timedelta(INTERVALS[interval])
+    session_open = pd.Timedelta(hours=SESSION_OPEN.hour, minutes=SESSION_OPEN.minute)
+    session_length = pd.Timedelta(hours=SESSION_CLOSE.hour, minutes=SESSION_CLOSE.minute) - session_open
+    # A bar that starts before the close is part of the session, even if it would run past it (as the 15:30 1h bar)
+    offsets = session_open.to_timedelta64() + step.to_timedelta64() * np.arange(-(-session_length // step))
+    return pd.DatetimeIndex((days.to_numpy()[:, None] + offsets[None, :]).ravel())
+
+
+def _build_days(exchange, start, end):
+    """
+    Uses the pandas_market_calendars library to find all trading days on an exchange within a timeframe. The library
+    is only imported here, so loading a cached calendar doesn't pay for it
+    :param exchange: Exchange name, as known to pandas_market_calendars
+    :param start: Start date
+    :param end: End date
+    :return: datetime64[D] array of trading days
+    """
+    import pandas_market_calendars as mcal
+    schedule = mcal.get_calendar(exchange).schedule(start, end)
+    return schedule.index.values.astype('datetime64[D]')
+
+
+def get_trading_calendar(start, end, exchange='NYSE', cache_dir=None, max_age=datetime.timedelta(days=30)):
+    """
+    Returns a calendar of the trading days on an exchange that covers at least start to end. Calendars are memoized in
+    the process, and in an .npz file per exchange under cache_dir when one is given. A calendar is rebuilt if it doesn't
+    cover the dates asked for, or once it's older than max_age (whether memoized or on disk), so that newly announced
+    holidays are picked up, also by long-running processes such as the service and watch mode.
+    Without a cache directory only the dates asked for are built (together with any range memoized already). The file
+    on disk is built a little wider (back to 1990 and a year into the future), so that later runs for nearby dates are
+    served from it.
+    :param start: Start date
+    :param end: End date
+    :param exchange: Exchange name, as known to pandas_market_calendars
+    :param cache_dir: Directory for the on-disk cache, or None to only memoize in the process
+    :param max_age: Age after which a calendar is rebuilt
+    :return: TradingCalendar covering the whole cached range
+    """
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    path = os.path.join(cache_dir, "{}_calendar.npz".format(exchange)) if cache_dir else None
+    now = pd.Timestamp.now()
+
+    # Memoized and cached calendars are (start, end, calendar, built at)
+    cached = _CALENDARS.get(exchange)
+    if cached is not None and now - cached[3] > max_age:
+        cached = None
+    if cached is None and path and os.path.exists(path):
+        with np.load(path) as npz:
+            built_at = pd.Timestamp(npz['built_at'].item())
+            if now - built_at <= max_age:
+                cached = (pd.Timestamp(npz['start'].item()), pd.Timestamp(npz['end'].item()),
+                          TradingCalendar(npz['days']), built_at)
+
+    if cached is None or start < cached[0] or end > cached[1]:
+        covered_start, covered_end = (start, end) if cached is None else (min(start, cached[0]), max(end, cached[1]))
+        if path:
+            covered_start = min(covered_start, pd.Timestamp('1990-01-01'))
+            covered_end = max(covered_end, now.normalize() + pd.DateOffset(years=1))
+        cached = (covered_start, covered_end, TradingCalendar(_build_days(exchange, covered_start, covered_end)), now)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(path, days=cached[2].days, start=np.datetime64(covered_start, 'D'),
+                     end=np.datetime64(covered_end, 'D'), built_at=np.datetime64(now, 's'))
+    _CALENDARS[exchange] = cached
+    return cached[2]
@@ -0,0 +1,117 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data
+from portfolio_tracker.helper_functions.step4_daily_calcs import DERIVED_COLUMNS
+
+# Name of the benchmark that equal_weight_index adds
+EQUAL_WEIGHT = 'Equal Weight'
+
+# Columns added per benchmark, as a format of the benchmark's name, in the order they're added
+BENCHMARK_METRICS = ['Equiv {} Shares', '{} Share Value', '{} Gain / (Loss)', '{} Return', 'Ticker Return vs {}']
+
+
+def benchmark_column(metric, benchmark):
+    """
+    Name of the column holding a metric for a benchmark, e.g. benchmark_column('{} Return', 'QQQ') is 'QQQ Return'
+    :param metric: One of the BENCHMARK_METRICS
+    :param benchmark: Name of the benchmark
+    :return:
+    """
+    return metric.format(benchmark)
+
+
+def benchmark_columns(columns):
+    """
+    Picks out the columns add_benchmark_columns added, leaving the primary benchmark's own columns of step 4 aside
+    :param columns: Columns of a combined dataframe
+    :return: List of the per-benchmark columns, in their order
+    """
+    patterns = [re.compile('^' + re.escape(metric).replace(r'\{\}', '.+') + '$') for metric in BENCHMARK_METRICS]
+    return [column for column in columns if column not in DERIVED_COLUMNS and
+            any(pattern.match(column) for pattern in patterns)]
+
+
+def get_benchmarks(benchmarks, start, end, **kwargs):
+    """
+    Fetches the daily closes of several benchmarks in one go and lines them up as a (days × benchmarks) matrix
+    :param benchmarks: Benchmark tickers, e.g. ['SPY', 'QQQ', 'IWM']
+    :param start: Start date
+    :param end: End date
+    :param kwargs: Passed on to get_data
+    :return: Dataframe of closes indexed by 'Date', with a column per benchmark
+    """
+    closes = get_data(list(benchmarks), start, end, **kwargs)['Close'].unstack('Ticker')
+    return closes.reindex(columns=list(benchmarks))
+
+
+def equal_weight_index(daily_adj_close, tickers=None):
+    """
+    A benchmark made of the portfolio's own tickers held in equal weights from the first date of the price data: the
+    average of every ticker's growth since then, scaled to start at 100
+    :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+    :param tickers: Tickers to include, or None for all of them
+    :return: Series of index levels by 'Date'
+    """
+    closes = daily_adj_close.pivot(index='Date', columns='Ticker', values='Close')
+    if tickers is not None:
+        closes = closes.reindex(columns=list(tickers))
+    growth = closes / closes.iloc[0]
+    return (100 * growth.mean(axis=1)).rename(EQUAL_WEIGHT)
+
+
+def portfolio_prices(portfolio_df, start, end, benchmarks, **kwargs):
+    """
+    Gets everything the valuation needs besides the log book and the calendar: the daily closes of the log book's
+    tickers and of the benchmarks, with the equal-weight index of the portfolio's own tickers joined to the latter
+    :param portfolio_df: Transactions of the log book
+    :param start: Start date
+    :param end: End date
+    :param benchmarks: Benchmark tickers, the first being the primary one
+    :param kwargs: Passed on to get_data, e.g. provider and cache
+    :return: Tuple of the daily closes of every ticker ('Ticker', 'Date', 'Close'), the benchmarks' closes as returned
+             by get_benchmarks plus the equal-weight index, and the primary benchmark's daily closes ('Date', 'Close')
+    """
+    symbols = portfolio_df['Symbol'].unique().tolist()
+    daily_adj_close = get_data(symbols, start, end, **kwargs)[['Close']].reset_index()
+    benchmark_closes = get_benchmarks(benchmarks, start, end, **kwargs)
+    benchmark_closes = benchmark_closes.join(equal_weight_index(daily_adj_close, symbols))
+    daily_benchmark = benchmark_closes[benchmarks[0]].rename('Close').reset_index()
+    return daily_adj_close, benchmark_closes, daily_benchmark
+
+
+def add_benchmark_columns(combined_df, benchmark_closes):
+    """
+    Adds the benchmark columns of step 4 for every benchmark at once: the equivalent shares the lot's cost would have
+    bought on the first date, what they're worth and have gained on the day, the benchmark's return, and the lot's
+    return relative to it. Every metric is worked out as a single (rows × benchmarks) block, so adding more benchmarks
+    costs one more column per block rather than another pass over the data.
+    As with the single benchmark, the start close is the benchmark's first close (its first available one, for a
+    benchmark whose data starts later than the others)
+    :param combined_df: Output of step 4
+    :param benchmark_closes: Closes of every benchmark, as returned by get_benchmarks
+    :return: The combined dataframe with the BENCHMARK_METRICS columns of every benchmark added
+    """
+    benchmarks = list(benchmark_closes.columns)
+    closes = benchmark_closes.sort_index()
+    start_close = closes.bfill().iloc[0].to_numpy(dtype=float)
+
+    # The benchmarks' closes on every row's day, as a (rows × benchmarks) block
+    position = closes.index.get_indexer(combined_df['Date Snapshot'])
+    day_close = np.where((position >= 0)[:, None], closes.to_numpy(dtype=float)[position], np.nan)
+
+    adj_cost = combined_df['Adj cost'].to_numpy(dtype=float)[:, None]
+    ticker_return = combined_df['Ticker Return'].to_numpy(dtype=float)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        equiv_shares = adj_cost / start_close
+        share_value = equiv_shares * day_close
+        gain = share_value - adj_cost
+        benchmark_return = day_close / start_close - 1
+        relative_return = ticker_return - benchmark_return
+
+    blocks = [equiv_shares, share_value, gain, benchmark_return, relative_return]
+    columns = [benchmark_column(metric, benchmark) for metric in BENCHMARK_METRICS for benchmark in benchmarks]
+    added = pd.DataFrame(np.hstack(blocks), columns=columns, index=combined_df.index)
+    return pd.concat([combined_df, added], axis=1)
@@ -0,0 +1,265 @@
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from portfolio_tracker.helper_functions.market_calendar import SESSION_CLOSE
+from portfolio_tracker.helper_functions.price_providers import EXCHANGE_TIME_ZONE, PRICE_COLUMNS
+
+
+class PriceCache:
+    """
+    Local SQLite store of daily bars, keyed by ticker and date, that sits in front of a download. Along with the bars
+    it records every date range that has been fetched for a ticker (including ranges that came back empty, such as
+    holidays), so only the dates that were never fetched are downloaded again.
+    Bars dated on or after the day they were fetched may still have been forming at the time, so they're only trusted
+    for `staleness`; after that they're fetched again.
+    """
+
+    def __init__(self, path, staleness=datetime.timedelta(hours=12)):
+        """
+        :param path: Path of the SQLite database file, created if it doesn't exist
+        :param staleness: How long bars fetched on or after their own date are trusted for
+        """
+        self.path = path
+        self.staleness = staleness
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS prices (ticker TEXT, date TEXT, open REAL, high REAL, low REAL, "
+                         "close REAL, adj_close REAL, volume REAL, PRIMARY KEY (ticker, date))")
+            conn.execute("CREATE TABLE IF NOT EXISTS coverage (ticker TEXT, start TEXT, end TEXT, fetched_at TEXT)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection for the duration of a block, committing on success. Every call gets its own connection, so
+        the cache can be used from several download threads at once
+        :return:
+        """
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def missing(self, ticker, start, end, now=None):
+        """
+        Finds the date ranges between start and end that aren't held, or are held but stale
+        :param ticker: Unique Stock Code
+        :param start: Start date
+        :param end: End date (inclusive)
+        :param now: Current time, defaults to datetime.datetime.now()
+        :return: List of (start, end) date ranges to fetch, in order
+        """
+        now = now or datetime.datetime.now()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT start, end, fetched_at FROM coverage WHERE ticker = ?", (ticker,)).fetchall()
+
+        # A held range is trusted up to its end, except when it's stale - then it's only trusted up to the day before
+        # it was fetched
+        held = []
+        for range_start, range_end, fetched_at in rows:
+            range_start, range_end = pd.Timestamp(range_start), pd.Timestamp(range_end)
+            fetched_at = pd.Timestamp(fetched_at)
+            if now - fetched_at > self.staleness:
+                range_end = min(range_end, fetched_at.normalize() - pd.Timedelta(days=1))
+            if range_start <= range_end:
+                held.append((range_start, range_end))
+
+        # Walk through the held ranges in order and collect the gaps between them
+        gaps = []
+        cursor, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        for range_start, range_end in sorted(held):
+            if range_start > end:
+                break
+            if range_start > cursor:
+                gaps.append((cursor, range_start - pd.Timedelta(days=1)))
+            cursor = max(cursor, range_end + pd.Timedelta(days=1))
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def store(self, ticker, df, start, end, fetched_at=None):
+        """
+        Stores downloaded bars for a ticker, replacing any held for the same dates, and records the range as fetched
+        :param ticker: Unique Stock Code
+        :param df: Downloaded bars, indexed by date
+        :param start: Start date of the range that was fetched
+        :param end: End date of the range that was fetched (inclusive)
+        :param fetched_at: Time of the download, defaults to datetime.datetime.now()
+        :return:
+        """
+        fetched_at = fetched_at or datetime.datetime.now()
+        bars = df.reindex(columns=PRICE_COLUMNS).astype(float)
+        records = [(ticker, pd.Timestamp(date).strftime('%Y-%m-%d'), *values)
+                   for date, values in zip(bars.index, bars.itertuples(index=False))]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+            rows = conn.execute("SELECT start, end, fetched_at FROM coverage WHERE ticker = ?", (ticker,)).fetchall()
+            rows.append((start, end, fetched_at))
+            conn.execute("DELETE FROM coverage WHERE ticker = ?", (ticker,))
+            conn.executemany("INSERT INTO coverage VALUES (?, ?, ?, ?)",
+                             [(ticker, range_start.strftime('%Y-%m-%d'), range_end.strftime('%Y-%m-%d'),
+                               range_fetched_at.isoformat())
+                              for range_start, range_end, range_fetched_at in _merge_coverage(rows)])
+
+    def load(self, ticker, start, end):
+        """
+        Loads the bars held for a ticker between start and end
+        :param ticker: Unique Stock Code
+        :param start: Start date
+        :param end: End date (inclusive)
+        :return: Dataframe of bars indexed by 'Date', in the same layout as yfinance
+        """
+        with self._connect() as conn:
+            df = pd.read_sql_query("SELECT date, open, high, low, close, adj_close, volume FROM prices "
+                                   "WHERE ticker = ? AND date BETWEEN ? AND ? ORDER BY date", conn,
+                                   params=(ticker, pd.Timestamp(start).strftime('%Y-%m-%d'),
+                                           pd.Timestamp(end).strftime('%Y-%m-%d')))
+        df.columns = ['Date'] + PRICE_COLUMNS
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df.set_index('Date')
+
+    def wrap(self, download):
+        """
+        Puts the cache in front of a download: only the missing ranges are downloaded (and stored), and the result is
+        then loaded from the cache
+        :param download: Callable download(ticker, start, end, timeout)
+        :return: Callable with the same signature
+        """
+
+        def cached_download(ticker, start, end, timeout):
+            for range_start, range_end in self.missing(ticker, start, end):
+                fetched_at = datetime.datetime.now()
+                self.store(ticker, download(ticker, range_start, range_end, timeout), range_start, range_end,
+                           fetched_at)
+            return self.load(ticker, start, end)
+
+        return cached_download
+
+
+def _merge_coverage(rows):
+    """
+    Merges the ranges fetched for a ticker, so the coverage table holds a handful of rows per ticker however many runs
+    have stored to it. Every range splits into its settled part, the dates before the day it was fetched (which never go
+    stale), and its fresh part, the dates from that day on. Settled parts that overlap or touch are merged into one. A
+    fresh part is kept as it is, with its own fetch time, unless a settled range or a later fetch already covers it
+    :param rows: (start, end, fetched_at) of every range
+    :return: List of (start, end, fetched_at) Timestamps of the merged ranges
+    """
+    settled, fresh = [], []
+    for row in rows:
+        range_start, range_end, fetched_at = (pd.Timestamp(value) for value in row)
+        fetched_day = fetched_at.normalize()
+        if range_start < fetched_day:
+            settled.append((range_start, min(range_end, fetched_day - pd.Timedelta(days=1)), fetched_at))
+        if range_end >= fetched_day:
+            fresh.append((max(range_start, fetched_day), range_end, fetched_at))
+
+    # A settled range is trusted up to its end whenever it was fetched, so it takes the latest fetch time of its parts
+    merged = []
+    for range_start, range_end, fetched_at in sorted(settled):
+        if merged and range_start <= merged[-1][1] + pd.Timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end), max(merged[-1][2], fetched_at))
+        else:
+            merged.append((range_start, range_end, fetched_at))
+
+    def covered(range_start, range_end, fetched_at):
+        return any(start <= range_start and range_end <= end for start, end, _ in merged) or \
+            any(start <= range_start and range_end <= end and other_fetched_at > fetched_at
+                for start, end, other_fetched_at in fresh)
+
+    return merged + [fresh_range for fresh_range in fresh if not covered(*fresh_range)]
+
+
+class IntradayStore:
+    """
+    Local store of intraday bars, one file per ticker per session: <path>/<interval>/<TICKER>/<YYYY-MM-DD>.csv (or
+    .parquet). A day of 1m bars is 390 rows per ticker, so the store keeps a session's bars together, and reading one
+    session back never touches the others. A session's bars don't change once it has closed, so a file written after
+    the close is kept for good, while one written during the session is fetched again the next time it's asked for
+    """
+
+    def __init__(self, path, file_format='csv'):
+        """
+        :param path: Directory of the store, created when the first bars are stored
+        :param file_format: 'csv' or 'parquet'
+        """
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError("Unsupported file format {}".format(file_format))
+        self.path = path
+        self.file_format = file_format
+
+    def file(self, ticker, session, interval):
+        """
+        :param ticker: Unique Stock Code
+        :param session: Trading day
+        :param interval: Bar size
+        :return: Path of the session's file
+        """
+        return os.path.join(self.path, interval, ticker,
+                            "{:%Y-%m-%d}.{}".format(pd.Timestamp(session), self.file_format))
+
+    def has(self, ticker, session, interval):
+        """
+        :param ticker: Unique Stock Code
+        :param session: Trading day
+        :param interval: Bar size
+        :return: Whether the session's bars are held, and were stored after it closed
+        """
+        path = self.file(ticker, session, interval)
+        if not os.path.exists(path):
+            return False
+        # The close is in exchange time, whatever the time zone of the machine that wrote the file
+        session_close = datetime.datetime.combine(pd.Timestamp(session).date(), SESSION_CLOSE)
+        written = pd.Timestamp(os.path.getmtime(path), unit='s', tz='UTC').tz_convert(EXCHANGE_TIME_ZONE)
+        return written.tz_localize(None) > session_close
+
+    def store(self, ticker, session, interval, df):
+        """
+        Stores the bars of a ticker over one session, replacing any held
+        :param ticker: Unique Stock Code
+        :param session: Trading day
+        :param interval: Bar size
+        :param df: Bars indexed by 'Date'
+        :return:
+        """
+        path = self.file(ticker, session, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df = df.reindex(columns=PRICE_COLUMNS).astype(float).rename_axis('Date').reset_index()
+        if self.file_format == 'csv':
+            df.to_csv(path, index=False)
+        else:
+            df.to_parquet(path, index=False)
+
+    def load(self, ticker, session, interval):
+        """
+        Loads the bars held for a ticker over one session
+        :param ticker: Unique Stock Code
+        :param session: Trading day
+        :param interval: Bar size
+        :return: Dataframe of bars indexed by 'Date'
+        """
+        path = self.file(ticker, session, interval)
+        if self.file_format == 'csv':
+            return pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+        return pd.read_parquet(path).set_index('Date')
+
+    def wrap(self, download, interval):
+        """
+        Puts the store in front of an intraday download: a session is only downloaded (and stored) when it isn't held
+        :param download: Callable download(ticker, session, interval, timeout), as IntradayProvider.download_intraday
+        :param interval: Bar size
+        :return: Callable download(ticker, session, session, timeout), the signature fetch_all calls
+        """
+
+        def stored_download(ticker, session, _, timeout):
+            if not self.has(ticker, session, interval):
+                self.store(ticker, session, interval, download(ticker, session, interval, timeout))
+            return self.load(ticker, session, interval)
+
+        return stored_download
@@ -0,0 +1,211 @@
+import abc
+import datetime
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.market_calendar import get_trading_calendar, session_bars
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+# Time zone of the exchange, which intraday bars are kept in
+EXCHANGE_TIME_ZONE = 'America/New_York'
+
+
+class EmptyDownloadError(ValueError):
+    """
+    Raised when a provider hands back no bars for a range that had trading in it, which is how yfinance reports a failed
+    download. fetch_all retries it, as it does a network error
+    """
+
+
+class PriceProvider(abc.ABC):
+    """
+    Source of daily bars for get_data and get_benchmark. A provider returns the bars of a single ticker between two
+    dates (both inclusive) as a dataframe indexed by 'Date' with the PRICE_COLUMNS, which is the layout yfinance uses.
+    requests_per_second is the rate limit get_data applies to the provider by default; None means unlimited.
+    """
+    requests_per_second = None
+
+    @abc.abstractmethod
+    def download(self, ticker, start, end, timeout=None):
+        """
+        Gets the bars of the given ticker
+        :param ticker: Unique Stock Code
+        :param start: Start date
+        :param end: End date (inclusive)
+        :param timeout: Request timeout in seconds, for providers that make requests
+        :return: Dataframe of bars indexed by 'Date'
+        """
+
+    def __call__(self, ticker, start, end, timeout=None):
+        return self.download(ticker, start, end, timeout)
+
+
+class IntradayProvider(PriceProvider):
+    """
+    Source of intraday bars as well as daily ones, for get_intraday_data and the intraday mode
+    """
+
+    @abc.abstractmethod
+    def download_intraday(self, ticker, session, interval, timeout=None):
+        """
+        Gets the intraday bars of the given ticker over one trading session
+        :param ticker: Unique Stock Code
+        :param session: Trading day
+        :param interval: Bar size, one of market_calendar.INTERVALS
+        :param timeout: Request timeout in seconds, for providers that make requests
+        :return: Dataframe of bars indexed by 'Date', the start time of every bar in exchange time
+        """
+
+
+class YFinanceProvider(IntradayProvider):
+    """
+    Downloads bars from Yahoo Finance through the yfinance library, which is only imported when it's first used
+    """
+    requests_per_second = 4.
+
+    def download(self, ticker, start, end, timeout=None):
+        # You’ll notice the end date parameter includes a timedelta shift, this is because yfinance is exclusive of the
+        # end date you provide. Since we don’t want to remember this caveat when setting our parameters, we’ll shift the
+        # date+1 here using timedelta.
+        import yfinance as yf
+        df = yf.download(ticker, start=start, end=(end + datetime.timedelta(days=1)), timeout=timeout or 30,
+                         progress=False)
+        # yfinance doesn't raise when a download fails, it hands back an empty frame. That's only a genuine answer when
+        # there was no trading in the range (a weekend or a holiday, or a day that hasn't closed yet), so otherwise it's
+        # raised as an EmptyDownloadError, for fetch_all to retry
+        if df.empty and len(get_trading_calendar(start, end).between(start, min(pd.Timestamp(end), _yesterday()))):
+            raise EmptyDownloadError("No bars downloaded for {} from {:%Y-%m-%d} to {:%Y-%m-%d}".format(
+                ticker, pd.Timestamp(start), pd.Timestamp(end)))
+        return df
+
+    def download_intraday(self, ticker, session, interval, timeout=None):
+        # Yahoo only keeps the last few weeks of 1m bars (and the last couple of months of the other intraday sizes),
+        # and stamps them with the exchange's time zone, which is dropped to line them up with the calendar's bars
+        import yfinance as yf
+        session = pd.Timestamp(session).normalize()
+        df = yf.download(ticker, start=session, end=session + datetime.timedelta(days=1), interval=interval,
+                         timeout=timeout or 30, progress=False)
+        # As with the daily bars, an empty session that has closed is a failed download
+        if df.empty and session <= _yesterday() and session in get_trading_calendar(session, session):
+            raise EmptyDownloadError("No {} bars downloaded for {} on {:%Y-%m-%d}".format(interval, ticker, session))
+        if df.index.tz is not None:
+            df.index = df.index.tz_convert(EXCHANGE_TIME_ZONE).tz_localize(None)
+        return df.rename_axis('Date')
+
+
+def _yesterday():
+    """
+    :return: Yesterday's date in exchange time, the last day whose bars are sure to be out
+    """
+    return pd.Timestamp.now(tz=EXCHANGE_TIME_ZONE).tz_localize(None).normalize() - pd.Timedelta(days=1)
+
+
+class DirectoryProvider(PriceProvider):
+    """
+    Reads bars from a directory holding one file per ticker, <TICKER>.csv or <TICKER>.parquet, each with a 'Date'
+    column. This is the offline backend: export the bars once with write, and the tracker can then run without network.
+    """
+
+    def __init__(self, path, file_format='csv'):
+        """
+        :param path: Directory holding the files
+        :param file_format: 'csv' or 'parquet'
+        """
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError("Unsupported file format {}".format(file_format))
+        self.path = path
+        self.file_format = file_format
+
+    def _file(self, ticker):
+        return os.path.join(self.path, "{}.{}".format(ticker, self.file_format))
+
+    def download(self, ticker, start, end, timeout=None):
+        if self.file_format == 'csv':
+            df = pd.read_csv(self._file(ticker), parse_dates=['Date'], index_col='Date')
+        else:
+            df = pd.read_parquet(self._file(ticker)).set_index('Date')
+        return df.sort_index().loc[pd.Timestamp(start):pd.Timestamp(end)].reindex(columns=PRICE_COLUMNS)
+
+    def write(self, ticker, df):
+        """
+        Writes the bars of a ticker into the directory
+        :param ticker: Unique Stock Code
+        :param df: Dataframe of bars indexed by 'Date'
+        :return:
+        """
+        os.makedirs(self.path, exist_ok=True)
+        df = df.reindex(columns=PRICE_COLUMNS).rename_axis('Date').reset_index()
+        if self.file_format == 'csv':
+            df.to_csv(self._file(ticker), index=False)
+        else:
+            df.to_parquet(self._file(ticker), index=False)
+
+
+class SyntheticProvider(IntradayProvider):
+    """
+    Deterministic synthetic bars: a geometric random walk over business days per ticker, seeded by the ticker and the
+    provider's seed. Every walk starts from a fixed epoch, so the bar for a given ticker and date is always the same
+    whatever range is asked for, which keeps it consistent with a PriceCache and across runs.
+    """
+    epoch = pd.Timestamp('1990-01-01')
+
+    def __init__(self, seed=0, start_price=100., drift=0.0003, volatility=0.015):
+        """
+        :param seed: Seed shared by all tickers
+        :param start_price: Price of every ticker on the epoch
+        :param drift: Mean daily log return
+        :param volatility: Standard deviation of the daily log return
+        """
+        self.seed = seed
+        self.start_price = start_price
+        self.drift = drift
+        self.volatility = volatility
+
+    def download(self, ticker, start, end, timeout=None):
+        if pd.Timestamp(start) < self.epoch:
+            raise ValueError("Synthetic prices start on {:%Y-%m-%d}".format(self.epoch))
+        # Business days since the epoch, the same days as pd.bdate_range, which builds them one at a time in Python
+        days = np.arange(np.datetime64(self.epoch, 'D'), np.datetime64(pd.Timestamp(end), 'D') + 1)
+        dates = pd.DatetimeIndex(days[np.is_busday(days)], name='Date')
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+        log_returns = rng.normal(self.drift, self.volatility, len(dates))
+        close = self.start_price * np.exp(np.cumsum(log_returns))
+        df = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Adj Close': close,
+                           'Volume': 0}, index=dates)
+        return df.loc[pd.Timestamp(start):]
+
+    def download_intraday(self, ticker, session, interval, timeout=None):
+        # The bars walk from the previous day's close to the day's own close (a Brownian bridge), so the last bar of a
+        # session always closes at the daily close, and intraday and daily runs agree at the end of every day
+        session = pd.Timestamp(session).normalize()
+        daily = self.download(ticker, max(session - pd.Timedelta(days=7), self.epoch), session)['Close']
+        bars = session_bars([session], interval).rename('Date')
+        if not len(daily) or daily.index[-1] != session:
+            return pd.DataFrame(columns=PRICE_COLUMNS, index=bars[:0])
+        previous_close = daily.iloc[-2] if len(daily) > 1 else self.start_price
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode()), session.toordinal(), len(bars)])
+        walk = np.cumsum(rng.normal(0., self.volatility / np.sqrt(len(bars)), len(bars)))
+        elapsed = np.arange(1, len(bars) + 1) / len(bars)
+        close = previous_close * np.exp(elapsed * np.log(daily.iloc[-1] / previous_close) + walk - elapsed * walk[-1])
+        open_ = np.append(previous_close, close[:-1])
+        return pd.DataFrame({'Open': open_, 'High': np.maximum(open_, close), 'Low': np.minimum(open_, close),
+                             'Close': close, 'Adj Close': close, 'Volume': 0}, index=bars)
+
+
+PROVIDERS = {'yfinance': YFinanceProvider, 'directory': DirectoryProvider, 'synthetic': SyntheticProvider}
+
+
+def make_provider(name, **kwargs):
+    """
+    Creates a provider by name, so that the provider can be picked from configuration
+    :param name: One of the PROVIDERS keys
+    :param kwargs: Passed on to the provider
+    :return:
+    """
+    if name not in PROVIDERS:
+        raise ValueError("Unknown price provider {}, expected one of {}".format(name, ", ".join(PROVIDERS)))
+    return PROVIDERS[name](**kwargs)
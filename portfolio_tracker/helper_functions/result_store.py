@@ -0,0 +1,257 @@
+import abc
+import glob
+import importlib.util
+import os
+
+import pandas as pd
+
+# Columns parsed back into dates when results are read from CSV, which doesn't keep types
+DATE_COLUMNS = ['Date Snapshot', 'Open Date', 'Date']
+
+# Partitions by period, and how their files are named
+PARTITION_FREQUENCIES = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+# Format results are written in when none is given. Parquet and Feather both need pyarrow, so without it results are
+# written as CSV rather than failing at the end of a run
+DEFAULT_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') is not None else 'csv'
+
+# File suffixes pandas recognises as compressed CSV
+CSV_COMPRESSION_SUFFIXES = {'gzip': '.gz', 'bz2': '.bz2', 'zstd': '.zst', 'xz': '.xz'}
+
+
+class ResultFormat(abc.ABC):
+    """
+    A file format results can be written in. A format writes a single dataframe to a file and reads it back, loading
+    only the columns asked for when it can. Parquet and Feather go through pyarrow, which pandas only imports once
+    they're used.
+    """
+    suffix = None
+
+    def __init__(self, compression=None):
+        """
+        :param compression: Compression codec, or None for the format's default
+        """
+        self.compression = compression
+
+    def file_suffix(self):
+        """
+        :return: Suffix of the files written in this format
+        """
+        return self.suffix
+
+    @abc.abstractmethod
+    def write(self, df, path):
+        """
+        Writes a dataframe to a file
+        :param df: Dataframe
+        :param path: Path of the file
+        :return:
+        """
+
+    @abc.abstractmethod
+    def read(self, path, columns=None):
+        """
+        Reads a dataframe from a file
+        :param path: Path of the file
+        :param columns: Columns to load, or None for all of them
+        :return:
+        """
+
+
+class ParquetFormat(ResultFormat):
+    """
+    Apache Parquet: compressed, typed and column-oriented, so a reader only decodes the columns it asks for
+    """
+    suffix = '.parquet'
+
+    def write(self, df, path):
+        df.to_parquet(path, index=False, compression=self.compression or 'zstd')
+
+    def read(self, path, columns=None):
+        return pd.read_parquet(path, columns=columns)
+
+
+class FeatherFormat(ResultFormat):
+    """
+    Arrow IPC (Feather v2): the in-memory Arrow layout on disk, which makes it the fastest to load
+    """
+    suffix = '.feather'
+
+    def write(self, df, path):
+        df.reset_index(drop=True).to_feather(path, compression=self.compression or 'zstd')
+
+    def read(self, path, columns=None):
+        return pd.read_feather(path, columns=columns)
+
+
+class CsvFormat(ResultFormat):
+    """
+    Plain CSV, as the tracker used to write. Types aren't kept, so the known date columns are parsed back on reading
+    """
+    suffix = '.csv'
+
+    def file_suffix(self):
+        return self.suffix + CSV_COMPRESSION_SUFFIXES.get(self.compression, '')
+
+    def write(self, df, path):
+        df.to_csv(path, index=False)
+
+    def read(self, path, columns=None):
+        df = pd.read_csv(path, usecols=columns)
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column])
+        return df
+
+
+FORMATS = {'parquet': ParquetFormat, 'feather': FeatherFormat, 'arrow': FeatherFormat, 'csv': CsvFormat}
+
+
+def make_format(name=None, compression=None):
+    """
+    Creates a result format by name
+    :param name: One of the keys of FORMATS, or None for the DEFAULT_FORMAT
+    :param compression: Compression codec, or None for the format's default
+    :return: ResultFormat
+    """
+    if name is None:
+        name = DEFAULT_FORMAT
+    if name not in FORMATS:
+        raise ValueError("Unknown result format {}, expected one of {}".format(name, sorted(FORMATS)))
+    return FORMATS[name](compression)
+
+
+def _format_of(path):
+    """
+    Works out the format of a result file from its suffix
+    :param path: Path of the file
+    :return: ResultFormat
+    """
+    for result_format in (ParquetFormat(), FeatherFormat()):
+        if path.endswith(result_format.suffix):
+            return result_format
+    return CsvFormat()
+
+
+def _dataset_files(path):
+    """
+    :param path: Path of a dataset, without a suffix
+    :return: The result files of the dataset: the partitions when it's a directory holding any, or else the single
+             file
+    """
+    partitions = _partition_files(path)
+    if partitions:
+        return partitions
+    return [path + suffix for suffix in _suffixes() if os.path.exists(path + suffix)]
+
+
+def _suffixes():
+    """
+    :return: Suffixes of the result files of every format
+    """
+    return ['.parquet', '.feather', '.csv'] + ['.csv' + suffix for suffix in CSV_COMPRESSION_SUFFIXES.values()]
+
+
+def _partition_files(path):
+    """
+    :param path: Path of a dataset, without a suffix
+    :return: The partition files in the dataset's directory, if any
+    """
+    if not os.path.isdir(path):
+        return []
+    return sorted(file for suffix in _suffixes() for file in glob.glob(os.path.join(path, '*' + suffix)))
+
+
+def _remove_dataset(path):
+    """
+    Removes a dataset in either layout, so that a dataset written partitioned and then unpartitioned (or the other way
+    round) doesn't leave the old one behind
+    :param path: Path of a dataset, without a suffix
+    :return:
+    """
+    for existing in _partition_files(path) + [path + suffix for suffix in _suffixes()]:
+        if os.path.exists(existing):
+            os.remove(existing)
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
+
+
+def write_results(df, path, file_format=None, compression=None, partition_by=None, date_column='Date Snapshot',
+                  replace=True):
+    """
+    Writes a result dataframe as a dataset. Unpartitioned, the dataset is a single file at path plus the format's
+    suffix. Partitioned by day, month or year, path is a directory holding one file per period, named after it (e.g.
+    2020-07.parquet), so a reader after a date range only opens the files that overlap it. Whatever the dataset held
+    before is replaced, unless replace is False, in which case only the partitions written are (e.g. to add the
+    sessions of an intraday run one at a time)
+    :param df: Dataframe to write
+    :param path: Path of the dataset, without a suffix
+    :param file_format: 'parquet', 'feather'/'arrow' or 'csv', or None for the DEFAULT_FORMAT
+    :param compression: Compression codec, or None for the format's default
+    :param partition_by: 'day', 'month', 'year' or None
+    :param date_column: Column the partitions are taken from
+    :param replace: Whether the partitions not written are removed
+    :return: Paths of the files written
+    """
+    result_format = make_format(file_format, compression)
+    if replace:
+        _remove_dataset(path)
+
+    if partition_by is None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        result_format.write(df, path + result_format.file_suffix())
+        return [path + result_format.file_suffix()]
+
+    os.makedirs(path, exist_ok=True)
+    written = []
+    periods = df[date_column].dt.to_period(PARTITION_FREQUENCIES[partition_by])
+    for period, partition in df.groupby(periods, sort=True):
+        file = os.path.join(path, str(period) + result_format.file_suffix())
+        result_format.write(partition, file)
+        written.append(file)
+    return written
+
+
+def read_results(path, columns=None, start=None, end=None, date_column='Date Snapshot'):
+    """
+    Reads a dataset written by write_results, loading only the columns asked for and, with a start or end date, only
+    the partitions overlapping that range and the rows within it
+    :param path: Path of the dataset, without a suffix
+    :param columns: Columns to load, or None for all of them
+    :param start: First date to load (inclusive), or None
+    :param end: Last date to load (inclusive), or None
+    :param date_column: Column the dates are filtered on
+    :return:
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    files = _dataset_files(path)
+    if not files:
+        raise FileNotFoundError("No results found at {}".format(path))
+
+    # Partitions are named after their period, so the ones outside the range are skipped without being opened
+    if files == _partition_files(path) and (start is not None or end is not None):
+        def overlaps(file):
+            period = pd.Period(os.path.basename(file).split('.')[0])
+            return ((start is None or period.end_time >= start) and
+                    (end is None or period.start_time <= end))
+        files = [file for file in files if overlaps(file)]
+
+    # The date column is needed to filter the rows, even when it wasn't asked for
+    filtering = start is not None or end is not None
+    load_columns = columns
+    if columns is not None and filtering and date_column not in columns:
+        load_columns = list(columns) + [date_column]
+
+    frames = [_format_of(file).read(file, load_columns) for file in files]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    if filtering:
+        in_range = pd.Series(True, index=df.index)
+        if start is not None:
+            in_range &= df[date_column] >= start
+        if end is not None:
+            in_range &= df[date_column] <= end
+        df = df[in_range].reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.aggregation_cube import aggregation_cube
+
+# Trading days in a year, which daily figures are annualised with
+TRADING_DAYS_PER_YEAR = 252
+
+# Rolling windows the risk table is worked out over by default: a month, a quarter and a year of trading days
+RISK_WINDOWS = (21, 63, 252)
+
+# Columns of the risk table, after 'Date Snapshot', 'Symbol' and 'Window'
+RISK_METRICS = ['Return', 'Volatility', 'Sharpe', 'Sortino', 'Beta', 'Tracking Error', 'Drawdown', 'Max Drawdown']
+
+# Name the whole portfolio goes by in the 'Symbol' column of the risk table
+PORTFOLIO = 'Portfolio'
+
+
+def daily_returns(df):
+    """
+    Daily returns of the portfolio, of every ticker and of the benchmark, from the combined dataframe. A ticker's
+    return is the change in its close, on the days it's held. The portfolio's return is that of the shares held at the
+    previous close, valued at today's close, so buying and selling (which changes what the portfolio is worth but
+    isn't a gain or a loss) doesn't show up as one
+    :param df: Combined dataframe, or its AggregationCube
+    :return: Tuple of a dataframe of returns indexed by 'Date Snapshot', with a PORTFOLIO column followed by a column
+             per ticker, and a Series of the benchmark's returns by 'Date Snapshot'
+    """
+    cube = aggregation_cube(df)
+    qty = cube.by_symbol(['Qty']).pivot(index='Date Snapshot', columns='Symbol', values='Qty')
+    closes = cube.by_symbol(['Symbol Adj Close'], how='mean').pivot(index='Date Snapshot', columns='Symbol',
+                                                                   values='Symbol Adj Close')
+    qty, closes = qty.reindex(cube.dates).to_numpy(dtype=float), closes.reindex(cube.dates)
+    benchmark_close = cube.by_date(['Benchmark Close'], how='mean').set_index('Date Snapshot')['Benchmark Close']
+
+    close = closes.to_numpy(dtype=float)
+    previous_close, previous_qty = np.roll(close, 1, axis=0), np.roll(qty, 1, axis=0)
+    previous_close[0], previous_qty[0] = np.nan, np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ticker_returns = close / previous_close - 1
+        # Yesterday's holdings at today's and yesterday's closes, only counting the holdings priced on both days
+        priced = ~np.isnan(ticker_returns) & (np.nan_to_num(previous_qty) != 0)
+        held_today = np.where(priced, previous_qty * close, 0.).sum(axis=1)
+        held_yesterday = np.where(priced, previous_qty * previous_close, 0.).sum(axis=1)
+        portfolio_returns = np.where(held_yesterday != 0, held_today / held_yesterday - 1, np.nan)
+
+    returns = pd.DataFrame(ticker_returns, index=closes.index, columns=closes.columns)
+    returns.insert(0, PORTFOLIO, portfolio_returns)
+    return returns.rename_axis(index='Date Snapshot', columns='Symbol'), benchmark_close.pct_change()
+
+
+def _window_sums(values, window, counts=False):
+    """
+    Sums of the values over a trailing window, for every day and every column at once. A running total down the days
+    is taken once, and the sum over any window is then the difference of two running totals, so the cost doesn't
+    depend on the length of the window. Missing values are left out
+    :param values: (days × series) array
+    :param window: Days in the window
+    :param counts: Whether to also count the values that aren't missing in every window
+    :return: (days × series) sums, or a tuple of the sums and counts
+    """
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.where(present, values, 0.), axis=0)
+    sums[window:] -= sums[:-window].copy()
+    if not counts:
+        return sums
+    n = np.cumsum(present, axis=0, dtype=float)
+    n[window:] -= n[:-window].copy()
+    return sums, n
+
+
+def _window_max_drawdown(growth, window):
+    """
+    Largest fall from a high to a later low within a trailing window, for every day and every column. Both the high and
+    the low have to fall within the same window, so a high from before the window never counts. Every window's
+    running high is taken over a strided view of the values, one series at a time, which keeps the memory to a
+    (days × window) array. That is O(days × window) work rather than a single pass: a streaming version would need a
+    monotonic queue of highs and a rescan of the lows whenever its high leaves the window, in a Python loop per day
+    :param growth: (days × series) values of every series
+    :param window: Days in the window
+    :return: (days × series) max drawdowns, as negative fractions
+    """
+    # The first days get the window they have so far, the days before the first being missing
+    padded = np.concatenate([np.full((window - 1, growth.shape[1]), np.nan), growth])
+    max_drawdown = np.empty(growth.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for column in range(growth.shape[1]):
+            windows = np.lib.stride_tricks.sliding_window_view(padded[:, column], window)
+            max_drawdown[:, column] = np.nanmin(windows / np.fmax.accumulate(windows, axis=1), axis=1) - 1
+    return max_drawdown
+
+
+def rolling_risk(returns, benchmark_returns, window, risk_free_rate=0., periods_per_year=TRADING_DAYS_PER_YEAR,
+                 min_periods=None):
+    """
+    Rolling risk figures of every series over a trailing window, each worked out from running totals in one pass but
+    Max Drawdown, which has no running-total form and takes O(days × window) per series:
+    - Return: total return over the window
+    - Volatility: annualised standard deviation of the returns
+    - Sharpe: annualised mean excess return over the risk-free rate, per unit of volatility
+    - Sortino: the same, per unit of downside deviation (below the risk-free rate)
+    - Beta: covariance with the benchmark's returns over the benchmark's variance
+    - Tracking Error: annualised standard deviation of the returns less the benchmark's
+    - Drawdown: fall from the highest value within the window
+    - Max Drawdown: the largest fall from a high to a later low, both within the window
+    The means are taken about each series' overall mean, which keeps the running totals of squares small enough that
+    differencing them doesn't lose precision
+    :param returns: Dataframe of daily returns indexed by date, with a column per series (see daily_returns)
+    :param benchmark_returns: Series of the benchmark's daily returns by date
+    :param window: Trading days in the window
+    :param risk_free_rate: Annual risk-free rate
+    :param periods_per_year: Periods in a year, for annualising
+    :param min_periods: Fewest returns in a window for it to have figures, defaults to the whole window
+    :return: Dict of (days × series) arrays by RISK_METRICS name
+    """
+    min_periods = window if min_periods is None else min_periods
+    r = returns.to_numpy(dtype=float)
+    b = np.broadcast_to(benchmark_returns.reindex(returns.index).to_numpy(dtype=float)[:, None], r.shape)
+    rf = risk_free_rate / periods_per_year
+    annualise = np.sqrt(periods_per_year)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Only the days both the series and the benchmark have a return on count towards the figures against it
+        paired = ~np.isnan(r) & ~np.isnan(b)
+        r_centre, b_centre = np.nanmean(r, axis=0), np.nanmean(np.where(paired, b, np.nan), axis=0)
+        rc = r - r_centre
+        rp, bp = np.where(paired, rc, np.nan), np.where(paired, b - b_centre, np.nan)
+        sum_r, n = _window_sums(rc, window, counts=True)
+        sum_r2 = _window_sums(rc * rc, window)
+        sum_rp, n_paired = _window_sums(rp, window, counts=True)
+        sum_b = _window_sums(bp, window)
+        sum_b2 = _window_sums(bp * bp, window)
+        sum_rb = _window_sums(rp * bp, window)
+        sum_a2 = _window_sums((rp - bp) ** 2, window)
+        downside = _window_sums(np.minimum(r - rf, 0.) ** 2, window)
+        log_growth = _window_sums(np.log1p(r), window)
+
+        mean = sum_r / n + r_centre
+        variance = (sum_r2 - sum_r * sum_r / n) / (n - 1)
+        benchmark_variance = (sum_b2 - sum_b * sum_b / n_paired) / (n_paired - 1)
+        covariance = (sum_rb - sum_rp * sum_b / n_paired) / (n_paired - 1)
+        sum_a = sum_rp - sum_b
+        active_variance = (sum_a2 - sum_a * sum_a / n_paired) / (n_paired - 1)
+        volatility = np.sqrt(np.maximum(variance, 0.))
+
+        figures = {'Return': np.expm1(log_growth),
+                   'Volatility': volatility * annualise,
+                   'Sharpe': (mean - rf) / volatility * annualise,
+                   'Sortino': (mean - rf) / np.sqrt(downside / n) * annualise,
+                   'Beta': covariance / benchmark_variance,
+                   'Tracking Error': np.sqrt(np.maximum(active_variance, 0.)) * annualise}
+
+    # The value of every series, as growth since its first return, with the days it has no return on left flat. The
+    # high of the window comes from pandas' rolling max, a single pass too
+    growth = np.exp(np.cumsum(np.nan_to_num(np.log1p(r)), axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        figures['Drawdown'] = growth / pd.DataFrame(growth).rolling(window, min_periods=1).max().to_numpy() - 1
+    figures['Max Drawdown'] = _window_max_drawdown(growth, window)
+
+    thin = n < min_periods
+    return {metric: np.where(thin, np.nan, values) for metric, values in figures.items()}
+
+
+def risk_table(df, windows=RISK_WINDOWS, risk_free_rate=0., periods_per_year=TRADING_DAYS_PER_YEAR):
+    """
+    Rolling risk figures of the portfolio and every ticker against the benchmark, over several windows, as one long
+    table: a row per day, series and window that has figures, with a column per metric. Every window is a handful of
+    passes over a (days × series) array whatever its length, so all the tickers and windows take about as long as a
+    single rolling standard deviation in pandas would for each. Max Drawdown is the exception: a high can leave the
+    window while its low stays, so every window's running high is taken afresh, O(days × window) per series, and the
+    one-year window costs several times all the other figures put together
+    :param df: Combined dataframe, or its AggregationCube
+    :param windows: Trading days in every window
+    :param risk_free_rate: Annual risk-free rate
+    :param periods_per_year: Periods in a year, for annualising
+    :return: Dataframe with 'Date Snapshot', 'Symbol' (PORTFOLIO for the whole portfolio) and 'Window' columns, and a
+             column per RISK_METRICS
+    """
+    returns, benchmark_returns = daily_returns(df)
+    n_days, n_series = returns.shape
+    tables = []
+    for window in windows:
+        figures = rolling_risk(returns, benchmark_returns, window, risk_free_rate, periods_per_year)
+        table = pd.DataFrame({'Date Snapshot': np.repeat(returns.index.to_numpy(), n_series),
+                              'Symbol': np.tile(np.arange(n_series), n_days),
+                              'Window': np.full(n_days * n_series, window)})
+        for metric in RISK_METRICS:
+            table[metric] = figures[metric].ravel()
+        tables.append(table[~np.isnan(figures['Volatility'].ravel())])
+
+    table = pd.concat(tables, ignore_index=True)
+    table['Symbol'] = pd.Categorical.from_codes(table['Symbol'], categories=returns.columns)
+    return table
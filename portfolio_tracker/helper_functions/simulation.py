@@ -0,0 +1,139 @@
+import concurrent.futures
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.risk_metrics import PORTFOLIO, TRADING_DAYS_PER_YEAR, daily_returns
+
+# Ways paths are simulated: 'bootstrap' strings together blocks of consecutive days drawn from the history, keeping its
+# fat tails and short-term autocorrelation; 'normal' draws every day from a bivariate normal with the history's mean
+# and covariance
+METHODS = ('bootstrap', 'normal')
+
+# Name the benchmark goes by in the simulation's output
+BENCHMARK = 'Benchmark'
+
+# Quantiles of the paths the fan chart draws, as bands from the outside in around the median
+FAN_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Paths simulated per chunk. A chunk's returns over a three-year horizon take about 60 MB, which bounds the memory of
+# every worker however many paths are asked for
+CHUNK_PATHS = 5000
+
+
+def paired_log_returns(df):
+    """
+    Daily log returns of the portfolio and the benchmark on the days both have one, which is what the paths are
+    resampled from. Drawing both from the same day keeps the correlation between them
+    :param df: Combined dataframe, or its AggregationCube
+    :return: (days × 2) array of the portfolio's and the benchmark's daily log returns
+    """
+    returns, benchmark_returns = daily_returns(df)
+    paired = pd.concat([returns[PORTFOLIO], benchmark_returns], axis=1).dropna()
+    return np.log1p(paired.to_numpy(dtype=float))
+
+
+def _simulate_chunk(log_returns, n_paths, horizon, points, method, block_length, seed):
+    """
+    Simulates one chunk of paths as a single batch of array operations
+    :param log_returns: (days × 2) daily log returns of the portfolio and benchmark
+    :param n_paths: Paths in the chunk
+    :param horizon: Trading days every path runs for
+    :param points: Days (counted from 0) the growth of every path is kept on
+    :param method: One of METHODS
+    :param block_length: Days in every bootstrap block
+    :param seed: SeedSequence of the chunk
+    :return: (paths × points × 2) float32 array of the growth of 1 invested in the portfolio and the benchmark
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'bootstrap':
+        # Every path is made of blocks starting on random days, cut to the horizon
+        n_blocks = -(-horizon // block_length)
+        starts = rng.integers(0, len(log_returns) - block_length + 1, size=(n_paths, n_blocks))
+        days = (starts[:, :, None] + np.arange(block_length)).reshape(n_paths, -1)[:, :horizon]
+        steps = log_returns[days]
+    else:
+        # Correlated normal draws from independent ones, through the Cholesky factor of the covariance
+        cholesky = np.linalg.cholesky(np.cov(log_returns, rowvar=False))
+        steps = rng.standard_normal((n_paths, horizon, 2))
+        steps[:, :, 1] = cholesky[1, 0] * steps[:, :, 0] + cholesky[1, 1] * steps[:, :, 1]
+        steps[:, :, 0] *= cholesky[0, 0]
+        steps += log_returns.mean(axis=0)
+    return np.exp(np.cumsum(steps, axis=1)[:, points]).astype(np.float32)
+
+
+def simulate(df, horizon=3 * TRADING_DAYS_PER_YEAR, n_paths=100000, method='bootstrap', block_length=21, seed=0,
+             n_points=100, chunk_paths=CHUNK_PATHS, max_workers=None):
+    """
+    Simulates where the portfolio and the benchmark could go from here, by resampling the daily returns the tracker
+    computed. The paths are split into chunks of chunk_paths, simulated as batched NumPy arrays and spread across a
+    process pool. Every chunk gets its own seed, spawned from seed by its position, so the same seed gives the same
+    paths whatever the number of workers (as long as chunk_paths stays the same).
+    Only n_points days of every path are kept, evenly spread over the horizon, which is plenty for a fan chart
+    :param df: Combined dataframe, or its AggregationCube
+    :param horizon: Trading days to simulate
+    :param n_paths: Number of paths
+    :param method: 'bootstrap' (block bootstrap of the history) or 'normal' (parametric Monte Carlo)
+    :param block_length: Days in every bootstrap block
+    :param seed: Seed of the simulation
+    :param n_points: Days of every path kept
+    :param chunk_paths: Paths simulated per chunk
+    :param max_workers: Worker processes, defaults to the number of CPUs; 1 simulates in this process
+    :return: Tuple of the fan (see fan_table) and a dataframe of the final growth of every path, with a PORTFOLIO and a
+             BENCHMARK column
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown simulation method {}, expected one of {}".format(method, METHODS))
+    log_returns = paired_log_returns(df)
+    if len(log_returns) < (block_length if method == 'bootstrap' else 2):
+        raise ValueError("Only {} days of returns to simulate from".format(len(log_returns)))
+
+    step = max(horizon // n_points, 1)
+    points = np.unique(np.append(np.arange(step - 1, horizon, step), horizon - 1))
+    chunks = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = (itertools.repeat(log_returns), chunks, itertools.repeat(horizon), itertools.repeat(points),
+            itertools.repeat(method), itertools.repeat(block_length), seeds)
+    if max_workers == 1:
+        growth = np.concatenate(list(map(_simulate_chunk, *args)))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+            growth = np.concatenate(list(pool.map(_simulate_chunk, *args)))
+
+    final = pd.DataFrame(growth[:, -1, :], columns=[PORTFOLIO, BENCHMARK])
+    return fan_table(growth, points + 1), final
+
+
+def fan_table(growth, days_ahead, quantiles=FAN_QUANTILES):
+    """
+    Quantiles of the simulated returns on every day kept, for the portfolio, the benchmark and the portfolio's excess
+    return over the benchmark
+    :param growth: (paths × points × 2) growth of the portfolio and benchmark
+    :param days_ahead: Trading days ahead of every point
+    :param quantiles: Quantiles to take
+    :return: Dataframe with 'Days Ahead' and 'Series' columns and a column per quantile (e.g. '5%'), of the return
+    """
+    series = {PORTFOLIO: growth[:, :, 0] - 1, BENCHMARK: growth[:, :, 1] - 1,
+              'Excess': growth[:, :, 0] - growth[:, :, 1]}
+    tables = []
+    for name, returns in series.items():
+        table = pd.DataFrame(np.quantile(returns, quantiles, axis=0).T,
+                             columns=['{:g}%'.format(100 * quantile) for quantile in quantiles])
+        table.insert(0, 'Days Ahead', days_ahead)
+        table.insert(1, 'Series', name)
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def outcome_summary(final):
+    """
+    How the simulated paths end up
+    :param final: Final growth of every path, as returned by simulate
+    :return: Dict of figures
+    """
+    excess = final[PORTFOLIO] - final[BENCHMARK]
+    return {'Paths': len(final), 'Beats Benchmark': float((excess > 0).mean()),
+            'Median Return': float(final[PORTFOLIO].median() - 1),
+            'Median Benchmark Return': float(final[BENCHMARK].median() - 1),
+            'Excess Return 5%': float(excess.quantile(0.05)), 'Excess Return 95%': float(excess.quantile(0.95))}
@@ -1,48 +1,67 @@
 import pandas as pd
-import datetime
-import yfinance as yf
-import pandas_market_calendars as mcal
+
+from portfolio_tracker.helper_functions.concurrent_fetch import fetch_all
+from portfolio_tracker.helper_functions.market_calendar import get_trading_calendar
+from portfolio_tracker.helper_functions.price_providers import IntradayProvider, YFinanceProvider
 
 
 # Step 1 — Grabbing the Data
-def create_market_cal(stocks_start, stocks_end):
+def create_market_cal(stocks_start, stocks_end, cache_dir=None):
     """
     Uses the pandas_market_calendars library to find all relevant trading days within a specified timeframe.
     This library automatically filters out non-trading days based on the market, so no need to worry about trying to
     join data to invalid dates by using something like pandas.date_range.
-    Since all stocks are US-based, so selected NYSE as calendar, and then standardized the timestamps to make them easy
+    Since all stocks are US-based, so selected NYSE as calendar. The calendar is built once and cached (in the process,
+    and on disk under cache_dir when given), and comes back as a TradingCalendar of midnight timestamps that are easy
     to join on later.
     :param stocks_start:
     :param stocks_end:
+    :param cache_dir: Directory for the on-disk calendar cache, or None to only cache in the process
     :return:
     """
-    nyse = mcal.get_calendar('NYSE')
-    schedule = nyse.schedule(stocks_start, stocks_end)
-    market_cal = mcal.date_range(schedule, frequency='1D')
-    market_cal = market_cal.tz_localize(None)
-    market_cal = [i.replace(hour=0) for i in market_cal]
-    return market_cal
+    nyse = get_trading_calendar(stocks_start, stocks_end, 'NYSE', cache_dir=cache_dir)
+    return nyse.between(stocks_start, stocks_end)
 
 
-def get_data(stocks, start, end):
+def get_data(stocks, start, end, provider=None, cache=None, max_workers=8, requests_per_second=None, retries=3,
+             backoff=1., timeout=30.):
     """
-    Takes an array of stock tickers along with a start and end date, and then grabs the data using the yfinance library.
-    You’ll notice the end date parameter includes a timedelta shift, this is because yfinance is exclusive of the end
-    date you provide. Since we don’t want to remember this caveat when setting our parameters, we’ll shift the date+1
-    here using timedelta.
+    Takes an array of stock tickers along with a start and end date, and then grabs the data from a price provider
+    (the yfinance library unless another PriceProvider is given). The tickers are downloaded concurrently over a
+    bounded thread pool, with rate limiting and retries handled by fetch_all. If a PriceCache is given, only the dates
+    it doesn't already hold are downloaded, and every ticker is then read back from the cache.
     :param stocks:
     :param start:
     :param end:
+    :param provider: PriceProvider used to fetch a single ticker, defaults to a YFinanceProvider
+    :param cache: Optional PriceCache in front of the provider
+    :param max_workers: Maximum number of downloads in flight at once
+    :param requests_per_second: Rate limit across all downloads, defaults to the provider's own; 0 for no limit
+    :param retries: Number of retries per ticker
+    :param backoff: Seconds to wait before the first retry, doubling on every retry after that
+    :param timeout: Per-ticker request timeout in seconds
     :return:
     """
+    provider = provider or YFinanceProvider()
+    if requests_per_second is None:
+        requests_per_second = provider.requests_per_second
+
+    # With a cache, only the tickers that are missing dates go through fetch_all (and its rate limiter) at all
+    to_fetch = stocks if cache is None else [ticker for ticker in stocks if cache.missing(ticker, start, end)]
+    download = provider.download if cache is None else cache.wrap(provider.download)
+    downloads = fetch_all(to_fetch, download, start, end, max_workers=max_workers,
+                          requests_per_second=requests_per_second, retries=retries, backoff=backoff, timeout=timeout)
+    if cache is not None:
+        downloads = {ticker: downloads[ticker] if ticker in downloads else cache.load(ticker, start, end)
+                     for ticker in stocks}
 
     def data(ticker):
         """
-        Gets the data of the given ticker
+        Tags the data of the given ticker with its symbol
         :param ticker: Unique Stock Code
         :return:
         """
-        df = yf.download(ticker, start=start, end=(end + datetime.timedelta(days=1)))
+        df = downloads[ticker]
         df['symbol'] = ticker
         df.index = pd.to_datetime(df.index)
         return df
@@ -51,15 +70,55 @@ def get_data(stocks, start, end):
     return pd.concat(datas, keys=stocks, names=['Ticker', 'Date'], sort=True)
 
 
-def get_benchmark(benchmark, start, end):
+def get_intraday_data(stocks, session, interval, provider=None, store=None, max_workers=8, requests_per_second=None,
+                      retries=3, backoff=1., timeout=30.):
+    """
+    The intraday version of get_data, for a single session at a time: the bars of every ticker over one trading day,
+    downloaded concurrently through fetch_all. With an IntradayStore, sessions already held are read from it instead
+    :param stocks:
+    :param session: Trading day
+    :param interval: Bar size, e.g. '1m', '5m' or '1h'
+    :param provider: IntradayProvider, defaults to a YFinanceProvider
+    :param store: Optional IntradayStore in front of the provider
+    :param max_workers: Maximum number of downloads in flight at once
+    :param requests_per_second: Rate limit across all downloads, defaults to the provider's own; 0 for no limit
+    :param retries: Number of retries per ticker
+    :param backoff: Seconds to wait before the first retry, doubling on every retry after that
+    :param timeout: Per-ticker request timeout in seconds
+    :return: Dataframe of closes with 'Ticker', 'Date' (the bar's start time) and 'Close' columns
+    """
+    provider = provider or YFinanceProvider()
+    if not isinstance(provider, IntradayProvider):
+        raise TypeError("{} has no intraday bars".format(type(provider).__name__))
+    if requests_per_second is None:
+        requests_per_second = provider.requests_per_second
+    session = pd.Timestamp(session).normalize()
+
+    def download(ticker, start, end, timeout):
+        return provider.download_intraday(ticker, start, interval, timeout)
+
+    to_fetch = stocks if store is None else [ticker for ticker in stocks if not store.has(ticker, session, interval)]
+    downloads = fetch_all(to_fetch, download if store is None else store.wrap(provider.download_intraday, interval),
+                          session, session, max_workers=max_workers, requests_per_second=requests_per_second,
+                          retries=retries, backoff=backoff, timeout=timeout)
+    if store is not None:
+        downloads = {ticker: downloads[ticker] if ticker in downloads else store.load(ticker, session, interval)
+                     for ticker in stocks}
+
+    closes = pd.concat([downloads[ticker]['Close'] for ticker in stocks], keys=stocks, names=['Ticker', 'Date'])
+    return closes.rename('Close').reset_index()
+
+
+def get_benchmark(benchmark, start, end, **kwargs):
     """
     Function just feeds into get_data and then drops the ticker symbol
     :param benchmark:
     :param start:
     :param end:
+    :param kwargs: Passed on to get_data
     :return:
     """
-    benchmark = get_data(benchmark, start, end)
+    benchmark = get_data(benchmark, start, end, **kwargs)
     benchmark = benchmark.drop(['symbol'], axis=1)
     benchmark.reset_index(inplace=True)
     return benchmark
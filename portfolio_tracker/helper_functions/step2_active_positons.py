@@ -1,53 +1,46 @@
+import numpy as np
 import pandas as pd
 
 
 #  Step 2 — Finding our Initial Active Portfolio
-def position_adjust(daily_positions, sale):
+def position_adjust(daily_positions, sales):
     """
-
-    :param daily_positions:
-    :param sale:
-    :return:
+    FIFO matching engine. Takes the positions held and a per-symbol total of the quantity sold, and returns every buy
+    lot of a sold symbol with its quantity reduced oldest-lot-first. Lots that were fully sold come back with a
+    quantity of 0, exactly as before, so callers still filter on Qty > 0 afterwards.
+    :param daily_positions: Transactions dataframe (only the 'Buy' rows are matched)
+    :param sales: Dataframe with one row per symbol holding the total quantity sold ('Symbol', 'Qty')
+    :return: Buy lots of every sold symbol, with adjusted quantities
     """
-    # First, we’ll create an empty dataframe called stocks_with_sales where we’ll later add adjusted positions, and
-    # another dataframe holding all of the transactions labeled as ‘buys’
-    # Remember that we already filtered out ‘buys in the future’ in the portfolio_start_balance function, so no need
-    # to do it again here. You’ll also notice that we’re sorting by ‘Open Date’, and that will be important given we
-    # want to subtract positions using the FIFO method. By sorting the dates, we know we can move iteratively through a
-    # list of old-to-new positions
-    stocks_with_sales = pd.DataFrame()
-    buys_before_start = daily_positions[daily_positions['Type'] == 'Buy'].sort_values(by='Open Date')
+    # First, we’ll take all of the transactions labeled as ‘buys’ for the symbols that have a sale, and sort them by
+    # symbol and ‘Open Date’. Sorting is what gives us FIFO: within a symbol the lots now run old-to-new. The sort is
+    # stable, so lots opened on the same day keep their ledger order
+    sold_qty = sales.groupby('Symbol')['Qty'].sum()
+    buys = daily_positions[(daily_positions['Type'] == 'Buy') & daily_positions['Symbol'].isin(sold_qty.index)]
+    buys = buys.sort_values(by=['Symbol', 'Open Date'], kind='mergesort')
+
+    # Rather than walking the lots one at a time and subtracting the sale from each, we work out in one pass how much
+    # of every lot has been eaten by the sale. With a running total of the quantity bought per symbol (cum_qty):
+    #   every lot whose running total is ≤ the quantity sold is fully sold, so it drops to 0
+    #   the first lot whose running total is > the quantity sold is partly sold, and keeps (cum_qty - sold)
+    #   every later lot is untouched, and keeps its full quantity
+    # which is the same as clipping (cum_qty - sold) to the range [0, Qty]
+    qty = buys['Qty'].to_numpy(dtype=float)
+    cum_qty = buys.groupby('Symbol', sort=False)['Qty'].cumsum().to_numpy(dtype=float)
+    sold = buys['Symbol'].map(sold_qty).to_numpy(dtype=float)
 
-    # Now that we have all buys in a single dataframe, we’re going to filter for all buys where the stock symbol
-    # matches the stock symbol of the sold position.
-    # You’ll notice that we’re using indexing to access the ‘Symbol’ column in our data. That’s because using iterrows()
-    # creates a tuple from the index [0] and the series of data [1]. This is the same reason we’ll use indexing when we
-    # loop through buys_before_start.
-    # So what’s happening in the loop here is that for every buy in buys_before_start:
-    #   If the quantity of the oldest buy amount is ≤ the sold quantity (you sold more than your initial purchase amnt),
-    #       subtract the amount of the buy position from the sell,
-    #       then set the buy quantity to 0
-    #   Else (the amount you bought on a certain day > the quantity sold),
-    #       subtract the sales quantity from the buy position,
-    #       then subtract that same amount from the sales position
-    #   Append that adjusted position to our empty stock_with_sales dataframe
-    for position in buys_before_start[buys_before_start['Symbol'] == sale[1]['Symbol']].iterrows():
-        if position[1]['Qty'] <= sale[1]['Qty']:
-            sale[1]['Qty'] -= position[1]['Qty']
-            position[1]['Qty'] = 0
-        else:
-            position[1]['Qty'] -= sale[1]['Qty']
-            sale[1]['Qty'] -= sale[1]['Qty']
-        stocks_with_sales = stocks_with_sales.append(position[1])
+    stocks_with_sales = buys.copy()
+    stocks_with_sales['Qty'] = np.minimum(qty, np.maximum(cum_qty - sold, 0))
     return stocks_with_sales
 
 
 def portfolio_start_balance(portfolio, start_date):
     """
-
-    :param portfolio:
-    :param start_date:
-    :return:
+    Works out the active holdings on the start date: every buy up to and including the start date with the sales
+    before it netted off FIFO, plus the sales on or after the start date so that holding_intervals can apply them later.
+    :param portfolio: Transactions dataframe read from the log book
+    :param start_date: Start date of the analysis
+    :return: Active positions as of the start date, along with the future sales
     """
     # First, we supply our CSV data and start date to the portfolio_start_balance function and create a dataframe of all
     # trades that happened before our start date. We’ll then check to see if there are future sales after the start_date
@@ -62,21 +55,13 @@ def portfolio_start_balance(portfolio, start_date):
 
     # Next, we’ll make a final dataframe of positions that did not have any sales occur over the specified time period
     positions_no_change = positions_before_start[~positions_before_start['Symbol'].isin(sales['Symbol'].unique())]
-    adj_positions_df = pd.DataFrame()
 
-    # Now we’ll loop through every sale in our sales dataframe, call our position_adjust function, and then append the
-    # output of that into our empty adj_postitions_df
-    for sale in sales.iterrows():
-        adj_positions = position_adjust(positions_before_start, sale)
-        adj_positions_df = adj_positions_df.append(adj_positions)
+    # Now we net every sale off against its buys in a single call to our position_adjust function
+    adj_positions_df = position_adjust(positions_before_start, sales)
 
-    # Once loops (for position in buys_before_start[buys_before_start['Symbol'] == sale[1]['Symbol']].iterrows())
-    # goes through every sales position your code will now execute the final lines:
-    adj_positions_df = adj_positions_df.append(positions_no_change)
-    adj_positions_df = adj_positions_df.append(future_sales)
+    # Finally we add back positions that never had sales, add back sales that occur in the future, and filter out any
+    # rows that position_adjust zeroed out. You should now have an accurate record of your active holdings as of the
+    # start date!
+    adj_positions_df = pd.concat([adj_positions_df, positions_no_change, future_sales])
     adj_positions_df = adj_positions_df[adj_positions_df['Qty'] > 0]
-
-    # So we’re taking our adjusted positions in adj_positions_df, adding back positions that never had sales, adding
-    # back sales that occur in the future, and finally filtering out any rows that position_adjust zeroed out.
-    # You should now have an accurate record of your active holdings as of the start date!
     return adj_positions_df
@@ -1,63 +1,128 @@
+import numpy as np
 import pandas as pd
-from portfolio_tracker.helper_functions.step2_active_positons import position_adjust
+from portfolio_tracker.helper_functions.market_calendar import trading_days
 
 
 # Step 3 — Creating Daily Performance Snapshots.
 # So now that we have an accurate statement of positions held at the start date, let’s create daily performance data!
-# Our strategy is similar to what we did in step 2, in fact, we’ll re-use the position_adjust method again since we’ll
-# need to account for potential sales within our date range. We’ll go ahead and create two new functions, time_fill and
-# fifo
-def fifo(daily_positions, sales, date):
+# Our strategy is similar to what we did in step 2: we net every sale off FIFO against the buys. Rather than copying
+# the portfolio for every trading day, though, we encode the holdings as lot intervals, which the valuation engine
+# then expands into daily snapshots only where it needs them
+def _count_before(group, value, query_group, query_value, inclusive):
     """
-    Takes your active portfolio positions, the sales dataframe created in time_fill, and the
-    current date in the market_cal list
-    :param daily_positions:
-    :param sales:
-    :param date:
-    :return:
-    """
-    # Our fifo function takes your active portfolio positions, the sales dataframe created in time_fill, and the
-    # current date in the market_cal list. It then filters sales to find any that have occurred on the current date,
-    # and create a dataframe of positions not affected by sales
-    sales = sales[sales['Open Date'] == date]
-    daily_positions = daily_positions[daily_positions['Open Date'] <= date]
-    positions_no_change = daily_positions[~daily_positions['Symbol'].isin(sales['Symbol'].unique())]
-
-    # We’ll then use our trusty position_adjust function to zero-out any positions with active sales. If there were no
-    # sales for the specific date, our function will simply append the positions_no_change onto the empty adj_positions
-    # dataframe, leaving you with an accurate daily snapshot of positions:
-    adj_positions = pd.DataFrame()
-    for sale in sales.iterrows():
-        adj_positions = adj_positions.append(position_adjust(daily_positions, sale))
-    adj_positions = adj_positions.append(positions_no_change)
-    adj_positions = adj_positions[adj_positions['Qty'] > 0]
-    return adj_positions
-
-
-def time_fill(portfolio, market_cal):
+    For every query, counts the (group, value) pairs that sort before it - i.e. all pairs of earlier groups plus the
+    pairs of the same group whose value is below the query value (or equal to it, when inclusive). As long as the pairs
+    are sorted, that count is also the position of the first pair that doesn't sort before the query, which makes this
+    a searchsorted that runs within every group at once.
+    :param group: Sorted group codes of the pairs
+    :param value: Values of the pairs, sorted within each group
+    :param query_group: Group codes of the queries
+    :param query_value: Values of the queries
+    :param inclusive: Whether pairs equal to the query value are counted
+    :return: Number of pairs before every query
     """
+    n_pairs = len(group)
+    is_query = np.concatenate([np.zeros(n_pairs, dtype=bool), np.ones(len(query_group), dtype=bool)])
+
+    # On a tie the query sorts after the pairs when inclusive, so they're counted, and before them when not
+    tie_break = is_query if inclusive else ~is_query
+    order = np.lexsort((tie_break, np.concatenate([value, query_value]), np.concatenate([group, query_group])))
+    pairs_so_far = np.cumsum(~is_query[order])
+
+    counts = np.empty(len(query_group), dtype=np.int64)
+    counts[order[is_query[order]] - n_pairs] = pairs_so_far[is_query[order]]
+    return counts
+
 
-    :param portfolio:
-    :param market_cal:
-    :return:
+def holding_intervals(portfolio, market_cal):
     """
+    Encodes the holdings over time as lot intervals rather than one snapshot per day: every row is a buy lot together
+    with the quantity held, and the first and last trading day it was held at that quantity. A lot that is never sold
+    is a single row, and every sale that eats into a lot starts a new row for it.
+    :param portfolio: Active positions, as returned by portfolio_start_balance
+    :param market_cal: Trading days, as returned by create_market_cal
+    :return: Dataframe of lot intervals with 'Lot', 'First Day' and 'Last Day' columns
+    """
+    days = trading_days(market_cal)
+    n_days = len(days)
+
+    # Similar to position_adjust, we sort the buys by symbol and ‘Open Date’ so that within a symbol the lots run
+    # old-to-new, and take a running total of the quantity bought. Every lot starts being held on the first trading day
+    # on or after its open date
+    buys = portfolio[portfolio['Type'] == 'Buy'].sort_values(by=['Symbol', 'Open Date'], kind='mergesort')
+    lot_symbol, symbols = pd.factorize(buys['Symbol'])
+    lot_open = days.searchsorted(buys['Open Date'].values)
+    qty = buys['Qty'].to_numpy(dtype=float)
+    cum_qty = buys.groupby('Symbol', sort=False)['Qty'].cumsum().to_numpy(dtype=float)
+    prev_cum_qty = cum_qty - qty
+
+    # Sales are our events. A sale takes effect on the first trading day on or after it, and sales landing on the same
+    # trading day are added up. Sales after the last trading day can't affect anything, so they're dropped
+    sells = portfolio[(portfolio['Type'] == 'Sell') & portfolio['Symbol'].isin(symbols)]
+    sales = pd.DataFrame({'Symbol': symbols.get_indexer(sells['Symbol']),
+                          'Day': days.searchsorted(sells['Open Date'].values),
+                          'Qty': sells['Qty'].to_numpy(dtype=float)})
+    sales = sales[sales['Day'] < n_days].groupby(['Symbol', 'Day'])['Qty'].sum().reset_index()
+    sale_symbol = sales['Symbol'].to_numpy()
+    sale_day = sales['Day'].to_numpy()
+
+    # A sale can only eat into lots that were bought by the day it happens, so we need the quantity bought by then
+    # (bought_by_day) ...
+    lots_by_day = _count_before(lot_symbol, lot_open, sale_symbol, sale_day, inclusive=True)
+    last_lot = np.maximum(lots_by_day - 1, 0)
+    bought_by_day = np.where((lots_by_day > 0) & (lot_symbol[last_lot] == sale_symbol), cum_qty[last_lot], 0.)
 
-    # Similar to portfolio_start_balance, our goal is to provide our dataframe of active positions, find the sales, and
-    # zero-out sales against buy positions. The main difference here is that we are going to loop through using our
-    # market_cal list with valid trading days
-    sales = portfolio[portfolio['Type'] == 'Sell'].groupby(['Symbol', 'Open Date'])['Qty'].sum()
-    sales = sales.reset_index()
-    per_day_balance = []
-    for date in market_cal:
-        if (sales['Open Date'] == date).any():
-            portfolio = fifo(portfolio, sales, date)
-
-        # This way we can go day-by-day and see if any sales occurred, adjust positions correctly, and then return a
-        # correct snapshot of the daily data. In addition, we’ll also filter to positions that have occurred before or
-        # at the current date and make sure there are only buys. We’ll then add a Date Snapshot column with the current
-        # date in the market_cal loop, then append it to our per_day_balance list
-        daily_positions = portfolio[portfolio['Open Date'] <= date]
-        daily_positions = daily_positions[daily_positions['Type'] == 'Buy']
-        daily_positions['Date Snapshot'] = date
-        per_day_balance.append(daily_positions)
-    return per_day_balance
+    # ... and then the total quantity consumed by the end of every sale is
+    #   consumed(k) = min(consumed(k - 1) + sold(k), bought_by_day(k))
+    # which unrolls to the running total sold, less the biggest shortfall of holdings seen so far
+    sold = sales.groupby('Symbol')['Qty'].cumsum().to_numpy()
+    shortfall = pd.Series(bought_by_day - sold).groupby(sale_symbol).cummin().to_numpy()
+    consumed = sold + np.minimum(shortfall, 0)
+
+    # A lot is untouched until the first sale whose consumed total goes past the start of the lot (first_sale), and is
+    # fully sold once the consumed total reaches its end (sold_out). In between, every sale leaves it with
+    # (cum_qty - consumed) clipped to [0, Qty], just like position_adjust
+    symbol_sales_end = np.searchsorted(sale_symbol, np.arange(len(symbols)), side='right')[lot_symbol]
+    first_sale = _count_before(sale_symbol, consumed, lot_symbol, prev_cum_qty, inclusive=True)
+    sold_out = _count_before(sale_symbol, consumed, lot_symbol, cum_qty, inclusive=False)
+    last_sale = np.minimum(sold_out, symbol_sales_end - 1)
+
+    # One row for the lot before its first sale, and one per sale after that. The row for a sale runs until the day
+    # before the symbol's next sale, or the last trading day if there isn't one
+    n_rows = 1 + np.maximum(last_sale - first_sale + 1, 0)
+    lot = np.repeat(np.arange(len(buys)), n_rows)
+    row = np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    sale = first_sale[lot] + row - 1
+    next_sale = sale + 1
+    padded_sale_day = np.append(sale_day, n_days)
+
+    first_day = np.where(row == 0, lot_open[lot], padded_sale_day[np.maximum(sale, 0)])
+    last_day = np.where(next_sale < symbol_sales_end[lot], padded_sale_day[next_sale], n_days) - 1
+    interval_qty = np.where(row == 0, qty[lot],
+                            np.clip(cum_qty[lot] - np.append(consumed, 0.)[np.maximum(sale, 0)], 0, qty[lot]))
+
+    # Finally, we drop intervals that end before they start (lots bought and sold on the same day, or opened after the
+    # last trading day) along with the ones where the lot was fully sold
+    keep = (first_day <= last_day) & (interval_qty > 0)
+    intervals = buys.iloc[lot[keep]].copy()
+    intervals['Qty'] = interval_qty[keep]
+    intervals['Lot'] = intervals.index
+    intervals['First Day'] = days[first_day[keep]]
+    intervals['Last Day'] = days[last_day[keep]]
+    return intervals
+
+
+def interval_day_positions(intervals, days):
+    """
+    Positions of the (interval, trading day) pairs covered by lot intervals, ordered by day and then by interval
+    :param intervals: Lot intervals, as returned by holding_intervals
+    :param days: Trading days as a DatetimeIndex
+    :return: Tuple of interval positions and day positions
+    """
+    # Every interval is repeated once for each trading day it covers
+    first_day = days.searchsorted(intervals['First Day'].values)
+    n_rows = days.searchsorted(intervals['Last Day'].values) - first_day + 1
+    interval = np.repeat(np.arange(len(intervals)), n_rows)
+    day = first_day[interval] + np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    order = np.argsort(day, kind='mergesort')
+    return interval[order], day[order]
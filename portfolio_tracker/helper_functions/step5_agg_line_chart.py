@@ -1,98 +1,228 @@
+import itertools
+
 import pandas as pd
-import plotly.express as px
-from plotly.offline import plot
-from bokeh.plotting import figure, output_file, show
-from bokeh.models import ColumnDataSource
 
-from portfolio_tracker.helper_functions.bokeh_helpers import plot_new_graph, set_graph_and_legend_properties
+from portfolio_tracker.helper_functions.aggregation_cube import aggregation_cube
+from portfolio_tracker.helper_functions.downsample import downsample_line
+from portfolio_tracker.helper_functions.instrumentation import stage
+from portfolio_tracker.helper_functions.multi_benchmark import benchmark_column
+from portfolio_tracker.helper_functions.result_store import write_results
+
+# Line colours of the benchmarks other than the S&P500 on the MFI chart, in order
+BENCHMARK_COLOURS = ["orange", "dodgerblue", "violet", "gold", "cyan", "silver"]
+
+# Most points drawn per line on the Bokeh chart, a few per pixel of a wide screen
+MAX_POINTS_PER_LINE = 2000
+
+# Plotly and Bokeh are slow to import, so each chart imports the one it draws with when it's drawn, and a run that only
+# computes the results never loads either
 
 
-def line(df, val_1, val_2):
+def line(df, val_1, val_2, results_format=None):
     """
     Takes your completed dataframe and two metrics you want to plot against each other
-    :param df:
+    :param df: Combined dataframe, or its AggregationCube
     :param val_1:
     :param val_2:
+    :param results_format: Format the grouped metrics are saved in ('parquet', 'feather' or 'csv'), or None for the
+                           default of result_store
     :return:
     """
-    grouped_metrics = df.groupby(['Date Snapshot'])[[val_1, val_2]].sum().reset_index()
-    grouped_metrics = pd.melt(grouped_metrics, id_vars=['Date Snapshot'],
-                              value_vars=[val_1, val_2])
-    grouped_metrics.to_csv("grouped_metrics.csv")
-    fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
-                  color='variable')
-    plot(fig)
+    with stage('aggregation') as record:
+        grouped_metrics = aggregation_cube(df).by_date([val_1, val_2])
+        grouped_metrics = pd.melt(grouped_metrics, id_vars=['Date Snapshot'],
+                                  value_vars=[val_1, val_2])
+        record.rows_out = len(grouped_metrics)
+    with stage('render', rows_in=len(grouped_metrics)):
+        import plotly.express as px
+        from plotly.offline import plot
+        write_results(grouped_metrics, "grouped_metrics", results_format)
+        fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
+                      color='variable')
+        plot(fig)
 
 
 def line_facets(df, val_1, val_2):
     """
     Generate a chart per ticker that compares the benchmark against each ticker’s performance
-    :param df:
+    :param df: Combined dataframe, or its AggregationCube
     :param val_1:
     :param val_2:
     :return:
     """
-    grouped_metrics = df.groupby(['Symbol', 'Date Snapshot'])[[val_1, val_2]].sum().reset_index()
-    grouped_metrics = pd.melt(grouped_metrics, id_vars=['Symbol', 'Date Snapshot'],
-                              value_vars=[val_1, val_2])
-    fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
-                  color='variable', facet_col="Symbol", facet_col_wrap=5)
-    plot(fig)
+    with stage('aggregation') as record:
+        grouped_metrics = aggregation_cube(df).by_symbol([val_1, val_2])
+        grouped_metrics = pd.melt(grouped_metrics, id_vars=['Symbol', 'Date Snapshot'],
+                                  value_vars=[val_1, val_2])
+        record.rows_out = len(grouped_metrics)
+    with stage('render', rows_in=len(grouped_metrics)):
+        import plotly.express as px
+        from plotly.offline import plot
+        fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
+                      color='variable', facet_col="Symbol", facet_col_wrap=5)
+        plot(fig)
 
 
-def total_return(df, val_1, val_2):
+def total_return(df, val_1, val_2, results_format=None):
     """
     Takes your completed dataframe and two metrics you want to plot against each other
-    :param df:
+    :param df: Combined dataframe, or its AggregationCube
     :param val_1:
     :param val_2:
+    :param results_format: Format the grouped metrics are saved in ('parquet', 'feather' or 'csv'), or None for the
+                           default of result_store
     :return:
     """
-    grouped_metrics = df.groupby(['Date Snapshot'])[[val_1, val_2]].sum().reset_index()
-    grouped_metrics = pd.melt(grouped_metrics, id_vars=['Date Snapshot'],
-                              value_vars=[val_1, val_2])
-    grouped_metrics.to_csv("grouped_metrics.csv")
-    fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
-                  color='variable')
-    plot(fig)
+    with stage('aggregation') as record:
+        grouped_metrics = aggregation_cube(df).by_date([val_1, val_2])
+        grouped_metrics = pd.melt(grouped_metrics, id_vars=['Date Snapshot'],
+                                  value_vars=[val_1, val_2])
+        record.rows_out = len(grouped_metrics)
+    with stage('render', rows_in=len(grouped_metrics)):
+        import plotly.express as px
+        from plotly.offline import plot
+        write_results(grouped_metrics, "grouped_metrics", results_format)
+        fig = px.line(grouped_metrics, x="Date Snapshot", y="value",
+                      color='variable')
+        plot(fig)
 
 
-def mfi_vs_spy(df, val_1, val_2):
+def mfi_vs_spy(df, val_1, val_2, benchmarks=None, max_points=MAX_POINTS_PER_LINE, downsample='lttb',
+               open_browser=True, fan=None):
     """
-    Takes your completed dataframe and two metrics you want to plot against each other
-    :param df:
+    Takes your completed dataframe and two metrics you want to plot against each other. With a list of benchmarks, the
+    portfolio is plotted against each of them instead of val_2, using the '<benchmark> Return' columns added by
+    multi_benchmark.add_benchmark_columns, so any subset of the benchmarks computed can be shown.
+    Every line is thinned out to at most max_points points before it goes into the page, and drawn with WebGL, so the
+    HTML stays small and the chart responsive however long the history is
+    :param df: Combined dataframe, or its AggregationCube
     :param val_1:
     :param val_2:
+    :param benchmarks: Benchmarks to plot against, e.g. ['SPY', 'QQQ'], or None for val_2 alone
+    :param max_points: Maximum number of points per line, or None to draw every day
+    :param downsample: How lines are thinned out, 'lttb' or 'minmax' (see downsample.downsample_line)
+    :param open_browser: Whether to open the chart in the browser, or only write mfi_vs_spy.html (e.g. when redrawing
+                         it on every change of the log book, which a reload of the open page then picks up)
+    :param fan: Fan of simulated returns, as returned by simulation.simulate, drawn next to the chart, or None
     :return:
     """
-    grouped_metrics = df.groupby(['Date Snapshot'])[[val_1, val_2]].sum().reset_index()
+    lines = {'SPY': val_2} if benchmarks is None else \
+        {benchmark: benchmark_column('{} Return', benchmark) for benchmark in benchmarks}
+    with stage('aggregation') as record:
+        grouped_metrics = aggregation_cube(df).by_date([val_1] + list(lines.values()))
+        record.rows_out = len(grouped_metrics)
     # grouped_metrics.to_csv("grouped_metrics_1.csv")
+
+    with stage('downsample', rows_in=len(grouped_metrics)) as record:
+        sources = {column: _line_source(grouped_metrics, column, max_points, downsample)
+                   for column in [val_1] + list(lines.values())}
+        record.rows_out = sum(len(source['Date Snapshot']) for source in sources.values())
+
+    with stage('render', rows_in=len(grouped_metrics)):
+        _render_mfi_vs_spy(sources, val_1, lines, open_browser, fan)
+
+
+def _line_source(grouped_metrics, column, max_points, downsample):
+    """
+    Builds the source of one line of a chart, thinned out to at most max_points points
+    :param grouped_metrics: Daily totals
+    :param column: Column drawn
+    :param max_points: Maximum number of points, or None for all of them
+    :param downsample: 'lttb' or 'minmax'
+    :return: Dict of the 'Date Snapshot' and column values, the data of the line's ColumnDataSource
+    """
+    dates, values = downsample_line(grouped_metrics['Date Snapshot'].to_numpy(), grouped_metrics[column].to_numpy(),
+                                    max_points, downsample)
+    return {'Date Snapshot': dates, column: values}
+
+
+def _render_mfi_vs_spy(sources, val_1, lines, open_browser=True, fan=None):
+    """
+    Draws the MFI against S&P500 chart from the daily totals
+    :param sources: Data of every line by the column drawn, as returned by _line_source
+    :param val_1:
+    :param lines: Dict of the benchmark columns to draw by their legend label
+    :param open_browser: Whether to show the chart or only save it
+    :param fan: Fan of simulated returns to draw next to the chart, or None
+    :return:
+    """
+    from bokeh.layouts import row
+    from bokeh.models import ColumnDataSource
+    from bokeh.plotting import figure, output_file, save, show
+    from portfolio_tracker.helper_functions.bokeh_helpers import set_graph_and_legend_properties
+
     output_file("mfi_vs_spy.html")
-    source = ColumnDataSource(grouped_metrics)
+    sources = {column: ColumnDataSource(data) for column, data in sources.items()}
 
     fig = figure(x_axis_label="Time",
                  x_axis_type="datetime",
                  y_axis_label="%age Return",
                  toolbar_location="below",
                  tools="reset",
-                 sizing_mode='scale_both')
+                 sizing_mode='scale_both',
+                 output_backend="webgl")
 
     fig.line(x="Date Snapshot",
              y=val_1,
-             source=source,
+             source=sources[val_1],
              line_width=2,
              line_color="green",
              legend_label="MFI",
              name="mfi")
 
-    fig.line(x="Date Snapshot",
-             y=val_2,
-             source=source,
-             line_width=2,
-             line_color="red",
-             legend_label="SPY",
-             name="s&p")
+    # The S&P500 keeps its red, and any other benchmark takes the next colour along
+    colours = itertools.cycle(BENCHMARK_COLOURS)
+    for label, column in lines.items():
+        fig.line(x="Date Snapshot",
+                 y=column,
+                 source=sources[column],
+                 line_width=2,
+                 line_color="red" if label == 'SPY' else next(colours),
+                 legend_label=label,
+                 name="s&p" if label == 'SPY' else label)
+
+    title = "MFI vs S&P500" if list(lines) == ['SPY'] else "MFI vs " + ", ".join(lines)
+    set_graph_and_legend_properties(fig, title)
+
+    layout = fig if fan is None else row(fig, _fan_figure(fan), sizing_mode='scale_both')
+    if open_browser:
+        show(layout)
+    else:
+        save(layout)
+
+
+def _fan_figure(fan):
+    """
+    Draws the fan chart of simulated returns: for the portfolio and the S&P500, the median return on every day ahead,
+    with the band of the middle half of the paths and the wider band of the middle 90% around it
+    :param fan: Fan of simulated returns, as returned by simulation.simulate
+    :return: Bokeh figure
+    """
+    from bokeh.models import ColumnDataSource
+    from bokeh.plotting import figure
+    from portfolio_tracker.helper_functions.bokeh_helpers import set_graph_and_legend_properties
+    from portfolio_tracker.helper_functions.simulation import BENCHMARK, FAN_QUANTILES, PORTFOLIO
+
+    fig = figure(x_axis_label="Trading Days Ahead",
+                 y_axis_label="%age Return",
+                 toolbar_location="below",
+                 tools="reset",
+                 sizing_mode='scale_both',
+                 output_backend="webgl")
 
-    set_graph_and_legend_properties(fig, "MFI vs S&P500")
+    bands = ['{:g}%'.format(100 * quantile) for quantile in FAN_QUANTILES]
+    for series, label, colour in [(PORTFOLIO, "MFI", "green"), (BENCHMARK, "SPY", "red")]:
+        source = ColumnDataSource(fan[fan['Series'] == series].drop(columns='Series'))
+        # The outermost bands are the palest
+        for i in range(len(bands) // 2):
+            fig.varea(x="Days Ahead", y1=bands[i], y2=bands[-1 - i], source=source, fill_color=colour,
+                      fill_alpha=0.1 * (i + 1), legend_label=label)
+        fig.line(x="Days Ahead",
+                 y=bands[len(bands) // 2],
+                 source=source,
+                 line_width=2,
+                 line_color=colour,
+                 legend_label=label)
 
-    show(fig)
+    set_graph_and_legend_properties(fig, "Simulated MFI vs S&P500")
+    return fig
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.ledger_loader import LEDGER_COLUMNS, LEDGER_DATE_FORMAT
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+
+
+def synthetic_symbols(n_tickers):
+    """
+    Made-up ticker symbols, the same for the same count every time
+    :param n_tickers: Number of symbols
+    :return: List of symbols
+    """
+    return ['SYN{:04d}'.format(i) for i in range(n_tickers)]
+
+
+def synthetic_ledger(n_tickers=30, lots_per_ticker=1, sell_frequency=0., start='2020-07-24', end='2021-07-23',
+                     history_days=365, lot_cost=50., seed=0, provider=None):
+    """
+    Generates a transaction history shaped like mfi_log_book.csv, priced from synthetic bars so that the costs line up
+    with the prices the pipeline will later be fed.
+    Just like the Magic Formula log book, every lot is a fixed-cost buy made on or before the start of the analysis,
+    spread over the history_days before it. Each lot is then sold, with probability sell_frequency, in part or in full
+    on a business day after it was bought, anywhere up to the end of the analysis
+    :param n_tickers: Number of tickers
+    :param lots_per_ticker: Number of buy lots per ticker
+    :param sell_frequency: Chance of every lot being (partly) sold later on
+    :param start: Start date of the analysis
+    :param end: End date of the analysis
+    :param history_days: Number of days before start over which the lots are bought
+    :param lot_cost: Cost of every buy
+    :param seed: Seed of the random choices
+    :param provider: PriceProvider to price the lots with, defaults to a SyntheticProvider
+    :return: Transactions dataframe, with 'Open Date' formatted as in the log book
+    """
+    provider = provider or SyntheticProvider()
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    symbols = synthetic_symbols(n_tickers)
+
+    # Lots are bought on business days, the first of every ticker always on the last business day before the start
+    buy_days = pd.bdate_range(start - pd.Timedelta(days=history_days), start)
+    n_lots = n_tickers * lots_per_ticker
+    lot_symbol = np.repeat(np.arange(n_tickers), lots_per_ticker)
+    lot_day = rng.integers(0, len(buy_days), n_lots)
+    lot_day[::lots_per_ticker] = len(buy_days) - 1
+    lot_date = buy_days[lot_day]
+
+    # Each ticker's closes over the whole timeframe, looked up once per lot
+    closes = pd.concat({symbol: provider.download(symbol, buy_days[0], end)['Close'] for symbol in symbols})
+    lot_price = closes.loc[list(zip(np.array(symbols)[lot_symbol], lot_date))].to_numpy()
+
+    buys = pd.DataFrame({'Symbol': np.array(symbols)[lot_symbol],
+                         'Qty': np.round(lot_cost / lot_price, 2),
+                         'Type': 'Buy',
+                         'Open Date': lot_date,
+                         'Adj Cost per Share': np.round(lot_price, 2),
+                         'Adj Cost': lot_cost})
+
+    # Some lots are sold again later: a random share of the lot, on a random business day after it was bought
+    sell_days = pd.bdate_range(buy_days[0], end)
+    sold = rng.random(n_lots) < sell_frequency
+    sale_day = sell_days.searchsorted(lot_date[sold]) + 1
+    sale_day = sale_day + (rng.random(sold.sum()) * (len(sell_days) - sale_day)).astype(int)
+    keep = sale_day < len(sell_days)
+    sells = buys[sold][keep].copy()
+    sells['Type'] = 'Sell'
+    sells['Open Date'] = sell_days[sale_day[keep]]
+    sells['Qty'] = np.round(sells['Qty'] * rng.uniform(0.25, 1., len(sells)), 2)
+    sale_price = closes.loc[list(zip(sells['Symbol'], sells['Open Date']))].to_numpy()
+    sells['Adj Cost per Share'] = np.round(sale_price, 2)
+    sells['Adj Cost'] = np.round(sells['Qty'] * sale_price, 2)
+
+    # In date order, numbered and formatted like the log book
+    ledger = pd.concat([buys, sells]).sort_values('Open Date', kind='mergesort').reset_index(drop=True)
+    ledger['Index'] = np.arange(1, len(ledger) + 1)
+    ledger['Security'] = ledger['Symbol'] + ' SYNTHETIC INC. '
+    ledger['Open Date'] = ledger['Open Date'].dt.strftime(LEDGER_DATE_FORMAT)
+    return ledger[LEDGER_COLUMNS]
+
+
+def write_ledger(ledger, path):
+    """
+    Writes a ledger as a log book CSV, with the byte order mark the exported log book starts with
+    :param ledger: Transactions dataframe, as returned by synthetic_ledger
+    :param path: Path of the CSV file
+    :return:
+    """
+    ledger.to_csv(path, index=False, encoding='utf-8-sig')
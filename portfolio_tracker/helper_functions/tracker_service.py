@@ -0,0 +1,301 @@
+import datetime
+import http.server
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube, UnknownMetricError
+from portfolio_tracker.helper_functions.instrumentation import LOGGER
+from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+from portfolio_tracker.helper_functions.multi_benchmark import add_benchmark_columns, portfolio_prices
+from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal
+from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+# Metrics served when a request doesn't name any
+DEFAULT_METRICS = ['Ticker Return', 'Benchmark Return']
+
+# Columns of the holdings served for a date
+HOLDING_COLUMNS = ['Symbol', 'Security', 'Qty', 'Open Date', 'Adj cost', 'Symbol Adj Close', 'Ticker Share Value',
+                   'Stock Gain / (Loss)', 'Ticker Return', 'Benchmark Return']
+
+
+def yesterday():
+    """
+    :return: Yesterday's date, the last day with closing prices for a tracker run today
+    """
+    return pd.Timestamp(datetime.date.today() - datetime.timedelta(days=1))
+
+
+class Snapshot:
+    """
+    Everything computed from one version of the inputs: the combined dataframe, its aggregation cube and the rows of
+    every day. A snapshot is never changed once built; a refresh builds a new one and swaps it in, so requests being
+    served carry on with the one they started with
+    """
+
+    def __init__(self, signature, combined_df, cube):
+        """
+        :param signature: Inputs the snapshot was computed from (see TrackerService.signature)
+        :param combined_df: Output of step 4, with every benchmark's columns
+        :param cube: AggregationCube of combined_df
+        """
+        self.signature = signature
+        self.combined_df = combined_df
+        self.cube = cube
+        self.day_rows = combined_df.groupby('Date Snapshot').indices
+        self.days = np.array(sorted(self.day_rows), dtype='datetime64[ns]')
+        self.symbols = set(combined_df['Symbol'].unique())
+        self.computed_at = pd.Timestamp.now()
+
+
+class TrackerService:
+    """
+    Keeps the ledger, calendar, prices and results of the tracker in memory between requests. The inputs are checked
+    on every request, which costs a stat of the log book: when the log book changes or a new day starts, the results
+    are computed again before the request is answered. Everything else is answered from the warm snapshot
+    """
+
+    def __init__(self, ledger_path, stocks_start, stocks_end=None, benchmarks=('SPY',), provider=None, cache=None,
+                 ledger_cache_path=None, calendar_cache_dir=None):
+        """
+        :param ledger_path: Path of the log book CSV
+        :param stocks_start: Start date of the analysis
+        :param stocks_end: End date of the analysis, or None to always run up to yesterday
+        :param benchmarks: Benchmark tickers, the first being the primary one
+        :param provider: PriceProvider, defaults to a YFinanceProvider
+        :param cache: Optional PriceCache in front of the provider
+        :param ledger_cache_path: Binary cache of the parsed log book (see load_ledger)
+        :param calendar_cache_dir: Directory the market calendar is cached in
+        """
+        self.ledger_path = ledger_path
+        self.stocks_start = pd.Timestamp(stocks_start)
+        self.stocks_end = pd.Timestamp(stocks_end) if stocks_end is not None else None
+        self.benchmarks = list(benchmarks)
+        self.provider = provider
+        self.cache = cache
+        self.ledger_cache_path = ledger_cache_path
+        self.calendar_cache_dir = calendar_cache_dir
+        self.snapshot = None
+        self._lock = threading.Lock()
+
+    def signature(self):
+        """
+        :return: What the results depend on that can change while the service runs: the log book's size and
+                 modification time, and the end date
+        """
+        stat = os.stat(self.ledger_path)
+        end = self.stocks_end if self.stocks_end is not None else yesterday()
+        return stat.st_size, stat.st_mtime_ns, end
+
+    def current(self, force=False):
+        """
+        The snapshot of the current inputs, computed again if they changed since the last one. Only one request
+        recomputes; the others wait for it rather than computing the same thing
+        :param force: Whether to recompute even if the inputs look unchanged (e.g. after prices were corrected)
+        :return: Snapshot
+        """
+        signature = self.signature()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.signature == signature and not force:
+            return snapshot
+        with self._lock:
+            if self.snapshot is not None and self.snapshot.signature == signature and not force:
+                return self.snapshot
+            start_time = time.time()
+            self.snapshot = self._compute(signature)
+            LOGGER.info("Results computed in %.2f seconds (%d rows)", time.time() - start_time,
+                        len(self.snapshot.combined_df))
+            return self.snapshot
+
+    def _compute(self, signature):
+        """
+        Runs steps 1 to 4 over the current inputs
+        :param signature: The inputs' signature
+        :return: Snapshot
+        """
+        stocks_end = signature[2]
+        portfolio = load_ledger(self.ledger_path, cache_path=self.ledger_cache_path)
+        daily_adj_close, benchmark_closes, daily_benchmark = portfolio_prices(
+            portfolio, self.stocks_start, stocks_end, self.benchmarks, provider=self.provider, cache=self.cache)
+        market_cal = create_market_cal(self.stocks_start, stocks_end, cache_dir=self.calendar_cache_dir)
+
+        intervals = holding_intervals(portfolio_start_balance(portfolio, self.stocks_start), market_cal)
+        valuation = matrix_portfolio_calcs(intervals, market_cal, daily_benchmark, daily_adj_close, self.stocks_start)
+        combined_df = add_benchmark_columns(valuation.to_combined_df(), benchmark_closes)
+        return Snapshot(signature, combined_df, AggregationCube.build(combined_df))
+
+    def portfolio_series(self, metrics=None, how='sum', start=None, end=None):
+        """
+        Portfolio-level figures by date
+        :param metrics: Metrics, defaults to the DEFAULT_METRICS
+        :param how: 'sum' or 'mean'
+        :param start: First date, or None
+        :param end: Last date, or None
+        :return: Dataframe
+        """
+        figures = self.current().cube.by_date(metrics or DEFAULT_METRICS, how)
+        return _between(figures, start, end)
+
+    def ticker_series(self, symbol, metrics=None, how='sum', start=None, end=None):
+        """
+        Figures of one ticker by date, summed (or averaged) over its lots
+        :param symbol: Ticker
+        :param metrics: Metrics, defaults to the DEFAULT_METRICS
+        :param how: 'sum' or 'mean'
+        :param start: First date, or None
+        :param end: Last date, or None
+        :return: Dataframe
+        """
+        snapshot = self.current()
+        if symbol not in snapshot.symbols:
+            raise LookupError("{} isn't held in the portfolio".format(symbol))
+        figures = snapshot.cube.by_symbol(metrics or DEFAULT_METRICS, how)
+        figures = figures[figures['Symbol'] == symbol].drop('Symbol', axis=1)
+        return _between(figures, start, end)
+
+    def holdings(self, date=None):
+        """
+        The lots held at the close of a date, or of the last trading day before it
+        :param date: Date, or None for the last day of the results
+        :return: Dataframe of the HOLDING_COLUMNS
+        """
+        snapshot = self.current()
+        date = np.datetime64(pd.Timestamp(date) if date is not None else snapshot.days[-1], 'ns')
+        position = np.searchsorted(snapshot.days, date, side='right') - 1
+        if position < 0:
+            raise LookupError("Nothing is held before {}".format(snapshot.days[0]))
+        rows = snapshot.day_rows[pd.Timestamp(snapshot.days[position])]
+        holdings = snapshot.combined_df.iloc[rows]
+        return holdings[['Date Snapshot'] + [column for column in HOLDING_COLUMNS if column in holdings.columns]]
+
+    def status(self):
+        """
+        :return: Dict describing the snapshot being served
+        """
+        snapshot = self.current()
+        return {'ledger': self.ledger_path, 'start': str(self.stocks_start.date()),
+                'end': str(snapshot.signature[2].date()), 'benchmarks': self.benchmarks,
+                'rows': len(snapshot.combined_df), 'computed_at': snapshot.computed_at.isoformat(),
+                'metrics': snapshot.cube.metrics()}
+
+
+def _between(figures, start, end):
+    """
+    :param figures: Dataframe with a 'Date Snapshot' column
+    :param start: First date, or None
+    :param end: Last date, or None
+    :return: The rows of figures between the dates
+    """
+    if start is not None:
+        figures = figures[figures['Date Snapshot'] >= pd.Timestamp(start)]
+    if end is not None:
+        figures = figures[figures['Date Snapshot'] <= pd.Timestamp(end)]
+    return figures
+
+
+def _records(df):
+    """
+    :param df: Dataframe
+    :return: The rows of df as JSON, with dates in ISO format and missing values as null
+    """
+    return df.to_json(orient='records', date_format='iso')
+
+
+class TrackerRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers the JSON endpoints of a TrackerService:
+        GET  /portfolio?metrics=Ticker Return,Benchmark Return&how=sum&start=2020-08-01&end=2020-08-15
+        GET  /tickers/<symbol>?metrics=...&how=...&start=...&end=...
+        GET  /holdings?date=2020-08-10
+        GET  /status
+        POST /refresh
+    """
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        metrics = query['metrics'].split(',') if query.get('metrics') else None
+        series = {'metrics': metrics, 'how': query.get('how', 'sum'), 'start': query.get('start'),
+                  'end': query.get('end')}
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+
+        if parts == ['portfolio']:
+            self._answer(lambda: _records(self.service.portfolio_series(**series)))
+        elif len(parts) == 2 and parts[0] == 'tickers':
+            self._answer(lambda: _records(self.service.ticker_series(parts[1], **series)))
+        elif parts == ['holdings']:
+            self._answer(lambda: _records(self.service.holdings(query.get('date'))))
+        elif parts == ['status']:
+            self._answer(lambda: json.dumps(self.service.status()))
+        else:
+            self._send(404, {'error': "Unknown endpoint {}".format(url.path)})
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path.strip('/') == 'refresh':
+            self._answer(lambda: json.dumps({'computed_at': self.service.current(force=True).computed_at.isoformat()}))
+        else:
+            self._send(404, {'error': "Unknown endpoint {}".format(self.path)})
+
+    def _answer(self, respond):
+        """
+        Sends the JSON respond() returns, or the error it raises. Anything unexpected is logged and answered with a 500,
+        rather than leaving the client without a response
+        :param respond: Function returning the body
+        :return:
+        """
+        try:
+            body = respond()
+        except UnknownMetricError as error:
+            self._send(400, {'error': str(error)})
+        except LookupError as error:
+            self._send(404, {'error': str(error)})
+        except ValueError as error:
+            self._send(400, {'error': str(error)})
+        except Exception:
+            LOGGER.exception("Failed to answer %s %s", self.command, self.path)
+            self._send(500, {'error': "Internal error"})
+        else:
+            self._send(200, body)
+
+    def _send(self, status, body):
+        """
+        :param status: HTTP status
+        :param body: JSON text, or a dict to encode
+        :return:
+        """
+        body = (body if isinstance(body, str) else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s " + format, self.address_string(), *args)
+
+
+def serve(service, host='127.0.0.1', port=8050):
+    """
+    Serves a TrackerService over HTTP until interrupted. The results are computed before the port is opened, so the
+    first request is as quick as the rest
+    :param service: TrackerService
+    :param host: Interface to listen on, only the local machine by default
+    :param port: Port to listen on
+    :return:
+    """
+    service.current()
+    handler = type('Handler', (TrackerRequestHandler,), {'service': service})
+    with http.server.ThreadingHTTPServer((host, port), handler) as server:
+        LOGGER.info("Serving the portfolio tracker on http://%s:%d", host, port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker.helper_functions.compact_frames import INTERVAL_COLUMNS, compact_valuation
+from portfolio_tracker.helper_functions.market_calendar import trading_days
+from portfolio_tracker.helper_functions.step3_time_fill_daily import interval_day_positions
+from portfolio_tracker.helper_functions.step4_daily_calcs import fused_daily_calcs
+
+
+def _interval_sum(values, ticker, first_day, last_day, shape):
+    """
+    Adds the value of every lot interval into a (days × tickers) matrix, on every day the interval covers. Rather than
+    writing every day of every interval, each value is added on its first day and taken away again on the day after
+    its last, and a running total down the days then fills in everything in between
+    :param values: Value of every interval
+    :param ticker: Ticker position of every interval
+    :param first_day: First day position of every interval
+    :param last_day: Last day position of every interval
+    :param shape: (days, tickers)
+    :return:
+    """
+    changes = np.zeros((shape[0] + 1, shape[1]))
+    np.add.at(changes, (first_day, ticker), values)
+    np.add.at(changes, (last_day + 1, ticker), -values)
+    return np.cumsum(changes[:-1], axis=0)
+
+
+class DailyValuation:
+    """
+    Output of the matrix valuation engine. Every metric is held as a (days × tickers) NumPy matrix, with the rows
+    following `days` and the columns following `tickers`, except for the benchmark series which are per day. The long
+    per-lot, per-day layout of the combined dataframe is only built when to_combined_df is called.
+    """
+
+    def __init__(self, days, tickers, intervals, closes, qty, adj_cost, benchmark_close, benchmark_start_close,
+                 benchmark_end_close, ticker_start_close, ticker_end_close, start_date):
+        """
+        :param days: Trading days as a DatetimeIndex
+        :param tickers: Tickers as an Index
+        :param intervals: Lot intervals the holdings were built from, with their cost basis
+        :param closes: Daily closes (days × tickers)
+        :param qty: Quantity held (days × tickers)
+        :param adj_cost: Adjusted cost of the quantity held (days × tickers)
+        :param benchmark_close: Daily benchmark closes
+        :param benchmark_start_close: Benchmark close on its first date
+        :param benchmark_end_close: Benchmark close on its last date
+        :param ticker_start_close: Close of every ticker on the first date of the price data
+        :param ticker_end_close: Close of every ticker on the last date of the price data
+        :param start_date: First date of the price data
+        """
+        self.days = days
+        self.tickers = tickers
+        self.intervals = intervals
+        self.closes = closes
+        self.qty = qty
+        self.adj_cost = adj_cost
+        self.benchmark_close = benchmark_close
+        self.benchmark_start_close = benchmark_start_close
+        self.benchmark_end_close = benchmark_end_close
+        self.ticker_start_close = ticker_start_close
+        self.ticker_end_close = ticker_end_close
+        self.start_date = start_date
+
+        # With the matrices lined up, every metric is a broadcast away. The benchmark series are per day, so they're
+        # turned into a column to broadcast across the tickers
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.ticker_share_value = qty * closes
+            self.equiv_benchmark_shares = adj_cost / benchmark_start_close
+            self.benchmark_share_value = self.equiv_benchmark_shares * benchmark_close[:, None]
+            self.stock_gain = self.ticker_share_value - adj_cost
+            self.benchmark_gain = self.benchmark_share_value - adj_cost
+            self.ticker_return = np.where(adj_cost != 0, self.ticker_share_value / adj_cost - 1, np.nan)
+            self.benchmark_return = benchmark_close / benchmark_start_close - 1
+
+    def to_combined_df(self, drop_unpriced=True, compact=False, float32=False):
+        """
+        Melts the engine's output into the long layout of the combined dataframe: one row per lot held on every day,
+        with the same columns and values as the original per_day_portfolio_calcs.
+        With compact, the lean daily table and lot table of compact_frames are returned instead. Only the columns that
+        change from day to day are melted, so the ledger columns are never repeated on every day
+        :param drop_unpriced: Whether lots of tickers without a start or end close are left out
+        :param compact: Whether to return the tables of compact_frames.compact_combined_df
+        :param float32: With compact, whether to store the derived ratios as float32
+        :return: Combined dataframe, or with compact a tuple of the daily table and the lot table
+        """
+        # Lots of tickers that have no price on the first or last date of the price data are left out, as the merges
+        # in the original portfolio_end_of_year_stats and portfolio_start_of_year_stats did
+        intervals = self.intervals
+        if drop_unpriced:
+            priced = ~np.isnan(self.ticker_start_close) & ~np.isnan(self.ticker_end_close)
+            intervals = intervals[priced[intervals['Ticker Position'].to_numpy()]]
+        interval, day = interval_day_positions(intervals, self.days)
+        ticker = intervals['Ticker Position'].to_numpy()[interval]
+
+        if compact:
+            holdings = intervals.iloc[interval][['Lot', 'Qty', 'Symbol']].reset_index(drop=True)
+        else:
+            holdings = intervals.iloc[interval].drop(INTERVAL_COLUMNS, axis=1)
+        holdings['Date Snapshot'] = self.days[day]
+
+        # Every column is a lookup into the matrices and series by day and ticker, handed to the fused kernel of
+        # step 4
+        combined_df = fused_daily_calcs(holdings.sort_index(axis=1), self.closes[day, ticker],
+                                        self.benchmark_close[day], self.benchmark_start_close,
+                                        self.benchmark_end_close, self.ticker_start_close[ticker],
+                                        self.ticker_end_close[ticker],
+                                        intervals['Adj cost per share'].to_numpy(dtype=float)[interval])
+        if compact:
+            return compact_valuation(combined_df, intervals, float32)
+        return combined_df
+
+
+def matrix_portfolio_calcs(intervals, market_cal, daily_benchmark, daily_adj_close, stocks_start, start_date=None,
+                           start_closes=None, benchmark_start_close=None, end_date=None, end_closes=None,
+                           benchmark_end_close=None):
+    """
+    Matrix version of the original per_day_portfolio_calcs. Instead of merging prices onto a long (day × lot) table,
+    the closes are pivoted into a (trading days × tickers) matrix, the lot intervals are summed into quantity and cost
+    matrices aligned with it, and the metrics are then worked out for every day and ticker at once with broadcasting.
+    The start of the analysis normally comes from the first date of the price data. When only a later stretch of days
+    is valued (as incremental_update does), the first date and its closes are passed in instead. Likewise the end
+    comes from the last date of the price data, unless only some tickers' prices are passed in (as ledger_watch does),
+    or the closes on it are passed in (as the intraday mode does, where the market calendar is a session's bars)
+    :param intervals: Lot intervals, as returned by holding_intervals
+    :param market_cal: Trading days, as returned by create_market_cal
+    :param daily_benchmark: Daily benchmark closes ('Date', 'Close')
+    :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+    :param stocks_start: Start date of the analysis
+    :param start_date: First date of the price data, if daily_adj_close doesn't reach back to it
+    :param start_closes: Close of every ticker on start_date, as a Series by ticker
+    :param benchmark_start_close: Benchmark close on start_date
+    :param end_date: Last date of the price data, if daily_adj_close doesn't reach to it
+    :param end_closes: Close of every ticker on the last date, as a Series by ticker
+    :param benchmark_end_close: Benchmark close on the last date
+    :return: DailyValuation
+    """
+    days = trading_days(market_cal)
+    tickers = pd.Index(sorted(intervals['Symbol'].unique()))
+
+    # Overlapping downloads (or a ticker fetched twice) can leave more than one close for a day, which pivoting can't
+    # take, so the last one fetched is kept
+    daily_adj_close = daily_adj_close.drop_duplicates(['Date', 'Ticker'], keep='last')
+
+    # Daily closes pivoted onto the trading days and tickers. The first and last dates of the price data give the start
+    # and end closes, and anything that's missing is left as NaN, as the original left merges did
+    price_matrix = daily_adj_close.pivot(index='Date', columns='Ticker', values='Close')
+    closes = price_matrix.reindex(index=days, columns=tickers).to_numpy(dtype=float)
+    if end_date is None:
+        end_date = daily_adj_close['Date'].max()
+    if start_date is None:
+        start_date = daily_adj_close['Date'].min()
+        ticker_start_close = _close_on(daily_adj_close, start_date, tickers)
+    else:
+        ticker_start_close = start_closes.reindex(tickers).to_numpy(dtype=float)
+    if end_closes is None:
+        ticker_end_close = _close_on(daily_adj_close, end_date, tickers)
+    else:
+        ticker_end_close = end_closes.reindex(tickers).to_numpy(dtype=float)
+
+    benchmark = daily_benchmark.set_index('Date')['Close']
+    benchmark_close = benchmark.reindex(days).to_numpy(dtype=float)
+    if benchmark_start_close is None:
+        benchmark_start_close = float(benchmark[benchmark.index.min()])
+    if benchmark_end_close is None:
+        benchmark_end_close = float(benchmark[benchmark.index.max()])
+
+    # Just like the original portfolio_start_of_year_stats, lots opened on or before the first date of the price data
+    # are costed at that date's close rather than at what was paid for them
+    intervals = intervals.copy()
+    intervals['Ticker Position'] = tickers.get_indexer(intervals['Symbol'])
+    ticker = intervals['Ticker Position'].to_numpy()
+    intervals['Adj cost per share'] = np.where(intervals['Open Date'] <= start_date, ticker_start_close[ticker],
+                                               intervals['Adj Cost per Share'])
+
+    # Quantities and costs summed into day × ticker matrices over the days every interval was held
+    first_day = days.searchsorted(intervals['First Day'].values)
+    last_day = days.searchsorted(intervals['Last Day'].values)
+    lot_qty = intervals['Qty'].to_numpy(dtype=float)
+    shape = (len(days), len(tickers))
+    qty = _interval_sum(lot_qty, ticker, first_day, last_day, shape)
+    adj_cost = _interval_sum(lot_qty * intervals['Adj cost per share'].to_numpy(dtype=float), ticker, first_day,
+                             last_day, shape)
+
+    return DailyValuation(days, tickers, intervals, closes, qty, adj_cost, benchmark_close, benchmark_start_close,
+                          benchmark_end_close, ticker_start_close, ticker_end_close, start_date)
+
+
+def _close_on(daily_adj_close, date, tickers):
+    """
+    Close of every ticker on a given date, NaN for tickers without a row on that date
+    :param daily_adj_close: Daily closes of every ticker ('Ticker', 'Date', 'Close')
+    :param date: Date
+    :param tickers: Tickers as an Index
+    :return:
+    """
+    on_date = daily_adj_close[daily_adj_close['Date'] == date]
+    return on_date.set_index('Ticker')['Close'].reindex(tickers).to_numpy(dtype=float)
@@ -1,72 +1,137 @@
 # noinspection PyInterpreter
 import datetime
+import logging
 import time
-import pandas as pd
-from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data, get_benchmark, create_market_cal
+from portfolio_tracker.helper_functions.aggregation_cube import aggregation_cube
+from portfolio_tracker.helper_functions.instrumentation import Instrumentation, configure
+from portfolio_tracker.helper_functions.step1_stocks_get_data import create_market_cal
+from portfolio_tracker.helper_functions.ledger_loader import load_ledger
+from portfolio_tracker.helper_functions.multi_benchmark import add_benchmark_columns, portfolio_prices
+from portfolio_tracker.helper_functions.price_cache import PriceCache
+from portfolio_tracker.helper_functions.result_store import DEFAULT_FORMAT, write_results
+from portfolio_tracker.helper_functions.risk_metrics import risk_table
+from portfolio_tracker.helper_functions.price_providers import YFinanceProvider
 from portfolio_tracker.helper_functions.step2_active_positons import portfolio_start_balance
-from portfolio_tracker.helper_functions.step3_time_fill_daily import time_fill
-from portfolio_tracker.helper_functions.step4_daily_calcs import per_day_portfolio_calcs
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
 from portfolio_tracker.helper_functions.step5_agg_line_chart import line, line_facets, total_return, mfi_vs_spy
 
 # Based on Code - https://towardsdatascience.com/modeling-your-stock-portfolio-performance-with-python-fbba4ef2ef11
+# This script walks through every step in one go. For scheduled runs, python -m portfolio_tracker runs the steps as
+# separate commands (fetch, compute, render, report) with the dates and log book given on the command line
 if __name__ == '__main__':
-    # LOGGER.info("CUSTOM INFO: Script Started...")
-    print("CUSTOM INFO: Script Started...")
+    # Every stage of the run is logged as a JSON line with its wall and CPU time, rows in and out and peak memory. Set
+    # PORTFOLIO_TRACKER_PROFILE or PORTFOLIO_TRACKER_TRACEMALLOC to a stage name (e.g. daily_calcs) to also run that
+    # stage under cProfile or tracemalloc
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    LOGGER = logging.getLogger(__name__)
+    instrumentation = configure(Instrumentation.from_env())
+
+    LOGGER.info("CUSTOM INFO: Script Started...")
     # Start Time of Code
     start_time = time.time()
 
     # Step 1 — Grabbing the Data
-    # our buy/sell transaction history
-    portfolio_df = pd.read_csv('mfi_log_book.csv')
-    portfolio_df['Open Date'] = pd.to_datetime(portfolio_df['Open Date'])
-    symbols = portfolio_df.Symbol.unique()
+    # our buy/sell transaction history, parsed with a fixed schema and cached in binary form until the log book changes
+    portfolio_df = load_ledger('mfi_log_book.csv', cache_path='mfi_log_book.pkl')
+    symbols = portfolio_df.Symbol.unique().tolist()
     stocks_start = datetime.datetime(2020, 7, 27)
     stocks_end = datetime.datetime(2020, 8, 15)
 
-    # Daily closes for all tickers in our inventory before the end date specified
-    daily_adj_close = get_data(symbols, stocks_start, stocks_end)
-    daily_adj_close = daily_adj_close[['Close']].reset_index()
+    # Benchmarks the portfolio is compared against. The first is the primary one, which fills the 'Benchmark ...'
+    # columns of step 4; every benchmark, plus an equal-weight index of the portfolio's own tickers, also gets its own
+    # '<benchmark> Return', '<benchmark> Share Value' etc. columns. Only SPY is downloaded by default; add e.g. 'QQQ'
+    # and 'IWM' to compare against them as well
+    benchmarks = ['SPY']
+
+    # In lean mode, the combined dataframe is built as a daily table and a table of the columns fixed for every lot,
+    # with categorical strings and float32 returns (see compact_frames for the tolerance). The wide dataframe is never
+    # built, which takes several times less memory on long histories, and the charts work on the daily table the same
+    compact_frames = False
+
+    # Results are written as Parquet partitioned by month, which keeps their types and lets a reader load only the
+    # columns and months it needs (see result_store.read_results). 'feather' writes Arrow IPC instead, and 'csv' the
+    # old CSV files. Without pyarrow the default falls back to 'csv'
+    results_format = DEFAULT_FORMAT
+
+    # Prices come from Yahoo Finance. To run without network, swap in DirectoryProvider('prices') to read exported
+    # files, or SyntheticProvider() for deterministic made-up prices
+    price_provider = YFinanceProvider()
 
-    # Daily closes for our benchmark comparison
-    daily_benchmark = get_benchmark(['SPY'], stocks_start, stocks_end)
-    daily_benchmark = daily_benchmark[['Date', 'Close']]
+    # Prices are kept in a local cache between runs, so a daily run only downloads the days since the last one
+    price_cache = PriceCache('price_cache.sqlite')
+
+    with instrumentation.stage('fetch', rows_in=len(symbols)) as record:
+        # Daily closes for all tickers in our inventory before the end date specified, and for our benchmark
+        # comparison as a (days × benchmarks) matrix, with the primary benchmark's closes on their own
+        daily_adj_close, benchmark_closes, daily_benchmark = portfolio_prices(
+            portfolio_df, stocks_start, stocks_end, benchmarks, provider=price_provider, cache=price_cache)
+        record.rows_out = len(daily_adj_close) + int(benchmark_closes.size)
 
     # Contains dates that the market was open in our timeframe
-    market_cal = create_market_cal(stocks_start, stocks_end)
+    with instrumentation.stage('calendar') as record:
+        market_cal = create_market_cal(stocks_start, stocks_end, cache_dir='.')
+        record.rows_out = len(market_cal)
 
     # Step 2 — Finding our Initial Active Portfolio
     # Now that we have these four datasets, we need to figure out how many shares we actively held during the start date
     # specified. Assigning the output to a variable should give you the active positions within your portfolio
-    active_portfolio = portfolio_start_balance(portfolio_df, stocks_start)
+    with instrumentation.stage('start_balance', rows_in=len(portfolio_df)) as record:
+        active_portfolio = portfolio_start_balance(portfolio_df, stocks_start)
+        record.rows_out = len(active_portfolio)
 
     # Step 3 — Creating Daily Performance Snapshots
-    # Running this line of code should return back a list of all trading days within the time range specified,
-    # along with an accurate count of positions per-day
-    positions_per_day = time_fill(active_portfolio, market_cal)
+    # Running this line of code should return back the intervals over which every lot was held within the time range
+    # specified, along with an accurate count of positions over each interval
+    with instrumentation.stage('time_fill', rows_in=len(active_portfolio)) as record:
+        positions_per_day = holding_intervals(active_portfolio, market_cal)
+        record.rows_out = len(positions_per_day)
 
     # Step 4 — Making Portfolio Calculations
-    # Now that we have an accurate by-day ledger of our active holdings, we can go ahead and create the final
-    # calculations needed to generate graphs!
-    combined_df = per_day_portfolio_calcs(positions_per_day, daily_benchmark, daily_adj_close, stocks_start)
-    combined_df.to_csv("Combined_DF_csv.csv")
+    # Now that we have an accurate ledger of our active holdings, we can go ahead and create the final calculations
+    # needed to generate graphs! The valuation engine works on day × ticker matrices, and is only melted into the long
+    # per-lot, per-day layout for the CSV and the charts
+    with instrumentation.stage('daily_calcs', rows_in=len(positions_per_day)) as record:
+        valuation = matrix_portfolio_calcs(positions_per_day, market_cal, daily_benchmark, daily_adj_close,
+                                           stocks_start)
+        if compact_frames:
+            combined_df, lots_df = valuation.to_combined_df(compact=True, float32=True)
+            write_results(lots_df.reset_index(), "results/lots", results_format)
+        else:
+            combined_df = valuation.to_combined_df()
+        combined_df = add_benchmark_columns(combined_df, benchmark_closes)
+        record.rows_out = len(combined_df)
+    write_results(combined_df, "results/combined", results_format, partition_by='month')
+
+    # Every chart reads its daily figures from one aggregation cube of the results, rather than grouping them again
+    with instrumentation.stage('aggregation_cube', rows_in=len(combined_df)):
+        cube = aggregation_cube(combined_df)
+
+    # Volatility, drawdown, Sharpe, Sortino, beta and tracking error against the primary benchmark, for the portfolio
+    # and every ticker over rolling windows of a month, a quarter and a year, as one table ready to chart
+    with instrumentation.stage('risk', rows_in=len(combined_df)) as record:
+        risk_df = risk_table(cube)
+        write_results(risk_df, "results/risk", results_format)
+        record.rows_out = len(risk_df)
 
     # # Step 5 — Visualize the Data
     # # The biggest benefit of this daily data is to see how your positions perform over time, so let’s try looking at our
     # # data on an aggregated basis first. We’ll supply ticker and benchmark gain/loss as the metrics, then use a groupby
     # # to aggregate the daily performance to the portfolio-level
-    # line(combined_df, 'Stock Gain / (Loss)', 'Benchmark Gain / (Loss)')
+    # line(cube, 'Stock Gain / (Loss)', 'Benchmark Gain / (Loss)', results_format)
     #
     # # The most useful view, in my opinion, can be generated by using the facet_col option in plotly express to generate
     # # a chart per ticker that compares the benchmark against each ticker’s performance
-    # line_facets(combined_df, 'Ticker Return', 'Benchmark Return')
+    # line_facets(cube, 'Ticker Return', 'Benchmark Return')
 
     # Provides the absolute return of the portfolio
-    # total_return(combined_df, 'Ticker Return', 'Benchmark Return')
+    # total_return(cube, 'Ticker Return', 'Benchmark Return', results_format)
 
-    # Bokeh graph
-    mfi_vs_spy(combined_df, 'Ticker Return', 'Benchmark Return')
+    # Bokeh graph, against any of the benchmarks. The charts report their own aggregation and render stages
+    mfi_vs_spy(cube, 'Ticker Return', 'Benchmark Return', benchmarks=benchmarks)
 
+    # The measurements of every stage are also kept together, to compare with earlier runs
+    instrumentation.write("run_stages.json")
 
     # Print Time taken to execute script
-    print("CUSTOM INFO: --- Script Execution Time: %s seconds ---" % (time.time() - start_time))
-    # LOGGER.info("CUSTOM INFO: --- Script Execution Time: %s seconds ---" % (time.time() - start_time))
+    LOGGER.info("CUSTOM INFO: --- Script Execution Time: %s seconds ---" % (time.time() - start_time))
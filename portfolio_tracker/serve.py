@@ -0,0 +1,10 @@
+import sys
+
+from portfolio_tracker.cli import main
+
+# Keeps the tracker's results warm in memory and answers JSON queries about them over a local port, e.g.
+#   python -m portfolio_tracker.serve --start 2020-07-27 --benchmarks SPY QQQ IWM
+#   curl 'http://127.0.0.1:8050/portfolio?metrics=Ticker%20Return,SPY%20Return,QQQ%20Return'
+# The same as python -m portfolio_tracker serve, which takes the same inputs as the other commands
+if __name__ == '__main__':
+    main(['serve'] + sys.argv[1:])
@@ -0,0 +1,59 @@
+import gc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions import aggregation_cube as cubes
+from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube, FrameGoneError, UnknownMetricError, \
+    aggregation_cube
+
+
+def make_combined_df():
+    rng = np.random.default_rng(0)
+    days = pd.bdate_range('2021-01-04', periods=6)
+    rows = pd.DataFrame({'Symbol': rng.choice(['AAA', 'BBB', 'CCC'], 60), 'Date Snapshot': rng.choice(days, 60),
+                         'Lot': np.arange(60), 'Ticker Return': rng.normal(size=60),
+                         'Stock Gain / (Loss)': rng.normal(size=60)})
+    rows.loc[::7, 'Ticker Return'] = np.nan
+    return rows
+
+
+def test_figures_match_a_groupby():
+    combined_df = make_combined_df()
+    cube = AggregationCube.build(combined_df)
+    metrics = ['Ticker Return', 'Stock Gain / (Loss)']
+    expected = combined_df.groupby('Date Snapshot')[metrics].sum().reset_index()
+    pd.testing.assert_frame_equal(cube.by_date(metrics), expected)
+    expected = combined_df.groupby(['Symbol', 'Date Snapshot'])[metrics].mean().reset_index()
+    pd.testing.assert_frame_equal(cube.by_symbol(metrics, how='mean'), expected)
+    assert 'Lot' not in cube.metrics()
+
+
+def test_cube_is_shared_until_the_dataframe_goes():
+    combined_df = make_combined_df()
+    cube = aggregation_cube(combined_df)
+    assert aggregation_cube(combined_df) is cube
+    assert cube.frame is combined_df
+
+    # The cache doesn't keep the dataframe alive, and forgets the cube along with it
+    frame_id = id(combined_df)
+    del combined_df
+    gc.collect()
+    assert frame_id not in cubes._cubes
+    assert cube.frame is None
+
+
+def test_a_cube_whose_dataframe_is_gone_says_so():
+    combined_df = make_combined_df()
+    cube = AggregationCube.build(combined_df)
+    cube.compute(['Ticker Return'])
+    with pytest.raises(UnknownMetricError):
+        cube.compute(['Not A Column'])
+
+    del combined_df
+    gc.collect()
+    # What was summed before the dataframe went is still there, but nothing else can be summed
+    assert cube.by_date(['Ticker Return'])['Ticker Return'].notna().all()
+    with pytest.raises(FrameGoneError, match='is gone'):
+        cube.compute(['Stock Gain / (Loss)'])
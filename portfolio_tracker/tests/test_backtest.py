@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.backtest import evaluate_ledgers, rebalance_days, rebalancing_ledger, \
+    run_backtest, scenario_grid
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+DAYS = pd.bdate_range('2020-01-01', '2022-06-30')
+TICKERS = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE', 'FFF']
+
+
+@pytest.fixture(scope='module')
+def closes():
+    provider = SyntheticProvider(seed=1)
+    return pd.DataFrame({ticker: provider.download(ticker, DAYS[0], DAYS[-1])['Close'] for ticker in TICKERS})
+
+
+@pytest.fixture(scope='module')
+def benchmark_close():
+    return SyntheticProvider(seed=2).download('SPY', DAYS[0], DAYS[-1])['Close']
+
+
+def test_cohorts_are_bought_on_every_anniversary_before_the_end():
+    # The start is a Saturday, and the anniversaries fall on a Monday and a Tuesday
+    positions = rebalance_days(DAYS, pd.Timestamp('2020-01-04'), pd.Timestamp('2022-06-30'))
+    assert list(DAYS[positions]) == [pd.Timestamp('2020-01-06'), pd.Timestamp('2021-01-04'),
+                                     pd.Timestamp('2022-01-04')]
+    assert len(rebalance_days(DAYS, pd.Timestamp('2020-01-06'), pd.Timestamp('2021-01-04'))) == 1
+
+
+def test_the_ledger_finances_every_cohort_with_the_last_one(closes):
+    ledger = rebalancing_ledger(closes, '2020-01-06', '2022-06-30', 3, lot_cost=100., seed=4)
+    buys, sales = ledger[ledger['Type'] == 'Buy'], ledger[ledger['Type'] == 'Sell']
+
+    assert buys.groupby('Open Date').size().tolist() == [3, 3, 3]
+    assert buys.groupby('Open Date')['Adj Cost'].sum().iloc[0] == pytest.approx(300.)
+    # Every sale of a cohort pays for the next one, bought the same day
+    proceeds = sales.groupby('Open Date')['Adj Cost'].sum()
+    np.testing.assert_allclose(buys.groupby('Open Date')['Adj Cost'].sum().iloc[1:], proceeds)
+
+
+def test_scores_pick_the_lowest_ranked_stocks(closes):
+    scores = pd.DataFrame([[6, 5, 4, 3, 2, 1]], index=[DAYS[0]], columns=TICKERS)
+    ledger = rebalancing_ledger(closes, '2020-01-06', '2020-12-31', 2, scores=scores)
+    assert sorted(ledger['Symbol']) == ['EEE', 'FFF']
+
+
+def test_ledgers_valued_together_match_valuing_each_on_its_own(closes, benchmark_close):
+    ledgers = {'a': rebalancing_ledger(closes, '2020-01-06', '2022-06-30', 3, seed=0),
+               'b': rebalancing_ledger(closes, '2020-07-01', '2022-06-30', 4, seed=1)}
+    days, figures = evaluate_ledgers(ledgers, closes, benchmark_close)
+
+    market_cal = TradingCalendar(DAYS)
+    daily_adj_close = closes.rename_axis('Date').rename_axis(columns='Ticker').stack().rename('Close').reset_index()
+    daily_benchmark = benchmark_close.rename_axis('Date').reset_index()
+    for i, (name, ledger) in enumerate(ledgers.items()):
+        start = ledger['Open Date'].min()
+        valuation = matrix_portfolio_calcs(holding_intervals(ledger, market_cal), market_cal, daily_benchmark,
+                                           daily_adj_close, start)
+        first = days.get_loc(start)
+        assert np.isnan(figures['Value'][i, :first]).all()
+        value = pd.Series(valuation.ticker_share_value.sum(axis=1), index=pd.DatetimeIndex(valuation.days))
+        np.testing.assert_allclose(figures['Value'][i, first:], value.reindex(days[first:]))
+
+        # Rebalancing is self-financing, so the money in is the first cohort's, all put into the benchmark that day
+        capital = ledger.loc[ledger['Open Date'] == start, 'Adj Cost'].sum()
+        np.testing.assert_allclose(figures['Net Invested'][i, first:], capital)
+        np.testing.assert_allclose(figures['Benchmark Value'][i, first:],
+                                   capital / benchmark_close.iloc[first] * benchmark_close.iloc[first:])
+
+
+def test_run_backtest_summarises_every_scenario(tmp_path):
+    scenarios = scenario_grid(pd.to_datetime(['2020-01-06', '2020-04-06']), [2, 4], seeds=[0, 1])
+    summary, daily = run_backtest(scenarios, TICKERS, '2022-06-30', years=1, provider=SyntheticProvider(seed=1),
+                                  market_cal=TradingCalendar(DAYS), ledger_dir=str(tmp_path))
+
+    assert list(summary.index) == list(scenarios.index) and len(list(tmp_path.iterdir())) == len(scenarios)
+    assert (summary['Last Day'] - summary['First Day']).dt.days.between(360, 366).all()
+    np.testing.assert_allclose(summary['Return'], summary['Value'] / summary['Net Invested'] - 1)
+    assert (summary['Max Drawdown'] <= 0).all()
+
+    last = daily.sort_values('Date Snapshot').groupby('Scenario').last()
+    np.testing.assert_allclose(last.loc[summary.index, 'Value'], summary['Value'])
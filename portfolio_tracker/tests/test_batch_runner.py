@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.batch import ledger_name, parse_ledger
+from portfolio_tracker.helper_functions.batch_runner import run_batch
+from portfolio_tracker.helper_functions.ledger_loader import read_ledger
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.multi_benchmark import add_benchmark_columns, equal_weight_index
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+from portfolio_tracker.helper_functions.synthetic_ledger import synthetic_ledger, write_ledger
+
+START, END = pd.Timestamp('2021-01-04'), pd.Timestamp('2021-03-31')
+
+
+@pytest.fixture
+def ledgers(tmp_path):
+    # Written out and read back as log books, the way batch.py loads them
+    provider, ledgers = SyntheticProvider(), {}
+    for name, (n_tickers, lots_per_ticker, sell_frequency, seed) in {'first': (4, 2, 0.5, 1),
+                                                                     'second': (3, 1, 0., 2)}.items():
+        path = str(tmp_path / (name + '.csv'))
+        write_ledger(synthetic_ledger(n_tickers, lots_per_ticker, sell_frequency, START, END, seed=seed,
+                                      provider=provider), path)
+        ledgers[name] = read_ledger(path)
+    return ledgers
+
+
+def batch(ledgers, benchmark):
+    results, summary = run_batch(ledgers, START, END, benchmark=benchmark, provider=SyntheticProvider(),
+                                 market_cal=TradingCalendar(pd.bdate_range(START, END)), max_workers=1)
+    return results, summary
+
+
+def test_extra_benchmarks_add_columns_rather_than_rows(ledgers):
+    results, summary = batch(ledgers, ('SPY',))
+    with_extras, _ = batch(ledgers, ('SPY', 'QQQ'))
+
+    for name in ledgers:
+        combined_df = with_extras[name]
+        assert len(combined_df) == len(results[name])
+        pd.testing.assert_series_equal(combined_df['Benchmark Close'], results[name]['Benchmark Close'])
+        assert {'SPY Return', 'QQQ Return', 'Equal Weight Return'} <= set(combined_df.columns)
+        # The primary benchmark's own columns are the step 4 'Benchmark' ones
+        np.testing.assert_allclose(combined_df['SPY Return'], combined_df['Benchmark Return'])
+        np.testing.assert_allclose(combined_df['SPY Share Value'], combined_df['Benchmark Share Value'])
+        np.testing.assert_allclose(combined_df['Ticker Return vs SPY'],
+                                   combined_df['Ticker Return'] - combined_df['Benchmark Return'])
+        assert (combined_df.loc[combined_df['Date Snapshot'] == START, 'Equal Weight Return'] == 0).all()
+    assert list(summary.index) == ['first', 'second']
+
+
+def test_the_equal_weight_index_starts_at_100():
+    days = pd.bdate_range(START, periods=3)
+    daily_adj_close = pd.DataFrame({'Ticker': ['AAA'] * 3 + ['BBB'] * 3, 'Date': list(days) * 2,
+                                    'Close': [10., 11., 12., 50., 45., 40.]})
+    index = equal_weight_index(daily_adj_close)
+    np.testing.assert_allclose(index, [100., 100. * (1.1 + .9) / 2, 100. * (1.2 + .8) / 2])
+    assert index.name == 'Equal Weight'
+
+
+def test_a_benchmark_starting_late_is_measured_from_its_first_close():
+    days = pd.bdate_range(START, periods=3)
+    benchmark_closes = pd.DataFrame({'SPY': [100., 102., 104.], 'LATE': [np.nan, 20., 25.]},
+                                    index=pd.Index(days, name='Date'))
+    combined_df = pd.DataFrame({'Date Snapshot': days, 'Adj cost': 200., 'Ticker Return': 0.})
+    combined_df = add_benchmark_columns(combined_df, benchmark_closes)
+
+    np.testing.assert_allclose(combined_df['Equiv LATE Shares'], 10.)
+    np.testing.assert_allclose(combined_df['LATE Return'], [np.nan, 0., .25])
+    np.testing.assert_allclose(combined_df['LATE Share Value'], [np.nan, 200., 250.])
+    np.testing.assert_allclose(combined_df['SPY Return'], [0., .02, .04])
+
+
+def test_parse_ledger_keeps_windows_paths_whole():
+    assert parse_ledger('cohort.csv') == ('cohort.csv', None)
+    assert parse_ledger('cohort.csv:2021-01-04') == ('cohort.csv', pd.Timestamp('2021-01-04'))
+    assert parse_ledger(r'C:\ledgers\cohort.csv') == (r'C:\ledgers\cohort.csv', None)
+    assert parse_ledger(r'C:\ledgers\cohort.csv:2021-01-04') == (r'C:\ledgers\cohort.csv', pd.Timestamp('2021-01-04'))
+
+
+def test_ledgers_with_the_same_file_name_get_their_own_names():
+    taken = {}
+    for path in ['a/mfi_log_book.csv', 'b/mfi_log_book.csv', 'c/mfi_log_book.csv']:
+        taken[ledger_name(path, taken)] = path
+    assert list(taken) == ['mfi_log_book', 'mfi_log_book_2', 'mfi_log_book_3']
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from portfolio_tracker import benchmark
+from portfolio_tracker.benchmark import PLOTS, measure_plots, parse_scenario, run_scenario
+from portfolio_tracker.helper_functions.ledger_loader import read_ledger
+from portfolio_tracker.helper_functions.synthetic_ledger import synthetic_ledger, write_ledger
+
+
+def test_parse_scenario():
+    assert parse_scenario('100,4,0.2,365') == (100, 4, 0.2, 365)
+
+
+def test_synthetic_ledgers_never_sell_more_than_they_hold(tmp_path):
+    path = str(tmp_path / 'mfi_log_book.csv')
+    write_ledger(synthetic_ledger(20, 3, 0.6, '2021-01-04', '2021-06-30', seed=3), path)
+    ledger = read_ledger(path)
+
+    assert set(ledger['Type']) == {'Buy', 'Sell'}
+    assert ledger['Open Date'].is_monotonic_increasing and ledger['Open Date'].max() <= pd.Timestamp('2021-06-30')
+    buys = ledger[ledger['Type'] == 'Buy']
+    assert buys['Open Date'].max() <= pd.Timestamp('2021-01-04') and (buys['Adj Cost'] == 50.).all()
+    assert buys['Symbol'].nunique() == 20 and len(buys) == 60
+    held = ledger.assign(Held=np.where(ledger['Type'] == 'Buy', 1, -1) * ledger['Qty']).groupby('Symbol')['Held']
+    assert (held.cumsum() >= -1e-9).all()
+
+
+def test_run_scenario_measures_every_stage():
+    result = run_scenario(5, 2, 0.5, 60, repeat=1, seed=1)
+
+    assert result['tickers'] == 5 and result['ledger_rows'] >= 10 and result['combined_rows'] > 0
+    assert list(result['stages']) == ['read_ledger', 'portfolio_start_balance', 'holding_intervals',
+                                      'matrix_portfolio_calcs', 'to_combined_df'] + PLOTS
+    for stage, measurements in result['stages'].items():
+        # The charts are skipped when plotly or bokeh isn't installed, rather than failing the run
+        assert 'skipped' in measurements or measurements['best_seconds'] >= 0
+    assert result['stages']['to_combined_df']['rows_out'] == result['combined_rows']
+
+
+def test_charts_without_their_library_are_skipped(monkeypatch):
+    monkeypatch.setattr(benchmark, 'CHART_LIBRARIES', {name: 'no_such_charting_library' for name in PLOTS})
+    cwd = os.getcwd()
+    stages = measure_plots(pd.DataFrame({'Ticker Return': [0.], 'Benchmark Return': [0.]}), PLOTS, repeat=1)
+
+    assert stages == {name: {'skipped': "No module named 'no_such_charting_library'"} for name in PLOTS}
+    assert os.getcwd() == cwd
@@ -0,0 +1,126 @@
+import sys
+import time
+import types
+
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.concurrent_fetch import StubDownloader, TokenBucket, fetch_all
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider, YFinanceProvider
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data
+
+TICKERS = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE', 'FFF', 'GGG', 'HHH']
+START, END = pd.Timestamp('2021-01-04'), pd.Timestamp('2021-01-29')
+
+
+def test_token_bucket_spaces_out_requests_past_the_burst():
+    bucket = TokenBucket(rate=50, burst=2)
+    started = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+    # Two tokens are there from the start, the other five come in at 50 a second
+    assert time.monotonic() - started >= 5 / 50 * 0.9
+
+
+def test_fetch_all_is_rate_limited_and_bounded():
+    stub = StubDownloader(latency=0., jitter=0.)
+    started = time.monotonic()
+    downloads = fetch_all(TICKERS, stub.download, START, END, max_workers=2, requests_per_second=20, retries=0)
+    elapsed = time.monotonic() - started
+
+    assert list(downloads) == TICKERS
+    assert stub.calls == len(TICKERS)
+    assert stub.max_in_flight <= 2
+    # Only the first request goes out at once, the rest at 20 a second
+    assert elapsed >= (len(TICKERS) - 1) / 20 * 0.9
+
+
+def test_the_first_requests_keep_to_the_rate_too():
+    stub = StubDownloader(latency=0., jitter=0.)
+    sent = []
+
+    def download(ticker, start, end, timeout):
+        sent.append(time.monotonic())
+        return stub.download(ticker, start, end, timeout)
+
+    fetch_all(TICKERS, download, START, END, max_workers=8, requests_per_second=20, retries=0)
+    assert min(pd.Series(sorted(sent)).diff().dropna()) >= 1 / 20 * 0.9
+
+
+def test_fetch_all_retries_until_the_download_succeeds():
+    stub = StubDownloader(latency=0., jitter=0., failure_rate=0.5, seed=1)
+    downloads = fetch_all(TICKERS, stub.download, START, END, requests_per_second=None, retries=20, backoff=0.)
+
+    assert list(downloads) == TICKERS
+    assert stub.calls > len(TICKERS)
+    expected = SyntheticProvider().download('AAA', START, END)
+    pd.testing.assert_frame_equal(downloads['AAA'], expected)
+
+
+def test_fetch_all_raises_once_the_retries_run_out():
+    stub = StubDownloader(latency=0., jitter=0., failure_rate=1.)
+    with pytest.raises(RuntimeError, match="AAA, BBB") as error:
+        fetch_all(['AAA', 'BBB'], stub.download, START, END, requests_per_second=None, retries=2, backoff=0.)
+
+    assert isinstance(error.value.__cause__, ConnectionError)
+    assert stub.calls == 2 * 3
+
+
+@pytest.mark.parametrize('error', [KeyError('Close'), TypeError('bad argument')])
+def test_bugs_are_raised_as_they_are_without_a_retry(error):
+    calls = []
+
+    def download(ticker, start, end, timeout):
+        calls.append(ticker)
+        raise error
+
+    with pytest.raises(type(error)):
+        fetch_all(['AAA'], download, START, END, requests_per_second=None, retries=3, backoff=0.)
+    assert calls == ['AAA']
+
+
+def test_fetch_all_times_out_slow_downloads():
+    stub = StubDownloader(latency=0.5, jitter=0.)
+    started = time.monotonic()
+    with pytest.raises(RuntimeError) as error:
+        fetch_all(['AAA'], stub.download, START, END, requests_per_second=None, retries=1, backoff=0., timeout=0.02)
+
+    assert isinstance(error.value.__cause__, TimeoutError)
+    assert stub.calls == 2
+    # Every attempt gives up at the timeout rather than waiting for the whole latency
+    assert time.monotonic() - started < 0.5
+
+
+def test_get_data_tags_every_ticker_and_only_fetches_what_the_cache_misses(tmp_path):
+    from portfolio_tracker.helper_functions.price_cache import PriceCache
+
+    stub = StubDownloader(latency=0., jitter=0.)
+    cache = PriceCache(str(tmp_path / 'prices.sqlite'))
+    data = get_data(TICKERS[:3], START, END, provider=stub, cache=cache, requests_per_second=None)
+
+    assert sorted(data.index.get_level_values('Ticker').unique()) == TICKERS[:3]
+    assert (data['symbol'] == data.index.get_level_values('Ticker')).all()
+    assert stub.calls == 3
+
+    again = get_data(TICKERS[:3], START, END, provider=stub, cache=cache, requests_per_second=None)
+    assert stub.calls == 3
+    pd.testing.assert_frame_equal(again, data)
+
+
+def test_an_empty_yfinance_download_is_retried(monkeypatch):
+    bars = SyntheticProvider().download('AAA', START, END)
+    answers = [bars.iloc[:0], bars]
+    monkeypatch.setitem(sys.modules, 'yfinance', types.SimpleNamespace(download=lambda *args, **kwargs: answers.pop(0)))
+
+    downloads = fetch_all(['AAA'], YFinanceProvider().download, START, END, requests_per_second=None, retries=1,
+                          backoff=0.)
+    assert not answers
+    pd.testing.assert_frame_equal(downloads['AAA'], bars)
+
+
+def test_an_empty_yfinance_download_over_a_weekend_is_kept(monkeypatch):
+    empty = SyntheticProvider().download('AAA', START, END).iloc[:0]
+    monkeypatch.setitem(sys.modules, 'yfinance', types.SimpleNamespace(download=lambda *args, **kwargs: empty))
+
+    saturday, sunday = pd.Timestamp('2021-01-09'), pd.Timestamp('2021-01-10')
+    assert YFinanceProvider().download('AAA', saturday, sunday).empty
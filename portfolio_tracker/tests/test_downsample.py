@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions import step5_agg_line_chart
+from portfolio_tracker.helper_functions.downsample import downsample_line, lttb_indices, minmax_indices
+
+X = pd.date_range('2000-01-03', periods=10000, freq='D').to_numpy()
+Y = np.cumsum(np.random.default_rng(0).normal(size=10000))
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+@pytest.mark.parametrize('max_points', [2, 3, 4, 5, 100, 2000])
+def test_lines_are_capped_and_keep_their_ends(method, max_points):
+    x, y = downsample_line(X, Y, max_points, method)
+
+    assert 2 <= len(x) <= max_points
+    assert x[0] == X[0] and x[-1] == X[-1] and y[0] == Y[0] and y[-1] == Y[-1]
+    assert (np.diff(x) > np.timedelta64(0)).all()
+
+
+@pytest.mark.parametrize('max_points', [0, 1])
+def test_fewer_than_two_points_are_rejected(max_points):
+    with pytest.raises(ValueError):
+        downsample_line(X, Y, max_points)
+
+
+def test_short_lines_are_kept_whole_without_their_missing_values():
+    y = Y[:10].copy()
+    y[3] = np.nan
+    x, kept = downsample_line(X[:10], y, 100)
+    assert len(x) == 9 and not np.isnan(kept).any()
+    np.testing.assert_array_equal(lttb_indices(X[:10], Y[:10], 10), np.arange(10))
+
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    indices = minmax_indices(X, Y, 202)
+    buckets = np.minimum((np.arange(10000) / 9999 * 100).astype(int), 99)
+    for bucket in range(100):
+        members = np.flatnonzero(buckets == bucket)
+        assert members[np.argmin(Y[members])] in indices and members[np.argmax(Y[members])] in indices
+    assert Y.min() in Y[indices] and Y.max() in Y[indices]
+
+
+def test_lttb_keeps_a_lone_spike():
+    y = np.zeros(1000)
+    y[517] = 10.
+    assert 517 in lttb_indices(np.arange(1000), y, 50)
+
+
+def test_every_line_of_the_mfi_chart_is_downsampled(monkeypatch):
+    combined_df = pd.DataFrame({'Symbol': 'AAA', 'Date Snapshot': X, 'Ticker Return': Y, 'Benchmark Return': -Y})
+    drawn = {}
+    monkeypatch.setattr(step5_agg_line_chart, '_render_mfi_vs_spy',
+                        lambda sources, *args: drawn.update(sources))
+    step5_agg_line_chart.mfi_vs_spy(combined_df, 'Ticker Return', 'Benchmark Return', max_points=500)
+
+    assert set(drawn) == {'Ticker Return', 'Benchmark Return'}
+    for column, source in drawn.items():
+        assert len(source['Date Snapshot']) == len(source[column]) <= 500
+        assert source['Date Snapshot'][-1] == X[-1]
+
+
+def test_the_mfi_chart_is_drawn_with_webgl(tmp_path, monkeypatch):
+    pytest.importorskip('bokeh')
+    monkeypatch.chdir(tmp_path)
+    combined_df = pd.DataFrame({'Symbol': 'AAA', 'Date Snapshot': X, 'Ticker Return': Y, 'Benchmark Return': -Y})
+    step5_agg_line_chart.mfi_vs_spy(combined_df, 'Ticker Return', 'Benchmark Return', max_points=500,
+                                    open_browser=False)
+
+    with open(os.path.join(str(tmp_path), 'mfi_vs_spy.html')) as html:
+        assert 'webgl' in html.read()
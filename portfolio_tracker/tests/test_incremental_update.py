@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.incremental_update import IncrementalState
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+
+DAYS = pd.bdate_range('2021-01-04', periods=8)
+
+
+@pytest.fixture
+def ledger():
+    # Two lots bought on the start date, and a sale of part of one of them halfway through
+    return pd.DataFrame({'Symbol': ['AAA', 'BBB', 'AAA'], 'Qty': [15., 4., 12.], 'Type': ['Buy', 'Buy', 'Sell'],
+                         'Open Date': [DAYS[0], DAYS[0], DAYS[5]], 'Adj Cost per Share': [10., 20., 13.],
+                         'Adj Cost': [150., 80., 156.]})
+
+
+@pytest.fixture
+def prices():
+    return pd.DataFrame([{'Ticker': ticker, 'Date': day, 'Close': base + i}
+                         for ticker, base in [('AAA', 10.), ('BBB', 20.)] for i, day in enumerate(DAYS)])
+
+
+@pytest.fixture
+def benchmark():
+    return pd.DataFrame({'Date': DAYS, 'Close': 100. + np.arange(len(DAYS))})
+
+
+def test_update_matches_a_full_rebuild(tmp_path, ledger, prices, benchmark):
+    market_cal = TradingCalendar(DAYS)
+    full = IncrementalState.build(str(tmp_path / 'full'), ledger, DAYS[0], market_cal, benchmark, prices)
+
+    # The first run only has prices up to day 3, the next one picks up from there with only the newer prices
+    state = IncrementalState.build(str(tmp_path / 'daily'), ledger, DAYS[0], market_cal,
+                                   benchmark[benchmark['Date'] <= DAYS[3]], prices[prices['Date'] <= DAYS[3]])
+    assert state.end_date == DAYS[3]
+
+    state = IncrementalState.load(str(tmp_path / 'daily'))
+    assert state.is_current(ledger, DAYS[0])
+    added = state.update(ledger, market_cal, benchmark[benchmark['Date'] >= state.next_day()],
+                         prices[prices['Date'] >= state.next_day()])
+
+    assert added == 4
+    pd.testing.assert_frame_equal(state.combined_df(), full.combined_df())
+
+
+def test_update_without_new_prices_adds_nothing(tmp_path, ledger, prices, benchmark):
+    state = IncrementalState.build(str(tmp_path), ledger, DAYS[0], TradingCalendar(DAYS), benchmark, prices)
+    assert state.update(ledger, TradingCalendar(DAYS), benchmark.iloc[-1:], prices[prices['Date'] == DAYS[-1]]) == 0
+
+
+def test_editing_a_computed_transaction_invalidates_the_state(tmp_path, ledger, prices, benchmark):
+    state = IncrementalState.build(str(tmp_path), ledger, DAYS[0], TradingCalendar(DAYS), benchmark, prices)
+    edited = ledger.copy()
+    edited.loc[2, 'Qty'] = 10.
+    assert not state.is_current(edited, DAYS[0])
+    assert not state.is_current(ledger, DAYS[1])
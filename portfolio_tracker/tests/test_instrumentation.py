@@ -0,0 +1,42 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from portfolio_tracker.helper_functions.instrumentation import Instrumentation
+
+
+def test_stages_are_recorded_in_order():
+    instrumentation = Instrumentation(logger=logging.getLogger(__name__))
+    with instrumentation.stage('load', rows_in=3) as record:
+        record.rows_out = 2
+    with instrumentation.stage('render'):
+        pass
+
+    summary = instrumentation.summary()
+    assert [stage['stage'] for stage in summary] == ['load', 'render']
+    assert summary[0]['rows_in'] == 3 and summary[0]['rows_out'] == 2
+    assert all(stage['wall_seconds'] >= 0 for stage in summary)
+
+
+def test_a_stage_profiled_twice_keeps_both_profiles(tmp_path):
+    instrumentation = Instrumentation(profile=['aggregation'], profile_dir=str(tmp_path),
+                                      logger=logging.getLogger(__name__))
+    for _ in range(2):
+        with instrumentation.stage('aggregation'):
+            sum(range(1000))
+
+    profiles = [stage['profile'] for stage in instrumentation.summary()]
+    assert [os.path.basename(profile) for profile in profiles] == ['aggregation.prof', 'aggregation-2.prof']
+    assert all(os.path.exists(profile) for profile in profiles)
+
+
+def test_numpy_row_counts_are_written_as_json_ints(tmp_path):
+    instrumentation = Instrumentation(logger=logging.getLogger(__name__))
+    with instrumentation.stage('fetch', rows_in=np.int64(2)) as record:
+        record.rows_out = np.int64(3) + np.int64(4)
+    instrumentation.write(str(tmp_path / 'run_stages.json'))
+
+    with open(str(tmp_path / 'run_stages.json')) as f:
+        assert json.load(f)[0]['rows_out'] == 7
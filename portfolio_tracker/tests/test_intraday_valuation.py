@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.intraday_valuation import intraday_portfolio_calcs
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_benchmark, get_data, get_intraday_data
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+DAYS = pd.bdate_range('2021-01-04', periods=5)
+PROVIDER = SyntheticProvider(seed=5)
+FIGURES = ['Qty', 'Adj cost', 'Symbol Adj Close', 'Ticker Share Value', 'Stock Gain / (Loss)', 'Ticker Return',
+           'Benchmark Close', 'Benchmark Share Value', 'Benchmark Return']
+
+
+def transaction(symbol, qty, kind, day):
+    close = PROVIDER.download(symbol, DAYS[day], DAYS[day])['Close'].iloc[0]
+    return {'Symbol': symbol, 'Qty': qty, 'Type': kind, 'Open Date': DAYS[day], 'Adj Cost per Share': close,
+            'Adj Cost': qty * close}
+
+
+@pytest.fixture
+def inputs():
+    # Nothing is held on the first session; AAA is bought on the second and partly sold on the fourth
+    ledger = pd.DataFrame([transaction('AAA', 10., 'Buy', 1), transaction('BBB', 4., 'Buy', 2),
+                           transaction('AAA', 6., 'Sell', 3)])
+    market_cal = TradingCalendar(DAYS)
+    daily_adj_close = get_data(['AAA', 'BBB'], DAYS[0], DAYS[-1], provider=PROVIDER)[['Close']].reset_index()
+    daily_benchmark = get_benchmark(['SPY'], DAYS[0], DAYS[-1], provider=PROVIDER)[['Date', 'Close']]
+    return holding_intervals(ledger, market_cal), market_cal, daily_adj_close, daily_benchmark
+
+
+def run(inputs, session_data):
+    intervals, market_cal, daily_adj_close, daily_benchmark = inputs
+    sessions = {}
+    cube = intraday_portfolio_calcs(intervals, market_cal, '1h', daily_adj_close, daily_benchmark, session_data,
+                                    'SPY', DAYS[0], on_session=lambda session, rows: sessions.update({session: rows}))
+    return cube, sessions
+
+
+def bars(tickers, session):
+    return get_intraday_data(tickers, session, '1h', provider=PROVIDER, max_workers=1)
+
+
+def test_the_last_bar_of_every_session_agrees_with_the_daily_run(inputs):
+    intervals, market_cal, daily_adj_close, daily_benchmark = inputs
+    daily = matrix_portfolio_calcs(intervals, market_cal, daily_benchmark, daily_adj_close, DAYS[0]).to_combined_df()
+    cube, sessions = run(inputs, bars)
+
+    # on_session is called once for every session something is held on
+    assert list(sessions) == list(DAYS[1:])
+    for session, rows in sessions.items():
+        assert rows['Date Snapshot'].dt.normalize().eq(session).all()
+        last_bar = rows[rows['Date Snapshot'] == rows['Date Snapshot'].max()].sort_values(['Symbol', 'Open Date'])
+        day = daily[daily['Date Snapshot'] == session].sort_values(['Symbol', 'Open Date'])
+        assert list(last_bar['Symbol']) == list(day['Symbol'])
+        # The bars close at the daily close, up to the rounding of their walk
+        np.testing.assert_allclose(last_bar[FIGURES].to_numpy(dtype=float), day[FIGURES].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-9)
+
+    # The cube holds every bar of every session valued
+    assert len(cube.dates) == sum(rows['Date Snapshot'].nunique() for rows in sessions.values())
+
+
+def test_bars_missing_from_the_feed_carry_the_last_close_forward(inputs):
+    session = DAYS[2]
+    full = bars(['AAA', 'BBB', 'SPY'], session)
+    missing_bar = full.loc[full['Ticker'] == 'BBB', 'Date'].iloc[3]
+
+    def gappy_bars(tickers, day):
+        closes = bars(tickers, day)
+        return closes[~((closes['Ticker'] == 'BBB') & (closes['Date'] == missing_bar))]
+
+    _, sessions = run(inputs, gappy_bars)
+    rows = sessions[session]
+    bbb = rows[rows['Symbol'] == 'BBB'].set_index('Date Snapshot')['Symbol Adj Close']
+    previous_bar = full.loc[full['Ticker'] == 'BBB', 'Date'].iloc[2]
+
+    assert missing_bar in bbb.index
+    assert bbb[missing_bar] == bbb[previous_bar]
+    assert rows['Date Snapshot'].nunique() == full['Date'].nunique()
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.ledger_loader import LEDGER_COLUMNS, load_ledger, read_ledger
+
+LOG_BOOK = """﻿Index,Symbol,Security,Qty,Type,Open Date,Adj Cost per Share,Adj Cost,,
+1,MO,"Altria Group, Inc. ",1.21,Buy,23-Jul-20,41.22,50,,
+2,ABBV,ABBVIE INC. ,0.51,Buy,23-Jul-20,97.4,50,,
+3,MO,"Altria Group, Inc. ",0.5,Sell,03-Aug-20,42.1,21.05,,
+4,AYI,"ACUITY BRANDS, INC. ",0.5,Buy,04-Aug-20,100.71,50,,
+"""
+
+
+@pytest.fixture
+def log_book(tmp_path):
+    path = tmp_path / 'mfi_log_book.csv'
+    path.write_text(LOG_BOOK, encoding='utf-8')
+    return str(path)
+
+
+def test_ledger_is_read_with_its_schema(log_book):
+    ledger = read_ledger(log_book)
+    assert list(ledger.columns) == LEDGER_COLUMNS
+    assert ledger['Open Date'].tolist() == [pd.Timestamp('2020-07-23')] * 2 + [pd.Timestamp('2020-08-03'),
+                                                                                pd.Timestamp('2020-08-04')]
+    assert ledger['Symbol'].dtype == 'category' and ledger['Qty'].dtype == float
+
+
+@pytest.mark.parametrize('chunksize', [1, 3])
+def test_chunked_reads_match_a_single_read(log_book, chunksize):
+    ledger = read_ledger(log_book, chunksize=chunksize)
+    pd.testing.assert_frame_equal(ledger, read_ledger(log_book))
+    assert list(ledger['Symbol'].cat.categories) == ['ABBV', 'AYI', 'MO']
+
+
+def test_cached_ledger_is_reused_until_the_log_book_changes(tmp_path, log_book):
+    cache_path = str(tmp_path / 'ledger.pkl')
+    first = load_ledger(log_book, cache_path)
+    pd.testing.assert_frame_equal(load_ledger(log_book, cache_path), first)
+
+    with open(log_book, 'a', encoding='utf-8') as f:
+        f.write('5,MO,"Altria Group, Inc. ",1,Buy,05-Aug-20,43,43,,\n')
+    assert len(load_ledger(log_book, cache_path)) == len(first) + 1
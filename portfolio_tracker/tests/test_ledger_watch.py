@@ -0,0 +1,40 @@
+import os
+
+import pandas as pd
+
+from portfolio_tracker.helper_functions.ledger_loader import read_ledger
+from portfolio_tracker.helper_functions.ledger_watch import WatchState, watch
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_benchmark, get_data
+from portfolio_tracker.helper_functions.synthetic_ledger import synthetic_ledger, write_ledger
+
+START, END = pd.Timestamp('2021-01-04'), pd.Timestamp('2021-02-26')
+
+
+def test_watch_survives_the_log_book_going_missing(tmp_path):
+    provider = SyntheticProvider()
+    ledger = synthetic_ledger(5, 2, 0.5, START, END, provider=provider)
+    path = str(tmp_path / 'mfi_log_book.csv')
+    write_ledger(ledger.iloc[:-1], path)
+
+    daily_adj_close = get_data(list(ledger['Symbol'].unique()), START, END, provider=provider)[['Close']]
+    daily_benchmark = get_benchmark(['SPY'], START, END, provider=provider)[['Date', 'Close']]
+    state = WatchState(read_ledger(path), START, daily_adj_close.reset_index(), daily_benchmark,
+                       TradingCalendar(pd.bdate_range(START, END)))
+
+    # The log book disappears for a check, as it does while an editor moves a new version into place, and then comes
+    # back with the last row added
+    seen, checks = [], []
+
+    def stop():
+        checks.append(len(checks))
+        if len(checks) == 1:
+            os.remove(path)
+        elif len(checks) == 2:
+            write_ledger(ledger, path)
+        return bool(seen) or len(checks) > 50
+
+    watch(path, state, lambda changes, cube: seen.append(changes), interval=0.01, stop=stop)
+    added = read_ledger(path).iloc[-1]
+    assert seen == [{added['Symbol']: added['Open Date']}]
@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions import market_calendar
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar, get_trading_calendar, session_bars
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """
+    Swaps pandas_market_calendars for business days, and records every range built
+    """
+    built = []
+
+    def build_days(exchange, start, end):
+        built.append((pd.Timestamp(start), pd.Timestamp(end)))
+        days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        return days[np.is_busday(days)]
+
+    monkeypatch.setattr(market_calendar, '_build_days', build_days)
+    monkeypatch.setattr(market_calendar, '_CALENDARS', {})
+    return built
+
+
+def test_lookups_are_on_trading_days():
+    calendar = TradingCalendar(['2021-01-08', '2021-01-04', '2021-01-05', '2021-01-11'])
+
+    assert len(calendar) == 4
+    assert pd.Timestamp('2021-01-05') in calendar and pd.Timestamp('2021-01-06') not in calendar
+    assert calendar.index('2021-01-08') == 2
+    assert calendar.next_day('2021-01-06') == pd.Timestamp('2021-01-08')
+    assert calendar.previous_day('2021-01-06') == pd.Timestamp('2021-01-05')
+    assert calendar.next_day('2021-01-11', inclusive=False) is None
+    assert list(calendar.between('2021-01-05', '2021-01-08')) == \
+        [pd.Timestamp('2021-01-05'), pd.Timestamp('2021-01-08')]
+    with pytest.raises(KeyError):
+        calendar.index('2021-01-06')
+
+
+def test_only_the_range_asked_for_is_built_without_a_cache(builds):
+    calendar = get_trading_calendar('2021-01-01', '2021-03-31')
+    assert builds == [(pd.Timestamp('2021-01-01'), pd.Timestamp('2021-03-31'))]
+    assert calendar[0] == pd.Timestamp('2021-01-01') and calendar[-1] == pd.Timestamp('2021-03-31')
+
+    # Served from the memo, then widened to cover both ranges
+    get_trading_calendar('2021-02-01', '2021-02-28')
+    get_trading_calendar('2020-12-01', '2021-01-31')
+    assert builds[1:] == [(pd.Timestamp('2020-12-01'), pd.Timestamp('2021-03-31'))]
+
+
+def test_the_memo_is_rebuilt_once_older_than_max_age(builds, monkeypatch):
+    get_trading_calendar('2021-01-01', '2021-03-31', max_age=datetime.timedelta(days=30))
+    start, end, calendar, built_at = market_calendar._CALENDARS['NYSE']
+    market_calendar._CALENDARS['NYSE'] = (start, end, calendar, built_at - pd.Timedelta(days=31))
+
+    get_trading_calendar('2021-01-01', '2021-03-31', max_age=datetime.timedelta(days=30))
+    assert len(builds) == 2
+
+
+def test_the_file_cache_is_built_wide_and_read_back(builds, tmp_path, monkeypatch):
+    get_trading_calendar('2021-01-01', '2021-03-31', cache_dir=str(tmp_path))
+    assert builds[0][0] == pd.Timestamp('1990-01-01') and builds[0][1] > pd.Timestamp.now()
+
+    # A new process (an empty memo) reads the file rather than building again
+    monkeypatch.setattr(market_calendar, '_CALENDARS', {})
+    calendar = get_trading_calendar('2015-01-01', '2015-12-31', cache_dir=str(tmp_path))
+    assert len(builds) == 1
+    assert calendar.next_day('2015-01-03') == pd.Timestamp('2015-01-05')
+
+
+def test_session_bars_run_from_the_open_to_the_close():
+    bars = session_bars(TradingCalendar(['2021-01-04', '2021-01-05']), '1h')
+    assert len(bars) == 14
+    assert bars[0] == pd.Timestamp('2021-01-04 09:30') and bars[6] == pd.Timestamp('2021-01-04 15:30')
+    with pytest.raises(ValueError):
+        session_bars(TradingCalendar(['2021-01-04']), '3m')
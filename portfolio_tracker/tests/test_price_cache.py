@@ -0,0 +1,67 @@
+import datetime
+import os
+import sqlite3
+
+import pandas as pd
+
+from portfolio_tracker.helper_functions.price_cache import IntradayStore, PriceCache
+from portfolio_tracker.helper_functions.price_providers import SyntheticProvider
+
+
+def _coverage(cache):
+    with sqlite3.connect(cache.path) as conn:
+        return conn.execute("SELECT start, end FROM coverage WHERE ticker = 'AAA' ORDER BY start").fetchall()
+
+
+def test_only_the_dates_never_fetched_are_missing(tmp_path):
+    cache = PriceCache(str(tmp_path / 'prices.sqlite'))
+    bars = SyntheticProvider().download('AAA', '2021-01-04', '2021-01-29')
+    cache.store('AAA', bars.loc['2021-01-11':'2021-01-15'], '2021-01-11', '2021-01-15',
+                fetched_at=datetime.datetime(2021, 2, 1))
+
+    assert cache.missing('AAA', '2021-01-04', '2021-01-29', now=datetime.datetime(2021, 2, 1)) == \
+        [(pd.Timestamp('2021-01-04'), pd.Timestamp('2021-01-10')),
+         (pd.Timestamp('2021-01-16'), pd.Timestamp('2021-01-29'))]
+    pd.testing.assert_frame_equal(cache.load('AAA', '2021-01-11', '2021-01-15'),
+                                  bars.loc['2021-01-11':'2021-01-15'].astype(float), check_freq=False)
+
+
+def test_coverage_stays_one_row_however_many_runs_store(tmp_path):
+    cache = PriceCache(str(tmp_path / 'prices.sqlite'))
+    provider = SyntheticProvider()
+    # A daily run for every day of a month, each fetching the day before, plus an overlapping backfill
+    for day in pd.date_range('2021-01-02', '2021-01-31'):
+        fetched = day - pd.Timedelta(days=1)
+        cache.store('AAA', provider.download('AAA', fetched, fetched), fetched, fetched, fetched_at=day)
+    cache.store('AAA', provider.download('AAA', '2020-12-20', '2021-01-10'), '2020-12-20', '2021-01-10',
+                fetched_at=datetime.datetime(2021, 2, 1))
+
+    assert _coverage(cache) == [('2020-12-20', '2021-01-30')]
+    assert cache.missing('AAA', '2020-12-20', '2021-01-31', now=datetime.datetime(2021, 2, 1)) == \
+        [(pd.Timestamp('2021-01-31'), pd.Timestamp('2021-01-31'))]
+
+
+def test_bars_fetched_on_their_own_day_go_stale(tmp_path):
+    cache = PriceCache(str(tmp_path / 'prices.sqlite'), staleness=datetime.timedelta(hours=12))
+    bars = SyntheticProvider().download('AAA', '2021-01-04', '2021-01-08')
+    cache.store('AAA', bars, '2021-01-04', '2021-01-08', fetched_at=datetime.datetime(2021, 1, 8, 12))
+
+    assert cache.missing('AAA', '2021-01-04', '2021-01-08', now=datetime.datetime(2021, 1, 8, 18)) == []
+    assert cache.missing('AAA', '2021-01-04', '2021-01-08', now=datetime.datetime(2021, 1, 9, 6)) == \
+        [(pd.Timestamp('2021-01-08'), pd.Timestamp('2021-01-08'))]
+
+    # Fetching the day again once it has closed settles it, and the two rows merge into one
+    cache.store('AAA', bars.loc['2021-01-08':], '2021-01-08', '2021-01-08', fetched_at=datetime.datetime(2021, 1, 9, 6))
+    assert _coverage(cache) == [('2021-01-04', '2021-01-08')]
+
+
+def test_intraday_bars_are_kept_once_written_after_the_close_in_exchange_time(tmp_path):
+    store = IntradayStore(str(tmp_path))
+    store.store('AAA', '2021-01-04', '1h', SyntheticProvider().download_intraday('AAA', '2021-01-04', '1h'))
+    path = store.file('AAA', '2021-01-04', '1h')
+
+    # 20:30 UTC is 15:30 in New York, half an hour before the close, and 21:30 UTC half an hour after it
+    os.utime(path, (pd.Timestamp('2021-01-04 20:30', tz='UTC').timestamp(),) * 2)
+    assert not store.has('AAA', '2021-01-04', '1h')
+    os.utime(path, (pd.Timestamp('2021-01-04 21:30', tz='UTC').timestamp(),) * 2)
+    assert store.has('AAA', '2021-01-04', '1h')
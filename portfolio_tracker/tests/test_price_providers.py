@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.concurrent_fetch import StubDownloader
+from portfolio_tracker.helper_functions.price_providers import PRICE_COLUMNS, DirectoryProvider, IntradayProvider, \
+    PriceProvider, SyntheticProvider, make_provider
+from portfolio_tracker.helper_functions.step1_stocks_get_data import get_data, get_intraday_data
+
+
+def test_a_provider_has_to_implement_download():
+    with pytest.raises(TypeError):
+        PriceProvider()
+
+    class Incomplete(PriceProvider):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_only_intraday_providers_give_intraday_bars(tmp_path):
+    class DailyOnly(IntradayProvider):
+        def download(self, ticker, start, end, timeout=None):
+            return SyntheticProvider().download(ticker, start, end)
+
+    with pytest.raises(TypeError):
+        DailyOnly()
+    with pytest.raises(TypeError):
+        get_intraday_data(['AAA'], '2021-01-04', '1h', provider=DirectoryProvider(str(tmp_path)))
+
+    bars = get_intraday_data(['AAA'], '2021-01-04', '1h', provider=SyntheticProvider())
+    assert list(bars.columns) == ['Ticker', 'Date', 'Close'] and len(bars) == 7
+
+
+def test_synthetic_bars_are_the_same_whatever_range_is_asked_for():
+    provider = SyntheticProvider(seed=3)
+    wide = provider.download('AAA', '2020-01-01', '2020-12-31')
+    narrow = provider.download('AAA', '2020-06-01', '2020-06-30')
+
+    assert list(wide.columns) == PRICE_COLUMNS
+    pd.testing.assert_frame_equal(narrow, wide.loc['2020-06-01':'2020-06-30'])
+    assert not provider.download('BBB', '2020-06-01', '2020-06-30')['Close'].equals(narrow['Close'])
+
+
+def test_directory_provider_reads_back_what_it_wrote(tmp_path):
+    bars = SyntheticProvider().download('AAA', '2020-01-01', '2020-03-31')
+    provider = make_provider('directory', path=str(tmp_path))
+    provider.write('AAA', bars)
+
+    pd.testing.assert_frame_equal(provider.download('AAA', '2020-02-01', '2020-02-29'),
+                                  bars.loc['2020-02-01':'2020-02-29'], check_freq=False, check_dtype=False)
+
+
+def test_unknown_providers_are_rejected():
+    with pytest.raises(ValueError):
+        make_provider('bloomberg')
+    with pytest.raises(ValueError):
+        DirectoryProvider('.', file_format='xlsx')
+
+
+def test_a_rate_limit_of_zero_turns_the_limit_off():
+    class Limited(StubDownloader):
+        requests_per_second = 1.
+
+    stub = Limited(latency=0., jitter=0.)
+    data = get_data(['AAA', 'BBB', 'CCC'], '2021-01-04', '2021-01-08', provider=stub, max_workers=1,
+                    requests_per_second=0)
+    # At the provider's own limit, the second and third downloads would have waited a second each
+    assert stub.calls == 3
+    assert len(data) == 15
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions import result_store
+from portfolio_tracker.helper_functions.result_store import ResultFormat, read_results, write_results
+
+
+@pytest.fixture
+def results():
+    days = pd.bdate_range('2021-01-28', '2021-03-03')
+    return pd.DataFrame({'Date Snapshot': days, 'Symbol': 'AAA', 'Ticker Return': range(len(days))})
+
+
+def test_result_format_is_abstract():
+    with pytest.raises(TypeError):
+        ResultFormat()
+
+
+def test_default_format_falls_back_to_csv_without_pyarrow(monkeypatch, tmp_path, results):
+    monkeypatch.setattr(result_store, 'DEFAULT_FORMAT', 'csv')
+    assert write_results(results, str(tmp_path / 'risk')) == [str(tmp_path / 'risk.csv')]
+
+
+def test_partitions_outside_the_range_are_not_read(tmp_path, results):
+    path = str(tmp_path / 'combined')
+    written = write_results(results, path, 'csv', partition_by='month')
+    assert [file.rsplit('/', 1)[-1] for file in written] == ['2021-01.csv', '2021-02.csv', '2021-03.csv']
+
+    february = read_results(path, columns=['Ticker Return'], start='2021-02-01', end='2021-02-28')
+    expected = results[results['Date Snapshot'].dt.month == 2]['Ticker Return'].reset_index(drop=True)
+    pd.testing.assert_series_equal(february['Ticker Return'], expected)
+
+
+def test_rewriting_a_dataset_in_the_other_layout_replaces_it(tmp_path, results):
+    path = str(tmp_path / 'out' / 'res')
+    write_results(results, path, 'csv', partition_by='month')
+    write_results(results.iloc[:5], path, 'csv')
+    assert not (tmp_path / 'out' / 'res').exists()
+    pd.testing.assert_frame_equal(read_results(path), results.iloc[:5])
+
+    write_results(results, path, 'csv', partition_by='month')
+    assert not (tmp_path / 'out' / 'res.csv').exists()
+    pd.testing.assert_frame_equal(read_results(path), results)
+
+
+def test_an_empty_directory_left_behind_falls_back_to_the_single_file(tmp_path, results):
+    path = str(tmp_path / 'res')
+    write_results(results, path, 'csv')
+    (tmp_path / 'res').mkdir()
+    pd.testing.assert_frame_equal(read_results(path, start='2021-02-01'),
+                                  results[results['Date Snapshot'] >= '2021-02-01'].reset_index(drop=True))
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.risk_metrics import rolling_risk
+
+DAYS = pd.bdate_range('2021-01-04', periods=7)
+
+
+def returns_of(values):
+    growth = pd.Series(values, index=DAYS)
+    return growth.pct_change().to_frame('AAA'), pd.Series(0.01, index=DAYS)
+
+
+def brute_force_max_drawdown(values, window):
+    max_drawdowns = []
+    for last in range(len(values)):
+        first = max(last - window + 1, 0)
+        max_drawdowns.append(min(values[day] / max(values[first:day + 1]) - 1 for day in range(first, last + 1)))
+    return max_drawdowns
+
+
+def test_max_drawdown_only_counts_highs_within_the_window():
+    # Up to a high of 1.1 on day 1, down to 0.9 on day 3, and back up from there
+    values = [1., 1.1, .99, .9, .95, 1., 1.05]
+    returns, benchmark_returns = returns_of(values)
+    figures = rolling_risk(returns, benchmark_returns, 3, min_periods=1)
+
+    # The first day has no return, so no figures either
+    assert np.isnan(figures['Max Drawdown'][0, 0])
+    np.testing.assert_allclose(figures['Max Drawdown'][1:, 0], brute_force_max_drawdown(values, 3)[1:])
+    # By day 5 the high of day 1 has left the window, which has only risen since day 3
+    assert figures['Max Drawdown'][3, 0] == pytest.approx(.9 / 1.1 - 1)
+    assert figures['Max Drawdown'][5, 0] == 0.
+    assert figures['Drawdown'][4, 0] == pytest.approx(.95 / .99 - 1)
+
+
+def test_max_drawdown_matches_a_brute_force_on_a_random_walk():
+    rng = np.random.default_rng(0)
+    values = np.exp(np.cumsum(rng.normal(0., .02, 60)))
+    values /= values[0]
+    growth = pd.Series(values, index=pd.bdate_range('2021-01-04', periods=60))
+    figures = rolling_risk(growth.pct_change().to_frame('AAA'), pd.Series(0., index=growth.index), 10, min_periods=1)
+
+    np.testing.assert_allclose(figures['Max Drawdown'][1:, 0], brute_force_max_drawdown(list(values), 10)[1:])
+
+
+def test_window_figures_match_pandas():
+    rng = np.random.default_rng(1)
+    index = pd.bdate_range('2021-01-04', periods=80)
+    returns = pd.DataFrame(rng.normal(0., .01, (80, 2)), index=index, columns=['AAA', 'BBB'])
+    benchmark_returns = pd.Series(rng.normal(0., .01, 80), index=index)
+    figures = rolling_risk(returns, benchmark_returns, 21)
+
+    rolling = returns.rolling(21)
+    np.testing.assert_allclose(figures['Volatility'][20:], rolling.std().to_numpy()[20:] * np.sqrt(252))
+    np.testing.assert_allclose(figures['Return'][20:], (1 + returns).rolling(21).apply(np.prod).to_numpy()[20:] - 1)
+    np.testing.assert_allclose(figures['Beta'][20:, 0], (rolling.cov(benchmark_returns)['AAA'] /
+                                                         benchmark_returns.rolling(21).var()).to_numpy()[20:])
+    assert np.isnan(figures['Volatility'][:20]).all()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.risk_metrics import PORTFOLIO
+from portfolio_tracker.helper_functions.simulation import BENCHMARK, FAN_QUANTILES, outcome_summary, \
+    paired_log_returns, simulate
+
+DAYS = pd.bdate_range('2021-01-04', periods=120)
+
+
+@pytest.fixture(scope='module')
+def combined_df():
+    # Two tickers held throughout, 10 and 5 shares, and a benchmark, all on random walks
+    rng = np.random.default_rng(0)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.01, (len(DAYS), 3)), axis=0))
+    rows = [{'Symbol': symbol, 'Date Snapshot': day, 'Qty': qty, 'Symbol Adj Close': closes[i, column],
+             'Benchmark Close': closes[i, 2]}
+            for column, (symbol, qty) in enumerate([('AAA', 10.), ('BBB', 5.)]) for i, day in enumerate(DAYS)]
+    return pd.DataFrame(rows)
+
+
+def test_paths_are_resampled_from_the_value_of_the_shares_held(combined_df):
+    log_returns = paired_log_returns(combined_df)
+    value = combined_df.assign(Value=combined_df['Qty'] * combined_df['Symbol Adj Close']) \
+        .groupby('Date Snapshot')['Value'].sum()
+    benchmark = combined_df.groupby('Date Snapshot')['Benchmark Close'].first()
+
+    assert log_returns.shape == (len(DAYS) - 1, 2)
+    np.testing.assert_allclose(log_returns[:, 0], np.diff(np.log(value.to_numpy())))
+    np.testing.assert_allclose(log_returns[:, 1], np.diff(np.log(benchmark.to_numpy())))
+
+
+@pytest.mark.parametrize('method', ['bootstrap', 'normal'])
+def test_the_same_seed_gives_the_same_paths_whatever_the_workers(combined_df, method):
+    kwargs = dict(horizon=63, n_paths=250, method=method, block_length=10, seed=7, n_points=20, chunk_paths=100)
+    fan, final = simulate(combined_df, max_workers=1, **kwargs)
+    pooled_fan, pooled_final = simulate(combined_df, max_workers=2, **kwargs)
+
+    pd.testing.assert_frame_equal(final, pooled_final)
+    pd.testing.assert_frame_equal(fan, pooled_fan)
+    assert not final.equals(simulate(combined_df, max_workers=1, **dict(kwargs, seed=8))[1])
+
+
+def test_fan_and_outcomes(combined_df):
+    fan, final = simulate(combined_df, horizon=63, n_paths=500, block_length=10, n_points=20, max_workers=1)
+
+    assert list(final.columns) == [PORTFOLIO, BENCHMARK] and len(final) == 500
+    assert list(fan['Series'].unique()) == [PORTFOLIO, BENCHMARK, 'Excess']
+    assert list(fan.columns[2:]) == ['{:g}%'.format(100 * quantile) for quantile in FAN_QUANTILES]
+    # Every series runs to the end of the horizon, and its bands are ordered from the outside in
+    assert fan['Days Ahead'].max() == 63 and fan.groupby('Series').size().nunique() == 1
+    assert (np.diff(fan.iloc[:, 2:].to_numpy(), axis=1) >= 0).all()
+
+    last = fan[fan['Days Ahead'] == 63].set_index('Series')
+    summary = outcome_summary(final)
+    assert summary['Paths'] == 500
+    assert summary['Median Return'] == pytest.approx(last.loc[PORTFOLIO, '50%'], rel=1e-5)
+    assert summary['Beats Benchmark'] == pytest.approx((final[PORTFOLIO] > final[BENCHMARK]).mean())
+
+
+def test_too_short_a_history_or_an_unknown_method_is_rejected(combined_df):
+    with pytest.raises(ValueError):
+        simulate(combined_df, method='garch')
+    with pytest.raises(ValueError):
+        simulate(combined_df[combined_df['Date Snapshot'] < DAYS[5]], block_length=21, max_workers=1)
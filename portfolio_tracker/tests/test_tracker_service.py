@@ -0,0 +1,64 @@
+import http.client
+import http.server
+import json
+import threading
+
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.aggregation_cube import AggregationCube
+from portfolio_tracker.helper_functions.tracker_service import TrackerRequestHandler
+
+
+class StubService:
+    """
+    Answers from a fixed cube, and fails on /status the way a bug would
+    """
+
+    def __init__(self):
+        self.combined_df = pd.DataFrame({'Symbol': ['AAA', 'BBB'], 'Date Snapshot': pd.Timestamp('2021-01-04'),
+                                         'Ticker Return': [0.1, 0.3]})
+        self.cube = AggregationCube.build(self.combined_df)
+
+    def portfolio_series(self, metrics=None, how='sum', start=None, end=None):
+        return self.cube.by_date(metrics or ['Ticker Return'], how)
+
+    def ticker_series(self, symbol, **series):
+        raise LookupError("{} isn't held in the portfolio".format(symbol))
+
+    def status(self):
+        raise RuntimeError("Something nobody expected")
+
+
+@pytest.fixture
+def server():
+    handler = type('Handler', (TrackerRequestHandler,), {'service': StubService()})
+    with http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+
+
+def get(server, path):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_portfolio_series(server):
+    status, body = get(server, '/portfolio?how=mean')
+    assert status == 200 and body[0]['Ticker Return'] == pytest.approx(0.2)
+
+
+def test_unknown_metric_is_a_bad_request(server):
+    assert get(server, '/portfolio?metrics=Nope') == (400, {'error': "Unknown metric Nope"})
+
+
+def test_unknown_ticker_is_not_found(server):
+    assert get(server, '/tickers/ZZZ')[0] == 404
+
+
+def test_unexpected_errors_are_answered_with_a_500(server):
+    assert get(server, '/status') == (500, {'error': "Internal error"})
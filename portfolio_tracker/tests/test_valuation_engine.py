@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from portfolio_tracker.helper_functions.compact_frames import compact_combined_df
+from portfolio_tracker.helper_functions.market_calendar import TradingCalendar
+from portfolio_tracker.helper_functions.step3_time_fill_daily import holding_intervals
+from portfolio_tracker.helper_functions.valuation_engine import matrix_portfolio_calcs
+
+DAYS = pd.bdate_range('2021-01-04', periods=5)
+
+
+def transaction(symbol, qty, kind, day, cost):
+    return {'Symbol': symbol, 'Qty': qty, 'Type': kind, 'Open Date': DAYS[day], 'Adj Cost per Share': cost,
+            'Adj Cost': qty * cost}
+
+
+@pytest.fixture
+def ledger():
+    # AAA: two lots, with a sale that empties the first and eats into the second. BBB: a single lot, never sold
+    return pd.DataFrame([transaction('AAA', 10., 'Buy', 0, 10.), transaction('BBB', 4., 'Buy', 1, 20.),
+                         transaction('AAA', 5., 'Buy', 2, 12.), transaction('AAA', 12., 'Sell', 3, 13.)])
+
+
+@pytest.fixture
+def prices():
+    closes = {'AAA': [10., 11., 12., 13., 14.], 'BBB': [20., 21., 22., 23., 24.]}
+    return pd.DataFrame([{'Ticker': ticker, 'Date': day, 'Close': close[i]}
+                         for ticker, close in closes.items() for i, day in enumerate(DAYS)])
+
+
+@pytest.fixture
+def benchmark():
+    return pd.DataFrame({'Date': DAYS, 'Close': [100., 101., 102., 103., 104.]})
+
+
+def combined(ledger, prices, benchmark):
+    # Every transaction is on or after the start date, so the ledger is already the active portfolio
+    market_cal = TradingCalendar(DAYS)
+    intervals = holding_intervals(ledger, market_cal)
+    return matrix_portfolio_calcs(intervals, market_cal, benchmark, prices, DAYS[0]).to_combined_df()
+
+
+def held(combined_df):
+    return {(row['Symbol'], DAYS.get_loc(row['Open Date']), DAYS.get_loc(row['Date Snapshot'])): row['Qty']
+            for _, row in combined_df.iterrows()}
+
+
+def test_sales_are_netted_off_fifo(ledger, prices, benchmark):
+    # The sale of 12 empties the first AAA lot on day 3 and leaves 3 of the second
+    assert held(combined(ledger, prices, benchmark)) == {
+        ('AAA', 0, 0): 10., ('AAA', 0, 1): 10., ('AAA', 0, 2): 10.,
+        ('AAA', 2, 2): 5., ('AAA', 2, 3): 3., ('AAA', 2, 4): 3.,
+        ('BBB', 1, 1): 4., ('BBB', 1, 2): 4., ('BBB', 1, 3): 4., ('BBB', 1, 4): 4.}
+
+
+def test_daily_values(ledger, prices, benchmark):
+    combined_df = combined(ledger, prices, benchmark)
+    row = combined_df[(combined_df['Symbol'] == 'AAA') & (combined_df['Date Snapshot'] == DAYS[4])].iloc[0]
+
+    # The lot left after the sale: 3 shares bought at 12, now closing at 14, against a benchmark up from 100 to 104.
+    # Lots opened on the first day of the price data are costed at its close, which for AAA is also 10
+    assert row['Ticker Share Value'] == pytest.approx(42.)
+    assert row['Adj cost'] == pytest.approx(36.)
+    assert row['Stock Gain / (Loss)'] == pytest.approx(6.)
+    assert row['Ticker Return'] == pytest.approx(14. / 12. - 1)
+    assert row['Benchmark Return'] == pytest.approx(0.04)
+    assert row['Benchmark Share Value'] == pytest.approx(36. / 100. * 104.)
+    assert row['Ticker End Date Close'] == 14. and row['Ticker Start Date Close'] == 10.
+
+
+def test_duplicate_price_rows_keep_the_last_close(ledger, prices, benchmark):
+    # A second close for a day, e.g. from overlapping downloads, is settled in favour of the last one
+    duplicated = pd.concat([prices, pd.DataFrame({'Ticker': ['BBB'], 'Date': [DAYS[2]], 'Close': [30.]})],
+                           ignore_index=True)
+    combined_df = combined(ledger, duplicated, benchmark)
+    expected = combined(ledger, prices.assign(Close=np.where((prices['Ticker'] == 'BBB') &
+                                                             (prices['Date'] == DAYS[2]), 30., prices['Close'])),
+                        benchmark)
+    pd.testing.assert_frame_equal(combined_df, expected)
+    assert combined_df.loc[(combined_df['Symbol'] == 'BBB') & (combined_df['Date Snapshot'] == DAYS[2]),
+                           'Symbol Adj Close'].item() == 30.
+
+
+def test_matrices_line_up_with_days_and_tickers(ledger, prices, benchmark):
+    market_cal = TradingCalendar(DAYS)
+    valuation = matrix_portfolio_calcs(holding_intervals(ledger, market_cal), market_cal, benchmark, prices, DAYS[0])
+
+    assert list(valuation.tickers) == ['AAA', 'BBB']
+    np.testing.assert_array_equal(valuation.qty, [[10., 0.], [10., 4.], [15., 4.], [3., 4.], [3., 4.]])
+    np.testing.assert_allclose(valuation.ticker_share_value[:, 0], [100., 110., 180., 39., 42.])
+    np.testing.assert_allclose(valuation.benchmark_return, [0., 0.01, 0.02, 0.03, 0.04])
+
+    # No cost held means no return, rather than a division by zero
+    assert np.isnan(valuation.ticker_return[0, 1])
+    assert valuation.ticker_return[1, 1] == pytest.approx(21. / 20. - 1)
+
+
+@pytest.mark.parametrize('float32', [False, True])
+def test_compact_tables_match_compacting_the_combined_dataframe(ledger, prices, benchmark, float32):
+    market_cal = TradingCalendar(DAYS)
+    valuation = matrix_portfolio_calcs(holding_intervals(ledger, market_cal), market_cal, benchmark, prices, DAYS[0])
+    daily, lots = valuation.to_combined_df(compact=True, float32=float32)
+    expected_daily, expected_lots = compact_combined_df(valuation.to_combined_df(), float32=float32)
+
+    pd.testing.assert_frame_equal(daily, expected_daily)
+    pd.testing.assert_frame_equal(lots, expected_lots)
@@ -0,0 +1,9 @@
+import sys
+
+from portfolio_tracker.cli import main
+
+# Keeps the MFI vs benchmarks chart up to date while you edit the log book, e.g.
+#   python -m portfolio_tracker.watch --start 2020-07-27 --benchmarks SPY QQQ IWM
+# The same as python -m portfolio_tracker watch, which takes the same inputs as the other commands
+if __name__ == '__main__':
+    main(['watch'] + sys.argv[1:])